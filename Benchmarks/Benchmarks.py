@@ -0,0 +1,469 @@
+# benchmarks for the hot paths of the midi controller.
+# usage: python Benchmarks.py <benchmark name> [repeat]
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import yaml
+
+import DoublyLinkedList
+import EventLog
+import FuncExpression
+import MIDI
+import MidiClock
+import MidiTransport
+import PartSongSet
+import PedalConfig
+import Sequence
+
+# keep the per message logging of the modules under test out of the timings
+logging.getLogger(MIDI.MIDI.__module__).setLevel(logging.WARNING)
+logging.getLogger(PedalConfig.MessageTable.__module__).setLevel(logging.WARNING)
+logging.getLogger(MidiClock.MidiClock.__module__).setLevel(logging.WARNING)
+
+SONG_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "PartSongSet", "Songs")
+MIDI_PEDAL_CONF_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Main", "Conf",
+                                      "MidiPedals")
+
+
+def load_pedal_confs():
+    """ returns [(pedal name, pedal config dict)] for the shipped pedal configs """
+    pedal_confs = []
+    for pedal_conf in sorted(os.listdir(MIDI_PEDAL_CONF_FOLDER)):
+        if pedal_conf[-5:] == ".yaml":
+            with open(os.path.join(MIDI_PEDAL_CONF_FOLDER, pedal_conf), 'r') as ymlfile:
+                pedal_confs.append((pedal_conf[:-5], yaml.full_load(ymlfile)))
+    return pedal_confs
+
+
+def pedal_conf_burst(pedal_conf, channel):
+    """ everything a full resync sends to a pedal: engage, a preset and every parameter the config knows """
+    midi = MIDI.MIDI(channel)
+    burst = []
+    for action_name, table in sorted(PedalConfig.compile_actions(pedal_conf, midi.cc_channel,
+                                                                 midi.pc_channel).items()):
+        if action_name in ["Engage", "Set Preset"]:
+            burst.extend(sorted(table.table.values())[-1])
+    param_index, unusable = PedalConfig.compile_param_index(pedal_conf, midi.cc_channel)
+    for param_name, table in sorted(param_index.items()):
+        if table.name == param_name and table.table:  # skip the short names of grouped parameters
+            burst.extend(sorted(table.table.values())[-1])
+    return burst
+
+
+def sample_part_change_burst(channels=6):
+    """ what a part change on a full pedal board looks like: bank select, program change, engage and a couple of
+    knob ccs for each channel """
+    burst = []
+    for channel in range(1, channels + 1):
+        midi = MIDI.MIDI(channel)
+        burst.append(midi.cc_channel + chr(0) + chr(0))
+        burst.append(midi.pc_channel + chr(channel))
+        burst.append(midi.cc_channel + chr(102) + chr(127))
+        burst.append(midi.cc_channel + chr(15) + chr(64))
+        burst.append(midi.cc_channel + chr(16) + chr(32))
+    return burst
+
+
+def latency_stats(latencies, byte_count, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "bytes/sec": byte_count / elapsed if elapsed else 0.0,
+        "mean ms": 1000.0 * sum(latencies) / len(latencies),
+        "p99 ms": 1000.0 * latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "max ms": 1000.0 * latencies[-1]
+    }
+
+
+def time_calls(func, items, repeat):
+    """ call func on every item, repeat times over. returns the latency of each call and the total elapsed time """
+    latencies = []
+    start = time.time()
+    for _ in range(repeat):
+        for item in items:
+            call_start = time.time()
+            func(item)
+            latencies.append(time.time() - call_start)
+    return latencies, time.time() - start
+
+
+def print_results(title, rows):
+    print(title)
+    for name, stats in rows:
+        print("  {0:<28} {1:>12.1f} bytes/sec  mean {2:>8.3f} ms  p99 {3:>8.3f} ms  max {4:>8.3f} ms".format(
+            name, stats["bytes/sec"], stats["mean ms"], stats["p99 ms"], stats["max ms"]))
+
+
+def run_write_benchmark(title, transports, repeat):
+    """ time MIDI.write one message at a time and MIDI.write_burst a whole burst at a time on each transport """
+    burst = sample_part_change_burst()
+    burst_bytes = sum(len(msg) for msg in burst)
+    rows = []
+    saved_transport = MIDI.MIDI.transport
+    try:
+        for name, transport in transports:
+            MIDI.MIDI.transport = transport
+            latencies, elapsed = time_calls(MIDI.MIDI.write, burst, repeat)
+            rows.append((name + " (per message)", latency_stats(latencies, burst_bytes * repeat, elapsed)))
+            latencies, elapsed = time_calls(MIDI.MIDI.write_burst, [burst], repeat)
+            rows.append((name + " (whole burst)", latency_stats(latencies, burst_bytes * repeat, elapsed)))
+    finally:
+        MIDI.MIDI.transport = saved_transport
+    print_results(title + ": " + str(len(burst)) + " messages, " + str(burst_bytes) + " bytes per burst", rows)
+
+
+def benchmark_midi_write(repeat=20):
+    """ per byte i2c path against block transfer. needs the arduino on the i2c bus """
+    run_write_benchmark("midi write (i2c)", [
+        ("per byte", MidiTransport.I2cArduinoTransport(block_transfer=False)),
+        ("block", MidiTransport.I2cArduinoTransport(block_transfer=True))
+    ], repeat)
+
+
+def benchmark_transport(repeat=200):
+    """ the midi output path on the loopback transport, in memory and through a pty. runs on any linux box """
+    memory = MidiTransport.LoopbackTransport()
+    pty = MidiTransport.LoopbackTransport(use_pty=True)
+    run_write_benchmark("midi write (loopback)", [("loopback memory", memory), ("loopback pty", pty)], repeat)
+    burst = sample_part_change_burst()
+    burst_bytes = sum(len(msg) for msg in burst)
+    saved_transport = MIDI.MIDI.transport
+    MIDI.MIDI.transport = pty
+    try:
+        # how long until the other end of the pty has each message
+        pty.clear()
+        latencies = []
+        start = time.time()
+        for _ in range(repeat):
+            for msg in burst:
+                expected = len(pty.received) + len(msg)
+                write_start = time.time()
+                MIDI.MIDI.write(msg)
+                pty.wait_for(expected)
+                latencies.append(time.time() - write_start)
+        rows = [("pty write -> read", latency_stats(latencies, burst_bytes * repeat, time.time() - start))]
+        # the same bursts through the output queue and the writer thread, timed until the last byte is read back
+        pty.clear()
+        MIDI.MIDI.start_output_queue()
+        latencies = []
+        start = time.time()
+        for _ in range(repeat):
+            send_start = time.time()
+            MIDI.MIDI.send_burst(burst)
+            latencies.append(time.time() - send_start)
+        MIDI.MIDI.flush()
+        pty.wait_for(burst_bytes * repeat)
+        rows.append(("queued burst -> read", latency_stats(latencies, burst_bytes * repeat, time.time() - start)))
+        MIDI.MIDI.stop_output_queue()
+    finally:
+        MIDI.MIDI.transport = saved_transport
+        memory.close()
+        pty.close()
+    print_results("midi wire latency (loopback pty)", rows)
+
+
+def benchmark_running_status(repeat=1000):
+    """ bytes on the wire with and without running status for a full resync of each shipped pedal config, checked
+    by decoding the encoded burst back into the original messages """
+    print("running status: full resync burst of each pedal in " + MIDI_PEDAL_CONF_FOLDER)
+    board_burst = []
+    for channel, (pedal_name, pedal_conf) in enumerate(load_pedal_confs(), 1):
+        burst = pedal_conf_burst(pedal_conf, channel)
+        board_burst.extend(burst)
+        print_running_status_row(pedal_name, burst)
+    print_running_status_row("whole board", board_burst)
+    start = time.time()
+    for _ in range(repeat):
+        MIDI.running_status_encode(board_burst)
+    print("  encode: {0:.1f} us per whole board burst".format(1000000.0 * (time.time() - start) / repeat))
+
+
+def print_running_status_row(name, burst):
+    encoded = MIDI.running_status_encode(burst)
+    if MIDI.running_status_decode(encoded) != burst:
+        raise AssertionError("running status round trip failed for " + name)
+    raw_bytes = sum(len(msg) for msg in burst)
+    print("  {0:<16} {1:>5} messages {2:>6} bytes -> {3:>6} bytes ({4:.1f}% saved, round trip ok)".format(
+        name, len(burst), raw_bytes, len(encoded), 100.0 * (raw_bytes - len(encoded)) / raw_bytes if raw_bytes else 0))
+
+
+def benchmark_midi_clock(repeat=3):
+    """ midi clock through the output queue onto the loopback transport for 'repeat' seconds per tempo: how late the
+    ticks go out, and the tempo a pedal counting the ticks would see """
+    MIDI.MIDI.set_transport(MidiTransport.LoopbackTransport())
+    MIDI.MIDI.start_output_queue()
+    print("midi clock: " + str(repeat) + " s per tempo on the loopback transport")
+    try:
+        for bpm in [60, 120, 240, 120.5]:
+            MIDI.MIDI.get_transport().clear()
+            clock = MidiClock.MidiClock(MIDI.MIDI.send, bpm, send_start=False)
+            clock.start()
+            start = time.time()
+            clock.start_clock()
+            time.sleep(repeat)
+            clock.stop()
+            clock.join()
+            elapsed = time.time() - start
+            MIDI.MIDI.flush()
+            ticks = MIDI.MIDI.get_transport().received.count(MidiClock.CLOCK_TICK)
+            stats = clock.jitter.summary()
+            print("  {0:>6.1f} bpm {1:>5} ticks, seen as {2:>6.2f} bpm  late mean {3:.3f} ms  p50 {4:.3f} ms  "
+                  "p99 {5:.3f} ms  max {6:.3f} ms  {7} resyncs".format(
+                      bpm, ticks, (ticks - 1) * 60.0 / (MidiClock.PPQN * elapsed), stats['mean_ms'], stats['p50_ms'],
+                      stats['p99_ms'], stats['max_ms'], stats['resyncs']))
+    finally:
+        MIDI.MIDI.stop_output_queue()
+        MIDI.MIDI.close_transport()
+
+
+def conf_funcs(conf):
+    """ every 'func' string in a pedal config, however deep it is nested """
+    funcs = []
+    if isinstance(conf, dict):
+        for key, value in conf.items():
+            if key == 'func' and isinstance(value, str):
+                funcs.append(value)
+            else:
+                funcs.extend(conf_funcs(value))
+    return funcs
+
+
+def eval_func(func, v):
+    """ what check_for_func used to do on every call """
+    f = eval('lambda x: ' + func)
+    return f(v)
+
+
+def benchmark_func_expression(repeat=20):
+    """ the func fields of the shipped pedal configs: eval on every call, as check_for_func used to, against the
+    compiled expression inside (0 - 127, lookup table) and outside its lookup table """
+    funcs = sorted(set(func for pedal_name, pedal_conf in load_pedal_confs() for func in conf_funcs(pedal_conf)))
+    funcs.append("min(127, max(0, x * 2 - 3))")
+    print("func expressions: " + str(repeat) + " calls per value, us per call")
+    print("  {0:<54} {1:>9} {2:>9} {3:>9}".format("func", "eval", "table", "no table"))
+    for func in funcs:
+        expression = FuncExpression.compile_func(func)
+        inside = [x for x in range(0, 128) if x in expression.lut]
+        outside = range(128, 3000, 23)
+        timings = []
+        for call, values in [(lambda v: eval_func(func, v), inside), (expression, inside), (expression.evaluate,
+                                                                                           outside)]:
+            start = time.time()
+            for _ in range(repeat):
+                for v in values:
+                    call(v)
+            timings.append(1000000.0 * (time.time() - start) / (repeat * len(values)))
+        print("  {0:<54} {1:>9.2f} {2:>9.2f} {3:>9.2f}".format(func, *timings))
+
+
+def benchmark_event_log(repeat=100000):
+    """ what a log call costs the caller: with its level off, the way the hot paths log (lazy arguments, level check
+    first) against building the message up front, and with the level on, into the ring buffer and the writer thread """
+    logger = EventLog.get_logger("Benchmarks.event_log")
+    saved_level = EventLog.get_level()
+    EventLog.configure(level="info", console_on=False)
+    seq = 2
+    change_dict = {'cc': 14, 'min': 0, 'max': 127, 'dict': {'TS808': 20, 'Plexi': 21}}
+    calls = [
+        ("empty loop", lambda: None),
+        ("debug off, lazy", lambda: logger.debug("sequence: %s", seq)),
+        ("debug off, eager", lambda: logger.debug("sequence: " + str(seq))),
+        ("debug off, dict lazy", lambda: logger.debug("Key, %s, not found in dict -> %s", seq, change_dict)),
+        ("debug off, dict eager", lambda: logger.debug("Key, " + str(seq) + ", not found in dict -> " +
+                                                       str(change_dict))),
+        ("level check", lambda: logger.isEnabledFor(logging.DEBUG)),
+        ("info on, ring + queue", lambda: logger.info("sequence: %s", seq)),
+        ("event on, ring + queue", lambda: EventLog.event(logger, logging.INFO, "part state sent", pedal="TimeLine",
+                                                          messages=4)),
+    ]
+    print("event log: " + str(repeat) + " calls each, console off")
+    try:
+        for name, call in calls:
+            start = time.time()
+            for _ in range(repeat):
+                call()
+            elapsed = time.time() - start
+            EventLog.flush()
+            print("  {0:<24} {1:>9.3f} us per call".format(name, 1000000.0 * elapsed / repeat))
+        print("  {0} records dropped with the queue full".format(EventLog.stats()['dropped']))
+    finally:
+        EventLog.configure(level=saved_level)
+
+
+def benchmark_pedal_conf_load(repeat=5):
+    """ startup cost of each shipped pedal config: reading the yaml, validating and compiling it, against loading
+    the compiled form from the cache """
+    cache_folder = tempfile.mkdtemp()
+    midi = MIDI.MIDI(1)
+    print("pedal config load: best of " + str(repeat) + ", ms per config")
+    print("  {0:<16} {1:>10} {2:>10} {3:>9}".format("pedal", "compile", "cached", "problems"))
+    try:
+        for pedal_conf in sorted(os.listdir(MIDI_PEDAL_CONF_FOLDER)):
+            if pedal_conf[-5:] != ".yaml":
+                continue
+            conf_path = os.path.join(MIDI_PEDAL_CONF_FOLDER, pedal_conf)
+            timings = []
+            for cached in [False, True]:
+                best = None
+                for _ in range(repeat):
+                    if not cached:
+                        shutil.rmtree(cache_folder, True)
+                    start = time.time()
+                    compiled = PedalConfig.load_pedal_conf(conf_path, midi.cc_channel, midi.pc_channel, cache_folder)
+                    elapsed = time.time() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                timings.append(1000.0 * best)
+            print("  {0:<16} {1:>10.2f} {2:>10.2f} {3:>9}".format(pedal_conf[:-5], timings[0], timings[1],
+                                                                    len(compiled.problems)))
+    finally:
+        shutil.rmtree(cache_folder, True)
+
+
+def benchmark_song_sequence(repeat=3):
+    """ the song list of a setlist as the old doubly linked list and as a Sequence, at setlists of hundreds of songs:
+    index to node and node to index the way song and part navigation uses them, a walk through the whole set with
+    next song, and putting a song in the middle of the set """
+    print("song sequence: best of " + str(repeat) + ", us per call")
+    print("  {0:<8} {1:<18} {2:>12} {3:>12}".format("songs", "call", "linked list", "sequence"))
+    for song_count in [100, 300, 1000]:
+        song_lists = []
+        for song_list in [DoublyLinkedList.DoublyLinkedList(), Sequence.Sequence()]:
+            for i in range(song_count):
+                song_list.append("song " + str(i))
+            song_lists.append(song_list)
+        indexes = [(i * 7919) % song_count + 1 for i in range(200)]  # spread over the whole set
+
+        def index_to_node(song_list):
+            for index in indexes:
+                song_list.index_to_node(index)
+
+        def node_to_index(song_list):
+            for node in nodes[song_list]:
+                song_list.node_to_index(node)
+
+        def next_song_walk(song_list):
+            # what next_song and load_song did for each song: the node of the next index, then the index of the node
+            for index in range(1, song_count + 1):
+                song_list.node_to_index(song_list.index_to_node(index))
+
+        def insert_middle(song_list):
+            # 50 songs put in the middle of the set and taken out again, e.g. a set being edited
+            added = [song_list.insert("new song " + str(i), song_count // 2) for i in range(50)]
+            for i, entry in enumerate(added):
+                if entry is None:
+                    song_list.remove("new song " + str(i))  # the linked list only removes by value
+                else:
+                    song_list.remove_entry(entry)
+
+        nodes = dict((song_list, [song_list.index_to_node(index) for index in indexes]) for song_list in song_lists)
+        for name, call, calls in [("index_to_node", index_to_node, len(indexes)),
+                                  ("node_to_index", node_to_index, len(indexes)),
+                                  ("next song walk", next_song_walk, song_count),
+                                  ("insert + remove", insert_middle, 50)]:
+            timings = []
+            for song_list in song_lists:
+                best = None
+                for _ in range(repeat):
+                    start = time.time()
+                    call(song_list)
+                    elapsed = time.time() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                timings.append(1000000.0 * best / calls)
+            print("  {0:<8} {1:<18} {2:>12.2f} {3:>12.2f}".format(song_count, name, timings[0], timings[1]))
+
+
+def generate_library(folder, song_count):
+    """ song_count songs made from the shipped ones under new names and tempos, and one set with all of them.
+    returns (song folder, set path without .yaml) """
+    song_folder = os.path.join(folder, "Songs") + os.sep
+    os.makedirs(song_folder)
+    templates = []
+    for song_file in sorted(os.listdir(SONG_FOLDER)):
+        if song_file[-5:] == ".yaml":
+            with open(os.path.join(SONG_FOLDER, song_file)) as yaml_file:
+                templates.append(yaml.safe_load(yaml_file))
+    song_names = []
+    for i in range(song_count):
+        song = dict(templates[i % len(templates)])
+        song['tempo'] = 60 + i % 120
+        song_names.append("Song " + str(i))
+        with open(song_folder + song_names[-1] + ".yaml", 'w') as yaml_file:
+            yaml.safe_dump(song, yaml_file)
+    set_path = os.path.join(folder, "Set")
+    with open(set_path + ".yaml", 'w') as yaml_file:
+        yaml.safe_dump({'name': "Generated", 'songs': song_names}, yaml_file)
+    return song_folder, set_path
+
+
+def benchmark_setlist_startup(repeat=1, song_count=500):
+    """ opening a set of song_count songs: parsing every song yaml up front the way the whole set used to be loaded,
+    against the compiled cache being built, and then read on a cold start with nothing changed. 'startup' is what
+    the controller waits for (the set and its first song), 'all songs' every song of the set """
+    folder = tempfile.mkdtemp()
+    cache_path = os.path.join(folder, "cache", "compiled.pickle")
+    logging.getLogger(PartSongSet.Setlist.__module__).setLevel(logging.WARNING)
+    try:
+        song_folder, set_path = generate_library(folder, song_count)
+
+        def open_set(cache, all_songs):
+            setlist = PartSongSet.Setlist(song_folder, cache)
+            setlist.load_setlist(set_path)
+            for song in setlist.songs.to_list() if all_songs else [setlist.songs.head.data]:
+                song.load()
+            if cache is not None:
+                cache.save()
+
+        def build_cache(all_songs):
+            if os.path.exists(cache_path):
+                os.remove(cache_path)
+            open_set(PartSongSet.CompiledCache(cache_path), all_songs)
+
+        runs = [
+            ("yaml, all songs", lambda: open_set(None, True)),
+            ("yaml, startup", lambda: open_set(None, False)),
+            ("cache build, all songs", lambda: build_cache(True)),
+            ("warm cache, all songs", lambda: open_set(PartSongSet.CompiledCache(cache_path), True)),
+            ("warm cache, startup", lambda: open_set(PartSongSet.CompiledCache(cache_path), False)),
+        ]
+        print("setlist startup: " + str(song_count) + " songs, best of " + str(repeat) + ", song cache of " +
+              str(PartSongSet.song_cache.capacity))
+        for name, run in runs:
+            best = None
+            for _ in range(repeat):
+                start = time.time()
+                run()
+                elapsed = time.time() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print("  {0:<24} {1:>10.1f} ms".format(name, 1000.0 * best))
+        cache = PartSongSet.CompiledCache(cache_path)
+        open_set(cache, True)
+        print("  warm cache compiled {0} of {1} files, cache file {2} kB".format(
+            cache.stats()['compiled'], song_count + 1, os.path.getsize(cache_path) // 1024))
+    finally:
+        shutil.rmtree(folder, True)
+
+
+BENCHMARKS = {
+    "event_log": benchmark_event_log,
+    "func_expression": benchmark_func_expression,
+    "midi_clock": benchmark_midi_clock,
+    "midi_write": benchmark_midi_write,
+    "pedal_conf_load": benchmark_pedal_conf_load,
+    "running_status": benchmark_running_status,
+    "setlist_startup": benchmark_setlist_startup,
+    "song_sequence": benchmark_song_sequence,
+    "transport": benchmark_transport
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("usage: python Benchmarks.py <" + "|".join(sorted(BENCHMARKS)) + "> [repeat]")
+        sys.exit(1)
+    if len(sys.argv) > 2:
+        BENCHMARKS[sys.argv[1]](int(sys.argv[2]))
+    else:
+        BENCHMARKS[sys.argv[1]]()
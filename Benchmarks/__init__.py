@@ -0,0 +1 @@
+from Benchmarks import *
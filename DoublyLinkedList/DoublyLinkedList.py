@@ -25,37 +25,47 @@ class DoublyLinkedList(object):
 		self.length += 1
 
 	def prepend(self, data):
-		new_head = Node(data).next
-		new_head.next = self.head
+		new_head = Node(data, None, self.head)
+		if self.head is None:
+			self.tail = new_head
+		else:
+			self.head.prev = new_head
 		self.head = new_head
+		self.length += 1
 
 	def insert(self, data, position):
-		if position == 0 or not self.head:
+		if position <= 0 or not self.head:
 			self.prepend(data)
+		elif position >= self.length:
+			self.append(data)
 		else:
-			node_to_insert = Node(data)
 			iter_node = self.head
 			pos = position
-			while pos > 1 and iter_node.next:
+			while pos > 1:
 				iter_node = iter_node.next
 				pos -= 1
-			node_to_insert.next = iter_node.next
+			node_to_insert = Node(data, iter_node, iter_node.next)
+			iter_node.next.prev = node_to_insert
 			iter_node.next = node_to_insert
+			self.length += 1
 
 	def remove(self, node_value):
 		current_node = self.head
-		while node_value is not None:
+		while current_node is not None:
 			if current_node.data == node_value:
-				# if it's not the first element
 				if current_node.prev is not None:
 					current_node.prev.next = current_node.next
-					current_node.next.prev = current_node.prev
 				else:
-					# otherwise we have no prev, head is the next one, and prev becomes None
+					# otherwise we have no prev, head is the next one
 					self.head = current_node.next
-					current_node.next.prev = None
+				if current_node.next is not None:
+					current_node.next.prev = current_node.prev
+				else:
+					self.tail = current_node.prev
+				self.length -= 1
+				return True
 			current_node = current_node.next
-		self.length -= 1
+		return False
 
 	def show(self):
 		print("Show list data:")
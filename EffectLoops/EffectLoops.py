@@ -1,8 +1,12 @@
 # 2016
 # Author: Aaron Watkins
 
-import time
+import EventLog
 import MIDI
+import Morph
+import PartStager
+import PedalConfig
+import PressClassifier
 import logging
 
 '''   ############ USAGE ###############
@@ -10,21 +14,38 @@ logger.info("info message")
 logger.warning("warning message")
 logger.error("error message")
 '''
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-logger.propagate = False
-# create console handler and set level to info
-handler = logging.StreamHandler()
-handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter("%(asctime)s [EffectLoops.py] [%(levelname)-5.5s]  %(message)s")
-handler.setFormatter(formatter)
-logger.addHandler(handler)
+logger = EventLog.get_logger(__name__)
 
 
 def unload():
     pass
 
 
+def send_part_plans(plans, action=None):
+    """ send the messages of several PartPlans as one burst, then record the state each of them leaves behind """
+    burst = []
+    sources = []
+    for plan in plans:
+        messages = plan.pedal.changed_messages(plan.messages)
+        burst.extend(messages)
+        sources.extend([(plan.pedal.name, action)] * len(messages))
+    MIDI.MIDI.send_burst(burst, sources)
+    for plan in plans:
+        plan.record()
+    return burst
+
+
+# actions that do something every time they are sent
+STATELESS_ACTIONS = ["Toggle Bypass", "Set Tempo"]
+
+
+def can_ramp(param_table, start, end):
+    """ a param can be ramped between two whole numbers it can be set to, its min to max range has all in between """
+    if type(start) is not int or type(end) is not int or start == end:
+        return False
+    return bool(param_table.messages(start)) and bool(param_table.messages(end))
+
+
 class Pedal(object):
 
     def __init__(self, name, state):
@@ -47,40 +68,34 @@ class Pedal(object):
 
 class ButtonOnPedalBoard(object):
 
-    def __init__(self, name, partner_function, long_press_func, button, **kwargs):
+    def __init__(self, name, partner_function, long_press_func, button, double_tap_func=None, **kwargs):
         self.name = name
         self.is_engaged = None
-        self.end = None
         self.button = button
-        self.start = time.time()
         self.pin = self.from_button_to_pin(self.button)
-        self.is_pressed = False
         self.partner = None
         self.partner_function = partner_function
         self.long_press_func = long_press_func
-        self.last_action_time = self.start
-        self.PedalConfigChanged = False
-
-    def button_state(self, int_capture_pin_val, mode):
-        output = None
+        self.double_tap_func = double_tap_func
+        # a switch only waits for a second press if it has something to do on a double tap
+        self.presses = PressClassifier.PressClassifier(name, hold_times=self.hold_times(),
+                                                      double_tap=PressClassifier.DOUBLE_TAP if double_tap_func else None)
+
+    def hold_times(self):
+        """ seconds held at which a press becomes a long press. a button without a long press function has none, so
+        holding it still makes a short press """
+        return [PressClassifier.LONG_PRESS] if self.long_press_func else []
+
+    def set_press_handler(self, handler):
+        """ handler(event) is called with every PressEvent once the press classifier has decided it """
+        self.presses.handler = handler
+
+    def button_state(self, int_capture_pin_val):
+        """ passes the pin value read at the interrupt on to the press classifier: low is down, high is up """
         if not int_capture_pin_val:
-            self.is_pressed = True
-            self.start = time.time()
+            self.presses.press()
         else:
-            self.end = time.time()
-            delta_t = self.end - self.start
-            if (self.partner and (
-                    not self.partner.PedalConfigChanged or time.time() - self.partner.last_action_time > 0.25)) \
-                    or not self.partner:
-                if delta_t < 0.5:
-                    output = self.name
-                else:
-                    output = self.secondary_function()
-            else:
-                output = "partner func"
-                self.partner.PedalConfigChanged = False
-            self.is_pressed = False
-        return output
+            self.presses.release()
 
     @staticmethod
     def from_button_to_pin(button):
@@ -91,6 +106,7 @@ class ButtonOnPedalBoard(object):
         if partner:
             self.partner = partner
             self.partner.partner = self
+            self.presses.set_partner(partner.presses)
 
     def get_partner_button(self):
         partner_dict = {}  # {1: 4, 3: 5, 4: 1, 5: 3}
@@ -120,12 +136,33 @@ class ButtonOnPedalBoard(object):
 
 
 class MidiPedal(Pedal):
-    params_types = ['Knobs/Switches', 'Parameters']
 
-    def __init__(self, name, state, midi_channel, commands, preset):
+    def __init__(self, name, state, midi_channel, commands, preset, compiled=None):
         self.preset = preset
         self.midi_channel = midi_channel
         self.midi = MIDI.MIDI(self.midi_channel)
+        self.name = name
+        # the config compiled into ready to send messages (PedalConfig.load_pedal_conf, or compiled here), so
+        # switching is a table lookup and a write
+        if compiled is None:
+            compiled = PedalConfig.CompiledPedalConf(name, commands, self.midi.cc_channel, self.midi.pc_channel)
+            compiled.report()
+        self.use_config(commands, compiled)
+        # what the last applied part left on the pedal, so the next part only sends what changes
+        self.part_applied = False
+        self.sent_params = {}
+        self.sent_settings = None
+        self.sent_tempo = None
+        # the PartSongSet.PedalState the last part left the pedal in, None once anything else was sent to it
+        self.sent_state = None
+        Pedal.__init__(self, name, state)
+        try:
+            preset = int(preset)
+        except ValueError:
+            logging.info("Cant cast \'" + str(preset) + "\' as an integer. Assuming it is a name based preset.")
+        self.set_preset(preset)
+
+    def use_config(self, commands, compiled):
         self.midi_command_dict = commands
         self.midi_pedal_conf_dict = {
             "Parameters": self.midi_command_dict.get("Parameters", None),
@@ -136,191 +173,246 @@ class MidiPedal(Pedal):
             "Knobs/Switches": self.midi_command_dict.get("Knobs/Switches", None),
             "Toggle Bypass": self.midi_command_dict.get("Toggle Bypass", None)
         }
-        Pedal.__init__(self, name, state)
-        try:
-            preset = int(preset)
-        except ValueError:
-            logging.info("Cant cast \'" + str(preset) + "\' as an integer. Assuming it is a name based preset.")
-        self.set_preset(preset)
+        self.action_tables = compiled.actions
+        self.setting_tables = compiled.settings
+        # one flat index from parameter name to its table, so applying a part's params is one lookup per param
+        self.param_index = compiled.params
+        if compiled.unusable:
+            logger.warning(self.name + " has parameters without a cc in its config, they can't be set: " +
+                           ", ".join(str(param) for param in compiled.unusable))
+        self.reported_params = set()
+        self.trigger_ccs = compiled.trigger_ccs
+
+    def reload_config(self, compiled):
+        """ take the config of the pedal compiled again after its file changed. what was sent is forgotten, so the
+        next part sends the pedal everything the way the new config says """
+        self.use_config(compiled.conf, compiled)
+        self.invalidate()
+        logger.info(self.name + " config reloaded.")
+
+    def send_messages(self, messages, action=None, suppress_redundant=False):
+        """ send messages of this pedal; action names what triggered them in the midi capture. with
+        suppress_redundant the ones that would set what the pedal was last sent are left out """
+        if suppress_redundant:
+            messages = self.changed_messages(messages)
+        if action != "Set Tempo":
+            self.sent_state = None  # the pedal is not just what the last part left any more, the tempo isn't part of it
+        if messages:
+            self.midi.send_burst(list(messages), [(self.name, action)] * len(messages))
+
+    def changed_messages(self, messages):
+        """ messages without the ones that would not change anything on the pedal, see MIDI.MidiShadow """
+        changed = MIDI.MIDI.shadow.changed(messages, self.trigger_ccs)
+        if len(changed) < len(messages):
+            logger.debug("%s: %s redundant midi messages left out.", self.name, len(messages) - len(changed))
+        return changed
+
+    def run_action(self, action_name, value=None):
+        """ send the compiled messages of one of the action groups (Engage, Bypass, Set Preset, ...). toggles and
+        tempo always go out, the others only when they change something """
+        self.send_messages(self.action_tables[action_name].messages(value), action_name,
+                           action_name not in STATELESS_ACTIONS)
+
+    def invalidate(self):
+        """ forget everything that was sent to the pedal, e.g. after it was power cycled. the next part sends it
+        everything again """
+        MIDI.MIDI.invalidate_shadow(self.midi_channel)
+        self.part_applied = False
+        self.sent_params = {}
+        self.sent_settings = None
+        self.sent_tempo = None
+        self.sent_state = None
+        PartStager.invalidate()
 
     def turn_on(self):
-        if self.midi_pedal_conf_dict["Engage"]:
-            self.determine_action_method(self.midi_pedal_conf_dict["Engage"])
+        if "Engage" in self.action_tables:
+            self.run_action("Engage")
             self.is_engaged = True
+            PartStager.invalidate()
             logger.info(self.name + " on.")
         else:
             logger.info(self.name + " has no \'Engage\' option defined in the pedal config.")
 
     def turn_off(self):
-        if self.midi_pedal_conf_dict["Bypass"]:
-            self.determine_action_method(self.midi_pedal_conf_dict["Bypass"])
+        if "Bypass" in self.action_tables:
+            self.run_action("Bypass")
             self.is_engaged = False
+            PartStager.invalidate()
             logger.info(self.name + " off.")
         else:
             logger.info(self.name + " has no \'Bypass\' option defined in the pedal config.")
 
     def toggle_engaged(self):
-        if self.midi_pedal_conf_dict["Toggle Bypass"]:
-            self.determine_action_method(self.midi_pedal_conf_dict["Toggle Bypass"])
+        if "Toggle Bypass" in self.action_tables:
+            self.run_action("Toggle Bypass")
             self.is_engaged ^= True
+            PartStager.invalidate()
             logger.info(self.name + " on." if self.is_engaged else " off.")
         else:
             logger.info(self.name + " has no \'Toggle Bypass\' option defined in the pedal config.")
 
     def set_preset(self, preset):
-        if self.midi_pedal_conf_dict["Set Preset"]:
+        if "Set Preset" in self.action_tables:
             if preset == '':
                 logger.info(self.name + " has no preset for this part.")
             else:
-                self.determine_action_method(self.midi_pedal_conf_dict["Set Preset"], preset)
+                self.run_action("Set Preset", preset)
                 logger.info(self.name + " preset was set to " + str(preset) + ".")
                 self.preset = preset
+                self.sent_params = {}  # loading a preset brings back the params saved with it
+                PartStager.invalidate()
         else:
             logger.info(self.name + " has no \'Set Preset\' option defined in the pedal config.")
 
     def set_tempo(self, tempo):
-        if self.midi_pedal_conf_dict["Set Tempo"]:
+        if "Set Tempo" in self.action_tables:
             if tempo == '':
                 logger.info(self.name + " has no tempo for this part.")
             else:
-                self.determine_action_method(self.midi_pedal_conf_dict["Set Tempo"], tempo)
+                self.run_action("Set Tempo", tempo)
                 logger.info(self.name + " tempo was set to " + str(tempo) + ".")
+                self.sent_tempo = tempo
         else:
             logger.info(self.name + " has no \'Set Tempo\' option defined in the pedal config.")
 
+    def has_tempo(self):
+        return "Set Tempo" in self.action_tables
+
     def set_setting(self, setting):
-        setting_dict = self.midi_command_dict.get(setting, None)
-        if setting_dict:
-            self.determine_action_method(setting_dict, setting)
+        setting_table = self.setting_tables.get(setting, None)
+        if setting_table:
+            self.send_messages(setting_table.messages(setting), "Action " + str(setting))
             logger.info(self.name + " setting " + str(setting) + " set.")
         else:
             logger.info(self.name + " setting " + str(setting) + " was not found in the pedal config.")
 
+    def find_param_table(self, param):
+        return self.param_index.get(param, None)
+
+    def check_params(self, params, where=""):
+        """ report the params this pedal has no config for, each one only the first time it is seen. returns them """
+        unknown = [param for param in (params or {}) if param not in self.param_index]
+        for param in unknown:
+            if param not in self.reported_params:
+                self.reported_params.add(param)
+                logger.warning(self.name + " has no parameter '" + str(param) + "'" + where + ", it is ignored.")
+        return unknown
+
+    def plan_part_state(self, state, force=False, morph_params=None):
+        """ work out the messages that take the pedal from the state it was last sent to the PedalState a part asks
+        for. a state that is the one the last part left needs nothing. a new preset resets the pedal, so it gets
+        everything again, as it does with force (a full resync) and on the first part. otherwise only the engaged
+        state, params and settings that differ from what was sent go out. params named in morph_params are not sent
+        but become ramps for the Morph scheduler, when they go from one number to another. """
+        if state is self.sent_state and not force and self.part_applied:
+            return PartPlan(self, [], self.is_engaged, self.preset, self.sent_params, self.sent_settings, None, state)
+        engaged, preset, params, settings = state.engaged, state.preset, state.params, state.settings
+        has_preset = preset is not None and preset != ''
+        full = force or not self.part_applied or (has_preset and preset != self.preset)
+        messages = []
+        if full or engaged != self.is_engaged:
+            action_name = "Engage" if engaged else "Bypass"
+            if action_name in self.action_tables:
+                messages.extend(self.action_tables[action_name].messages())
+        if full and has_preset and "Set Preset" in self.action_tables:
+            messages.extend(self.action_tables["Set Preset"].messages(preset))
+        sent_params = {} if full else dict(self.sent_params)
+        ramps = []
+        for param, value in (params or {}).iteritems():
+            if full or param not in self.sent_params or self.sent_params[param] != value:
+                param_table = self.param_index.get(param, None)
+                if param_table is None:
+                    self.check_params([param])
+                    continue
+                if not full and morph_params and param in morph_params and \
+                        can_ramp(param_table, self.sent_params.get(param, None), value):
+                    ramps.append(Morph.Ramp(self, param, param_table, self.sent_params[param], value))
+                    sent_params[param] = value  # where the ramp ends up
+                    continue
+                param_messages = param_table.messages(value)
+                if param_messages:
+                    messages.extend(param_messages)
+                    sent_params[param] = value
+                else:
+                    logger.info(self.name + " parameter \'" + str(param) + "\' not set.")
+        sent_settings = None if full else self.sent_settings
+        if settings and (full or settings != self.sent_settings):
+            setting_table = self.setting_tables.get(settings, None)
+            if setting_table:
+                setting_messages = setting_table.messages(settings)
+                if setting_messages:
+                    messages.extend(setting_messages)
+                    sent_settings = settings
+                else:
+                    logger.error(self.name + " cant apply setting " + str(settings) + ".")
+            else:
+                logger.info(self.name + " setting " + str(settings) + " was not found in the pedal config.")
+        return PartPlan(self, messages, engaged, preset if has_preset else self.preset, sent_params, sent_settings,
+                        ramps, state)
+
     def set_params(self, params):
         for param, value in params.iteritems():
-            for param_type in self.params_types:
-                if self.midi_pedal_conf_dict[param_type]:
-                    if self.set_param(param, value, param_type):
-                        break  # break for the inner for loop and then find the next (param, value) pair
-
-    def set_param(self, param, value, param_type):
-        config_found = False
-        param_info = self.midi_pedal_conf_dict[param_type].get(param, None)
-        if param_info:
-            config_found = self.check_for_param_then_set(config_found, param_info, param, value)
-        else:
-            logger.info("Configuration option, " + str(param) + ", not found in " + self.name + " \'" + param_type +
-                        "\' configuration dict -> " + str(self.midi_pedal_conf_dict[param_type]))
-        return config_found
-
-    def check_for_param_then_set(self, config_found, param_info, param, value):
-        param_was_set = self.determine_parameter_method(param_info, value)
-        if param_was_set:
+            self.set_param(param, value)
+
+    def set_param(self, param, value):
+        param_table = self.param_index.get(param, None)
+        if param_table is None:
+            self.check_params([param])
+            return False
+        messages = param_table.messages(value)
+        if messages:
+            self.send_messages(messages, "Param " + str(param), True)
             logger.info(self.name + " parameter \'" + str(param) + "\' set to " + str(value) + ".")
-            config_found = True
-        else:
-            logger.info(self.name + " parameter \'" + str(param) + "\' not set.")
-        return config_found
+            self.sent_params[param] = value
+            PartStager.invalidate()
+            return True
+        logger.info(self.name + " parameter \'" + str(param) + "\' not set.")
+        return False
 
     def determine_parameter_method(self, action_dict, value=None):
-        param_set = False
-        if value is None:
-            value = action_dict.get('value', None)
-        if action_dict.get('cc', None):
-            value = self.check_for_func(action_dict, value)
-            value = self.check_value_for_engaged(value)
-            logger.debug("Value is \'" + str(value) + "\' after check_value_for_engaged function.")
-            value = self.convert_to_int(action_dict, value)
-            logger.debug("Value is \'" + str(value) + "\' after convert_to_int function.")
-            if value is not None:
-                self.midi.midi_cc_tx(chr(action_dict['cc']), chr(value))
-                param_set = True
-        if not param_set:
+        messages = PedalConfig.param_messages(action_dict, value, self.midi.cc_channel)
+        if messages:
+            self.send_messages(messages, "Param")
+        else:
             logger.debug("Uh oh! Could not set param to \'{0}\' for some reason.".format(str(value)))
-        return param_set
-
-    # elif action_dict.get('program change', None):
-    # 	value = self.check_for_func(action_dict['program change'], value)
-    # 	self.midi.midi_pc_tx(chr(value))
-    # elif action_dict.get('control change', None):
-    # 	# logger.info(self.name + " has a value of " + str(value) + " before going through lambda func.")
-    # 	value = self.check_for_func(action_dict['control change'], value)
-    # 	# logger.info(self.name + " has a value of " + str(value) + " after going through lambda func.")
-    # 	self.midi.midi_cc_tx(chr(value))
-    # elif action_dict.get('multi', None):
-    # 	self.handle_multi_functions(action_dict, value)
+        return bool(messages)
 
     def determine_action_method(self, action_dict, value=None):
-        if value is None:
-            value = action_dict.get('value', None)
-        if action_dict.get('cc', None):
-            value = self.check_for_func(action_dict, value)
-            self.midi.midi_cc_tx(chr(action_dict['cc']), chr(value))
-        elif action_dict.get('program change', None):
-            value = self.check_for_func(action_dict['program change'], value)
-            self.midi.midi_pc_tx(chr(value))
-        elif action_dict.get('control change', None):
-            logger.debug(self.name + " has a value of " + str(value) + " before going through lambda func.")
-            value = self.check_for_func(action_dict['control change'], value)
-            logger.debug(self.name + " has a value of " + str(value) + " after going through lambda func.")
-            self.midi.midi_cc_tx(chr(value))
-        elif action_dict.get('multi', None):
-            self.handle_multi_functions(action_dict, value)
-
-    @staticmethod
-    def convert_to_int(change_dict, v):
-        converted_to_int = None
+        """ interpret an action dict that has no compiled table (e.g. a setting) and send what it describes """
         try:
-            dict_val = change_dict.get(v, change_dict.get('dict', {}).get(v, None))
-            if dict_val is not None:
-                converted_to_int = int(dict_val)
-            elif change_dict.get('value', None) == v:
-                logger.info("This param uses key \'value\' and the value is " + str(v) + ". ")
-                converted_to_int = int(v)
-            elif isinstance(v, bool):
-                converted_to_int = change_dict.get('on') if v else change_dict.get('off')
-            else:
-                logger.info("Key, " + str(v) + ", not found in dict -> " + str(change_dict))
-                min_val = change_dict.get('min', None)
-                max_val = change_dict.get('max', None)
-                if min_val is not None and max_val is not None:
-                    val = int(v)
-                    if min_val <= val <= max_val:
-                        converted_to_int = val
-                    else:
-                        logger.info("The value, " + str(v) + ", is not in the range [" + str(min_val) + ", " + str(
-                            max_val) + "]")
-        except ValueError:
-            logger.error("Value \'" + str(v) + "\' cannot be converted to an int.")
-        return converted_to_int
-
-    @staticmethod
-    def check_for_func(change_dict, v):
-        new_v = v
-        if change_dict.get('func', None):
-            f = eval('lambda x: ' + change_dict['func'])
-            new_v = f(v)
-        return new_v
-
-    @staticmethod
-    def check_value_for_engaged(v):
-        new_v = v
-        if isinstance(v, dict):
-            engaged = v.get('engaged', None)
-            if engaged is not None:
-                return engaged
-        return new_v
-
-    def handle_multi_functions(self, action_dict, val):
-        actions = action_dict['multi']
-        for i in range(len(actions)):
-            # logger.info('actions dictionary: ' + str(actions))
-            todo_item = actions[i + 1]
-            if action_dict.get(todo_item, None):
-                todo = action_dict[todo_item]
-                if todo.get('cc', None):
-                    val = self.check_for_func(todo, val)
-                    self.midi.midi_cc_tx(chr(todo['cc']), chr(val))
-                elif todo.get('program change', None):
-                    val = self.check_for_func(todo['program change'], val)
-                    self.midi.midi_pc_tx(chr(val))
+            self.send_messages(PedalConfig.action_messages(action_dict, value, self.midi.cc_channel,
+                                                           self.midi.pc_channel), "Action " + str(value))
+        except (TypeError, ValueError) as e:
+            logger.error(self.name + " cant run action " + str(action_dict) + " with value \'" + str(value) + "\': " +
+                         str(e))
+
+
+class PartPlan(object):
+    """ the messages that take a MidiPedal to the state of a part, and the state it is in once they are sent """
+
+    def __init__(self, pedal, messages, engaged, preset, sent_params, sent_settings, ramps=None, state=None):
+        self.pedal = pedal
+        self.state = state  # the PedalState it takes the pedal to
+        self.messages = messages
+        self.ramps = ramps or []
+        self.engaged = engaged
+        self.preset = preset
+        self.sent_params = sent_params
+        self.sent_settings = sent_settings
+
+    def commit(self, action=None):
+        self.pedal.send_messages(self.messages, action)
+        self.record()
+
+    def record(self):
+        """ remember on the pedal what was sent """
+        if ("Engage" if self.engaged else "Bypass") in self.pedal.action_tables:
+            self.pedal.is_engaged = self.engaged
+        self.pedal.preset = self.preset
+        self.pedal.sent_params = self.sent_params
+        self.pedal.sent_settings = self.sent_settings
+        self.pedal.sent_state = self.state
+        self.pedal.part_applied = True
+        PartStager.invalidate()  # plans staged against the old state would undo this one
+        EventLog.event(logger, logging.INFO, "part state sent", pedal=self.pedal.name, messages=len(self.messages),
+                       ramps=len(self.ramps))
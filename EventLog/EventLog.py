@@ -0,0 +1,270 @@
+# one event log for every module of the controller. loggers come from get_logger and share two handlers: a ring
+# buffer that keeps the last records in memory (/midi_controller/log), and a sink that hands records to a writer
+# thread for the console and the log file. a record is only made when its level is on, its message is only formatted
+# when something reads it, and nothing the interrupt callbacks or the midi writer log ever waits on console i/o.
+import atexit
+import collections
+import logging
+import sys
+import threading
+import time
+
+FORMAT = "%(asctime)s [%(module)s.py] [%(levelname)-5.5s]  %(message)s"
+LEVEL = logging.INFO
+RING_CAPACITY = 2048  # records kept in memory
+QUEUE_CAPACITY = 1024  # records waiting for the writer thread, more are dropped and counted
+WRITE_INTERVAL = 0.02  # the writer thread collects records for this long before it writes them
+LEVELS = {'debug': logging.DEBUG, 'info': logging.INFO, 'warning': logging.WARNING, 'error': logging.ERROR}
+
+'''   ############ USAGE ###############
+logger = EventLog.get_logger(__name__)
+logger.info("part %s loaded", part_name)  # the message is built later, and only if info is on
+if logger.isEnabledFor(logging.DEBUG):
+    logger.debug("menu: %s", describe(menu))  # work done only to log something goes behind the level check
+EventLog.event(logger, logging.INFO, "part loaded", part=part_name, messages=len(burst))
+'''
+
+
+class Fields(object):
+    """ the fields of an event, written out as 'key=value ...' when the record is formatted """
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        return " ".join(str(key) + "=" + str(value) for key, value in sorted(self.fields.items()))
+
+
+class RingBufferHandler(logging.Handler):
+    """ keeps the last 'capacity' records as they are. appending to a deque is thread safe, so it takes no lock """
+
+    def __init__(self, capacity=RING_CAPACITY):
+        logging.Handler.__init__(self)
+        self.records = collections.deque(maxlen=capacity)
+
+    def handle(self, record):
+        self.records.append(record)
+        return True
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def resize(self, capacity):
+        self.records = collections.deque(self.records, maxlen=capacity)
+
+    def clear(self):
+        self.records.clear()
+
+    def recent(self, count=None, level=logging.NOTSET):
+        """ the last count records at level or above, oldest first, as dicts """
+        records = [record for record in list(self.records) if record.levelno >= level]
+        if count is not None:
+            records = records[-count:] if count > 0 else []
+        return [record_to_dict(record) for record in records]
+
+
+def record_to_dict(record):
+    entry = {
+        'time': record.created,
+        'module': record.module,
+        'level': record.levelname,
+        'message': record.getMessage(),
+    }
+    if getattr(record, 'event', None) is not None:
+        entry['event'] = record.event
+        entry['fields'] = dict((key, value if isinstance(value, (int, long, float, bool, type(None))) else str(value))
+                               for key, value in record.fields.items())
+    return entry
+
+
+class EventLogWriterThread(threading.Thread):
+    """ writes what the sink queued to the console and file handlers. it wakes up when the first record of a batch
+    comes in, waits WRITE_INTERVAL for the rest of it, and writes the whole batch """
+
+    def __init__(self, sink):
+        threading.Thread.__init__(self)
+        self.name = "Event-Log-Writer-Thread"
+        self.daemon = True
+        self.sink = sink
+        self.running = True
+        self.writing = False
+
+    def stop(self):
+        self.running = False
+        self.sink.wakeup.set()
+
+    def run(self):
+        while True:
+            self.sink.wakeup.wait()
+            if self.running:
+                time.sleep(WRITE_INTERVAL)
+            self.sink.wakeup.clear()
+            self.writing = True
+            self.write_queued()
+            self.writing = False
+            if not self.running:
+                break
+
+    def write_queued(self):
+        records = self.sink.records
+        while records:
+            record = records.popleft()
+            for handler in list(self.sink.handlers):
+                if record.levelno >= handler.level:
+                    try:
+                        handler.handle(record)
+                    except Exception:
+                        pass  # logging must never take the controller down
+
+
+class AsyncSink(logging.Handler):
+    """ queues records for the writer thread and returns straight away: a deque append, and waking the thread up
+    if it is asleep. when 'capacity' records are waiting the record is dropped and counted, a stalled console never
+    holds up the caller """
+
+    def __init__(self, capacity=QUEUE_CAPACITY):
+        logging.Handler.__init__(self)
+        self.capacity = capacity
+        self.records = collections.deque()
+        self.wakeup = threading.Event()
+        self.handlers = []
+        self.dropped = 0
+        self.writer_thread = None
+        self.start_lock = threading.Lock()
+
+    def add_handler(self, handler):
+        if handler.formatter is None:
+            handler.setFormatter(logging.Formatter(FORMAT))
+        self.handlers.append(handler)
+
+    def remove_handler(self, handler):
+        if handler in self.handlers:
+            self.handlers.remove(handler)
+            handler.close()
+
+    def start(self):
+        with self.start_lock:
+            if self.writer_thread is None:
+                self.writer_thread = EventLogWriterThread(self)
+                self.writer_thread.start()
+
+    def handle(self, record):
+        if self.writer_thread is None:
+            self.start()
+        if len(self.records) >= self.capacity:
+            self.dropped += 1
+            return True
+        self.records.append(record)
+        if not self.wakeup.is_set():
+            self.wakeup.set()
+        return True
+
+    def emit(self, record):
+        self.handle(record)
+
+    def flush(self, timeout=1.0):
+        """ wait until the writer thread has written everything queued so far """
+        writer_thread = self.writer_thread
+        deadline = time.time() + timeout
+        while writer_thread is not None and writer_thread.is_alive() and (self.records or writer_thread.writing) \
+                and time.time() < deadline:
+            self.wakeup.set()
+            time.sleep(WRITE_INTERVAL / 4)
+        for handler in self.handlers:
+            handler.flush()
+
+    def stop(self):
+        """ write out what is queued and stop the writer thread """
+        with self.start_lock:
+            writer_thread = self.writer_thread
+            self.writer_thread = None
+        if writer_thread is not None:
+            writer_thread.stop()
+            writer_thread.join(1.0)
+        for handler in self.handlers:
+            handler.flush()
+
+
+_level = LEVEL
+_loggers = {}
+_loggers_lock = threading.Lock()
+ring = RingBufferHandler()
+sink = AsyncSink()
+console = logging.StreamHandler(sys.stderr)
+sink.add_handler(console)
+log_file = None
+
+
+def get_logger(name):
+    """ the logger of a module, on the shared ring buffer and sink and at the level of the event log """
+    with _loggers_lock:
+        logger = _loggers.get(name, None)
+        if logger is None:
+            logger = logging.getLogger(name)
+            logger.setLevel(_level)
+            logger.propagate = False
+            logger.addHandler(ring)
+            logger.addHandler(sink)
+            _loggers[name] = logger
+    return logger
+
+
+def set_level(level):
+    """ level of every logger of the event log: a name from LEVELS or a logging level """
+    global _level
+    _level = LEVELS.get(str(level).lower(), level) if not isinstance(level, int) else level
+    with _loggers_lock:
+        for logger in _loggers.values():
+            logger.setLevel(_level)
+
+
+def get_level():
+    return _level
+
+
+def configure(level=LEVEL, console_on=True, path=None, ring_capacity=RING_CAPACITY):
+    """ set up the event log from the 'logging' section of midi_controller.yaml """
+    global log_file
+    set_level(level)
+    ring.resize(ring_capacity)
+    if console_on and console not in sink.handlers:
+        sink.add_handler(console)
+    elif not console_on:
+        sink.remove_handler(console)
+    if log_file is not None:
+        sink.remove_handler(log_file)
+        log_file = None
+    if path:
+        log_file = logging.FileHandler(path)
+        sink.add_handler(log_file)
+
+
+def event(logger, level, name, **fields):
+    """ a structured event. the ring buffer keeps name and fields as they are, the console gets 'name key=value' """
+    if logger.isEnabledFor(level):
+        caller = sys._getframe(1)  # the module that logged the event, not this one
+        record = logger.makeRecord(logger.name, level, caller.f_code.co_filename, caller.f_lineno, "%s %s",
+                                   (name, Fields(fields)), None, caller.f_code.co_name,
+                                   {'event': name, 'fields': fields})
+        logger.handle(record)
+
+
+def recent(count=None, level=logging.NOTSET):
+    return ring.recent(count, level)
+
+
+def stats():
+    return {'level': logging.getLevelName(_level), 'ring': len(ring.records), 'queued': len(sink.records),
+            'dropped': sink.dropped}
+
+
+def flush():
+    sink.flush()
+
+
+def stop():
+    """ write out what is still queued and stop the writer thread """
+    sink.stop()
+
+
+atexit.register(stop)
@@ -0,0 +1 @@
+from EventLog import *
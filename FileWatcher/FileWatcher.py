@@ -0,0 +1,205 @@
+# watches the song, set and pedal config folders and calls back with the yaml files that were written, moved in or
+# out, or deleted. it waits for a folder to be quiet for a moment first, an editor saving a file is several events.
+# it uses inotify through libc where there is one, and compares the mtimes and sizes of the files every poll interval
+# where there isn't. the callback runs on the watcher thread, so whatever it reads never holds up the inputs.
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+
+import EventLog
+
+'''   ############ USAGE ###############
+FileWatcher.start([song_folder, set_folder], callback)  # callback(paths) with the files that changed
+FileWatcher.stop()
+'''
+logger = EventLog.get_logger(__name__)
+
+POLL_INTERVAL = 1.0  # seconds between two looks at the folders without inotify
+SETTLE_TIME = 0.25  # seconds a folder has to be quiet before its changes are handed on
+SUFFIX = ".yaml"
+
+# inotify events, see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")  # watch descriptor, mask, cookie, length of the name after it
+
+
+class Inotify(object):
+    """ an inotify instance on some folders. raises OSError where there is no inotify """
+
+    def __init__(self, folders):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init"):
+            raise OSError("no inotify in libc")
+        self.libc = libc
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        self.folders = {}  # {watch descriptor: folder}
+        for folder in folders:
+            wd = libc.inotify_add_watch(self.fd, folder.encode("utf-8") if not isinstance(folder, bytes) else folder,
+                                        WATCH_MASK)
+            if wd < 0:
+                logger.warning("Cant watch " + folder + ": " + os.strerror(ctypes.get_errno()))
+            else:
+                self.folders[wd] = folder
+
+    def read(self, timeout):
+        """ the paths of the files events came in for within timeout seconds. None if the kernel's queue overflowed
+        and events were lost """
+        readable = select.select([self.fd], [], [], timeout)[0]
+        if not readable:
+            return set()
+        data = os.read(self.fd, 64 * 1024)
+        paths = set()
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            folder = self.folders.get(wd, None)
+            if folder is not None and name:
+                paths.add(os.path.join(folder, name.decode("utf-8") if not isinstance(name, str) else name))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller(object):
+    """ the same as Inotify, by comparing the mtime and size of every file in the folders """
+
+    def __init__(self, folders, interval=POLL_INTERVAL):
+        self.folders = folders
+        self.interval = interval
+        self.wakeup = threading.Event()
+        self.files = self.scan()
+
+    def scan(self):
+        files = {}
+        for folder in self.folders:
+            try:
+                file_names = os.listdir(folder)
+            except OSError:
+                continue
+            for file_name in file_names:
+                path = os.path.join(folder, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (stat.st_mtime, stat.st_size)
+        return files
+
+    def read(self, timeout):
+        self.wakeup.wait(min(timeout, self.interval))
+        files = self.scan()
+        paths = set(path for path in set(files) | set(self.files) if files.get(path) != self.files.get(path))
+        self.files = files
+        return paths
+
+    def close(self):
+        self.wakeup.set()
+
+
+class FileWatcherThread(threading.Thread):
+    """ hands callback(paths) the yaml files in folders that changed, once none changed for SETTLE_TIME """
+
+    def __init__(self, folders, callback, poll_interval=POLL_INTERVAL, use_inotify=True):
+        threading.Thread.__init__(self)
+        self.name = "File-Watcher-Thread"
+        self.daemon = True
+        self.folders = [os.path.normpath(folder) for folder in folders]
+        self.callback = callback
+        self.running = True
+        self.reloads = 0
+        self.last_paths = []
+        self.source = None
+        if use_inotify:
+            try:
+                self.source = Inotify(self.folders)
+            except (OSError, AttributeError) as e:
+                logger.info("No inotify (" + str(e) + "), the folders are polled every " + str(poll_interval) + "s.")
+        if self.source is None:
+            self.source = Poller(self.folders, poll_interval)
+
+    def stop(self):
+        self.running = False
+        if isinstance(self.source, Poller):
+            self.source.close()
+
+    def run(self):
+        logger.info("Starting " + self.name + " (" + type(self.source).__name__ + ")")
+        pending = set()
+        while self.running:
+            paths = self.source.read(SETTLE_TIME if pending else POLL_INTERVAL)
+            if paths is None:
+                # events were lost, so every file counts as changed. the callback skips the ones that are the same
+                paths = self.all_files()
+            paths = set(path for path in paths if path.endswith(SUFFIX))
+            if paths:
+                pending.update(paths)
+            elif pending and self.running:
+                self.hand_on(sorted(pending))
+                pending = set()
+        if not isinstance(self.source, Poller):
+            self.source.close()
+        logger.info("Exiting " + self.name)
+
+    def all_files(self):
+        paths = set()
+        for folder in self.folders:
+            try:
+                paths.update(os.path.join(folder, file_name) for file_name in os.listdir(folder))
+            except OSError:
+                pass
+        return paths
+
+    def hand_on(self, paths):
+        self.reloads += 1
+        self.last_paths = paths
+        logger.info("Changed on disk: " + ", ".join(os.path.basename(path) for path in paths))
+        try:
+            self.callback(paths)
+        except Exception as e:
+            logger.exception(e)
+
+    def stats(self):
+        return {'source': type(self.source).__name__, 'folders': self.folders, 'reloads': self.reloads,
+                'last_paths': self.last_paths}
+
+
+_watcher = None
+
+
+def start(folders, callback, poll_interval=POLL_INTERVAL, use_inotify=True):
+    global _watcher
+    if _watcher is None:
+        _watcher = FileWatcherThread(folders, callback, poll_interval, use_inotify)
+        _watcher.start()
+
+
+def stop():
+    global _watcher
+    if _watcher is not None:
+        _watcher.stop()
+        _watcher.join(POLL_INTERVAL + 1.0)
+        _watcher = None
+
+
+def is_running():
+    return _watcher is not None
+
+
+def stats():
+    return _watcher.stats() if _watcher is not None else {}
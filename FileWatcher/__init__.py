@@ -0,0 +1 @@
+from FileWatcher import *
@@ -0,0 +1,242 @@
+# the 'func' fields of the pedal configs, e.g. "x / 128" or '{"TS808": 20, "Plexi": 21}.get(x, None)'. a func is
+# parsed once into a restricted syntax tree: x, numbers, strings, None, dict literals and their .get, arithmetic,
+# comparisons, and/or/not, if/else and int, round, min, max and abs. anything else is refused, so a pedal yaml can't
+# run code. the tree is turned into nested closures, and the results for 0 - 127 are kept in a lookup table.
+import ast
+import threading
+
+import EventLog
+
+'''   ############ USAGE ###############
+logger.info("info message")
+logger.warning("warning message")
+logger.error("error message")
+'''
+logger = EventLog.get_logger(__name__)
+
+VARIABLE = "x"
+LUT_RANGE = range(0, 128)  # midi data byte values, precomputed for every func
+# a pedal yaml must not be able to make a func allocate without limit: '1 << 1000000000' or '"a" * 1000000000'.
+# the string cap is on the length of the result, so chaining '*' or '+' doesn't get around it
+MAX_SHIFT = 64
+MAX_STRING = 1024
+
+
+def divide(a, b):
+    """ '/' the way python 2 does it, which is what the pedal configs were written for: whole numbers stay whole """
+    if isinstance(a, (int, long)) and isinstance(b, (int, long)):
+        return a // b
+    return a / b
+
+
+def check_string_length(length):
+    if length > MAX_STRING:
+        raise FuncExpressionError("a string can be at most " + str(MAX_STRING) + " characters, not " + str(length))
+
+
+def add(a, b):
+    """ '+', joining strings up to MAX_STRING characters """
+    if isinstance(a, basestring) and isinstance(b, basestring):
+        check_string_length(len(a) + len(b))
+    return a + b
+
+
+def multiply(a, b):
+    """ '*', repeating a string up to MAX_STRING characters """
+    if isinstance(a, basestring) and isinstance(b, (int, long)):
+        check_string_length(len(a) * b)
+    elif isinstance(b, basestring) and isinstance(a, (int, long)):
+        check_string_length(len(b) * a)
+    return a * b
+
+
+def modulo(a, b):
+    """ '%' of numbers only, string formatting could be asked for a field of any width """
+    if isinstance(a, basestring):
+        raise FuncExpressionError("'%' is not allowed on strings")
+    return a % b
+
+
+def shift_left(a, b):
+    if b > MAX_SHIFT:
+        raise FuncExpressionError("a shift can be at most " + str(MAX_SHIFT) + " bits, not " + str(b))
+    return a << b
+
+
+BINARY_OPERATORS = {
+    ast.Add: add,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: multiply,
+    ast.Div: divide,
+    ast.FloorDiv: lambda a, b: a // b,
+    ast.Mod: modulo,
+    ast.BitAnd: lambda a, b: a & b,
+    ast.BitOr: lambda a, b: a | b,
+    ast.LShift: shift_left,
+    ast.RShift: lambda a, b: a >> b,
+}
+UNARY_OPERATORS = {
+    ast.USub: lambda a: -a,
+    ast.UAdd: lambda a: +a,
+    ast.Not: lambda a: not a,
+}
+COMPARE_OPERATORS = {
+    ast.Eq: lambda a, b: a == b,
+    ast.NotEq: lambda a, b: a != b,
+    ast.Lt: lambda a, b: a < b,
+    ast.LtE: lambda a, b: a <= b,
+    ast.Gt: lambda a, b: a > b,
+    ast.GtE: lambda a, b: a >= b,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+}
+FUNCTIONS = {
+    "int": int,
+    "round": lambda v, digits=0: int(round(v)) if digits == 0 else round(v, digits),
+    "min": min,
+    "max": max,
+    "abs": abs,
+}
+CONSTANT_NAMES = {"None": None, "True": True, "False": False}
+
+
+class FuncExpressionError(ValueError):
+    pass
+
+
+def constant(value):
+    return lambda x: value
+
+
+def compile_node(node, func):
+    """ turn a node of the syntax tree into a function of x. func is the whole expression, for the error messages """
+    if isinstance(node, ast.Expression):
+        return compile_node(node.body, func)
+    elif isinstance(node, ast.Name):
+        if node.id == VARIABLE:
+            return lambda x: x
+        elif node.id in CONSTANT_NAMES:
+            return constant(CONSTANT_NAMES[node.id])
+    elif type(node).__name__ in ["Num", "Str", "Bytes", "NameConstant", "Constant"]:
+        return constant(getattr(node, 'n', getattr(node, 's', getattr(node, 'value', None))))
+    elif isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        return binary(BINARY_OPERATORS[type(node.op)], compile_node(node.left, func), compile_node(node.right, func))
+    elif isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+        operand = compile_node(node.operand, func)
+        operator = UNARY_OPERATORS[type(node.op)]
+        return lambda x: operator(operand(x))
+    elif isinstance(node, ast.Compare) and all(type(op) in COMPARE_OPERATORS for op in node.ops):
+        return compare(compile_node(node.left, func), [COMPARE_OPERATORS[type(op)] for op in node.ops],
+                       [compile_node(comparator, func) for comparator in node.comparators])
+    elif isinstance(node, ast.BoolOp):
+        values = [compile_node(value, func) for value in node.values]
+        if isinstance(node.op, ast.And):
+            return lambda x: bool_and(values, x)
+        return lambda x: bool_or(values, x)
+    elif isinstance(node, ast.IfExp):
+        test = compile_node(node.test, func)
+        body = compile_node(node.body, func)
+        orelse = compile_node(node.orelse, func)
+        return lambda x: body(x) if test(x) else orelse(x)
+    elif isinstance(node, ast.Dict):
+        if None in node.keys:
+            raise FuncExpressionError("'**' is not allowed in func: " + func)
+        items = [(compile_node(key, func), compile_node(value, func)) for key, value in zip(node.keys, node.values)]
+        return lambda x: dict((key(x), value(x)) for key, value in items)
+    elif isinstance(node, ast.Call) and not node.keywords and not getattr(node, 'starargs', None) \
+            and not getattr(node, 'kwargs', None):
+        args = [compile_node(arg, func) for arg in node.args]
+        if isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS:
+            function = FUNCTIONS[node.func.id]
+            return lambda x: function(*[arg(x) for arg in args])
+        elif isinstance(node.func, ast.Attribute) and node.func.attr == "get" and isinstance(node.func.value, ast.Dict):
+            mapping = compile_node(node.func.value, func)
+            if not uses_variable(node.func.value):
+                mapping = constant(mapping(None))  # a literal, so it only has to be built once
+            if 1 <= len(args) <= 2:
+                key = args[0]
+                default = args[1] if len(args) == 2 else constant(None)
+                return lambda x: mapping(x).get(key(x), default(x))
+    raise FuncExpressionError("'" + type(node).__name__ + "' is not allowed in func: " + func)
+
+
+def uses_variable(node):
+    return any(isinstance(child, ast.Name) and child.id == VARIABLE for child in ast.walk(node))
+
+
+def binary(operator, left, right):
+    return lambda x: operator(left(x), right(x))
+
+
+def compare(left, operators, comparators):
+    def compare_all(x):
+        a = left(x)
+        for operator, comparator in zip(operators, comparators):
+            b = comparator(x)
+            if not operator(a, b):
+                return False
+            a = b
+        return True
+    return compare_all
+
+
+def bool_and(values, x):
+    result = True
+    for value in values:
+        result = value(x)
+        if not result:
+            return result
+    return result
+
+
+def bool_or(values, x):
+    result = False
+    for value in values:
+        result = value(x)
+        if result:
+            return result
+    return result
+
+
+class FuncExpression(object):
+    """ a compiled func. call it with x like the lambda eval used to build """
+
+    def __init__(self, func):
+        self.func = func
+        try:
+            tree = ast.parse(func.strip(), mode='eval')
+        except SyntaxError as e:
+            raise FuncExpressionError("func is not an expression: " + func + " (" + str(e) + ")")
+        self.evaluate = compile_node(tree, func)
+        self.lut = {}
+        for x in LUT_RANGE:
+            try:
+                self.lut[x] = self.evaluate(x)
+            except Exception:
+                pass  # not defined for x, calling it with x raises the error again
+
+    def __call__(self, x):
+        if type(x) is int:
+            result = self.lut.get(x, self.lut)
+            if result is not self.lut:
+                return result
+        return self.evaluate(x)
+
+    def __repr__(self):
+        return "FuncExpression(" + repr(self.func) + ")"
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def compile_func(func):
+    """ the FuncExpression for a func string, compiled the first time it is asked for """
+    expression = _cache.get(func, None)
+    if expression is None:
+        with _cache_lock:
+            expression = _cache.get(func, None)
+            if expression is None:
+                expression = FuncExpression(func)
+                _cache[func] = expression
+    return expression
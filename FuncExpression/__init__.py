@@ -0,0 +1 @@
+from FuncExpression import *
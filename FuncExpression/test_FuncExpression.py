@@ -0,0 +1,35 @@
+# tests of the limits on what a func can allocate: python -m unittest discover -s FuncExpression -p "test_*.py"
+import unittest
+
+import FuncExpression
+
+
+class StringLimitTest(unittest.TestCase):
+
+    def assert_refused(self, func):
+        self.assertRaises(FuncExpression.FuncExpressionError, FuncExpression.FuncExpression(func), 0)
+
+    def test_repeat(self):
+        self.assertEqual(FuncExpression.FuncExpression('"ab" * 3')(0), "ababab")
+        self.assertEqual(len(FuncExpression.FuncExpression('3 * "a" * 100')(0)), 300)
+        self.assert_refused('"a" * 100000')
+        self.assert_refused('100000 * "a"')
+
+    def test_chained_repeat(self):
+        self.assert_refused('"a" * 1000 * 1000')
+        self.assert_refused('"a" * 1000 * 1000 * 1000')
+        self.assert_refused('"a" * 32 * 32 * 32')
+        self.assert_refused('("a" * 1000) * 1000')
+
+    def test_join(self):
+        self.assertEqual(FuncExpression.FuncExpression('"a" + "b"')(0), "ab")
+        self.assert_refused('"a" * 1000 + "a" * 1000')
+
+    def test_numbers(self):
+        self.assertEqual(FuncExpression.FuncExpression("x * 1000 * 1000 + 1")(2), 2000001)
+        self.assertEqual(FuncExpression.FuncExpression("1 << 64")(0), 1 << 64)
+        self.assert_refused("1 << 1000000")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+# footswitch to wire latency. a trace is started when an interrupt reaches the button callback, every stage of the
+# hot path marks the time it got there, and finished traces go into per action histograms.
+import json
+import os
+import threading
+import time
+
+import EventLog
+import MonotonicClock
+
+'''   ############ USAGE ###############
+logger.info("info message")
+logger.warning("warning message")
+logger.error("error message")
+'''
+logger = EventLog.get_logger(__name__)
+
+LATENCY_FOLDER = "/home/pi/MidiController/Latency/"
+STAGE_INTERRUPT = "interrupt"
+STAGE_REGISTER_READ = "register read"
+STAGE_DISPATCH = "dispatch"
+STAGE_MIDI_QUEUED = "midi queued"
+STAGE_MIDI_WRITTEN = "midi written"
+STAGE_OLED_SENT = "oled sent"
+STAGES = [STAGE_INTERRUPT, STAGE_REGISTER_READ, STAGE_DISPATCH, STAGE_MIDI_QUEUED, STAGE_MIDI_WRITTEN,
+          STAGE_OLED_SENT]
+# histogram bucket upper bounds in milliseconds, the last bucket takes everything above
+BUCKETS_MS = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000]
+SAMPLE_WINDOW = 1024  # percentiles are taken over the last SAMPLE_WINDOW samples
+
+_enabled = False  # changed through set_enabled, the package's 'from Latency import *' only copied the value
+_local = threading.local()
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+class LatencyHistogram(object):
+    """ latencies of one stage of one action: bucket counts and max since the start, and the last SAMPLE_WINDOW
+    samples for the percentiles """
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.max = 0.0
+        self.samples = []
+        self.next_index = 0
+
+    def add(self, ms):
+        i = 0
+        while i < len(BUCKETS_MS) and ms > BUCKETS_MS[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.max = max(self.max, ms)
+        if len(self.samples) < SAMPLE_WINDOW:
+            self.samples.append(ms)
+        else:
+            self.samples[self.next_index] = ms
+        self.next_index = (self.next_index + 1) % SAMPLE_WINDOW
+
+    def summary(self):
+        samples = sorted(self.samples)
+        return {
+            'count': self.count,
+            'p50_ms': samples[len(samples) // 2] if samples else None,
+            'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))] if samples else None,
+            'max_ms': self.max,
+            'histogram': [[bound, count] for bound, count in zip(BUCKETS_MS + ["inf"], self.buckets)],
+        }
+
+
+class Trace(object):
+    """ the stage timestamps of one press. it is finished once the callback that started it is done and every midi
+    message it queued has been written, whichever comes last """
+
+    def __init__(self, action, start=None):
+        self.action = action
+        self.start = MonotonicClock.monotonic() if start is None else start
+        self.marks = {STAGE_INTERRUPT: self.start}
+        self.holds = 1  # released by 'end'
+        self.lock = threading.Lock()
+
+    def mark(self, stage):
+        """ time the trace got to stage. a stage reached more than once keeps the last time, e.g. the last midi
+        message written """
+        with self.lock:
+            self.marks[stage] = MonotonicClock.monotonic()
+
+    def hold(self):
+        with self.lock:
+            self.holds += 1
+
+    def release(self):
+        with self.lock:
+            self.holds -= 1
+            finished = self.holds == 0
+        if finished:
+            record(self)
+
+
+def set_enabled(on):
+    global _enabled
+    _enabled = bool(on)
+
+
+def is_enabled():
+    return _enabled
+
+
+def begin(action=None, start=None):
+    """ start a trace for the current thread, at interrupt entry. a press decided by a timer (e.g. a long press) starts
+    it from the time the press was decided, 'start'. returns None when latency tracing is off """
+    if not _enabled:
+        return None
+    _local.trace = Trace(action, start)
+    return _local.trace
+
+
+def current():
+    """ the trace of the current thread, or None """
+    return getattr(_local, 'trace', None)
+
+
+def mark(stage):
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.mark(stage)
+
+
+def set_action(action):
+    """ name the press once it is known what it does, the histograms are per action """
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.action = action
+
+
+def end():
+    """ the callback is done with the current trace """
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        _local.trace = None
+        trace.release()
+
+
+def record(trace):
+    """ add the time from interrupt entry to each stage of a finished trace to the histograms of its action """
+    action = trace.action or "unknown"
+    with _histograms_lock:
+        stages = _histograms.setdefault(action, {})
+        for stage, timestamp in trace.marks.items():
+            if stage != STAGE_INTERRUPT:
+                stages.setdefault(stage, LatencyHistogram()).add((timestamp - trace.start) * 1000.0)
+
+
+def summary():
+    """ {action: {stage: {count, p50_ms, p99_ms, max_ms, histogram}}}, times from interrupt entry """
+    with _histograms_lock:
+        return {action: {stage: histogram.summary() for stage, histogram in stages.items()}
+                for action, stages in _histograms.items()}
+
+
+def reset():
+    with _histograms_lock:
+        _histograms.clear()
+
+
+def dump(path=None):
+    """ write the summary to a json file. returns the path of the file """
+    if path is None:
+        if not os.path.isdir(LATENCY_FOLDER):
+            os.makedirs(LATENCY_FOLDER)
+        path = LATENCY_FOLDER + "latency-" + time.strftime("%Y%m%d-%H%M%S") + ".json"
+    with open(path, 'w') as latency_file:
+        json.dump({'stages': STAGES, 'buckets_ms': BUCKETS_MS, 'actions': summary()}, latency_file, indent=2,
+                  sort_keys=True)
+    logger.info("Latency histograms dumped to " + path)
+    return path
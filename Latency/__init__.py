@@ -0,0 +1 @@
+from Latency import *
@@ -1,26 +1,433 @@
 # import serial #if using pi for MIDI. I changed to using the Arduino Pro Micro
 # import smbus #used for i2c #THE OLD i2c WAY
-import Adafruit_GPIO.I2C as I2C  # THE NEW WAY
+import collections
+import os
+import threading
 import time
 import logging
 
+import EventLog
+import Latency
+import MidiCapture
+import MidiClock
+import MonotonicClock
+import MidiTransport
+
 '''   ############ USAGE ###############
 logger.debug("debug message")
 logger.info("info message")
 logger.warning("warning message")
 logger.error("error message")
 '''
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-logger.propagate = False
-# create console handler and set level to info
-handler = logging.StreamHandler()
-handler.setLevel(logging.INFO)
-formatter = logging.Formatter("%(asctime)s [MIDI.py] [%(levelname)-5.5s]  %(message)s")
-handler.setFormatter(formatter)
-logger.addHandler(handler)
+logger = EventLog.get_logger(__name__)
+
+
+def running_status_encode(messages):
+    """ join a burst of messages into one byte string, leaving out every status byte that repeats the one before it
+    (midi running status). sysex and system common messages cancel running status, realtime bytes leave it alone. """
+    encoded = []
+    running_status = None
+    for msg in messages:
+        status = ord(msg[0])
+        if status >= 0xF8:
+            encoded.append(msg)
+        elif status >= 0xF0 or status < 0x80:  # < 0x80 is the rest of a sysex streamed in chunks
+            running_status = None
+            encoded.append(msg)
+        elif status == running_status:
+            encoded.append(msg[1:])
+        else:
+            running_status = status
+            encoded.append(msg)
+    return "".join(encoded)
+
+
+def data_length(status):
+    """ number of data bytes that follow a status byte. None for sysex, which runs until its end byte """
+    if status < 0xF0:
+        return 1 if 0xC0 <= status <= 0xDF else 2
+    return {0xF0: None, 0xF1: 1, 0xF2: 2, 0xF3: 1}.get(status, 0)
+
+
+def running_status_decode(stream):
+    """ split a byte string back into complete messages, putting back the status bytes running status left out """
+    messages = []
+    running_status = None
+    i = 0
+    while i < len(stream):
+        status = ord(stream[i])
+        if status >= 0xF8:
+            messages.append(stream[i])
+            i += 1
+            continue
+        if status & 0x80:
+            i += 1
+            running_status = status if status < 0xF0 else None
+        elif running_status is None:
+            raise ValueError("Data byte " + hex(status) + " without a status byte at " + str(i) + ".")
+        else:
+            status = running_status
+        length = data_length(status)
+        if length is None:
+            end = stream.index("\xF7", i) + 1
+            messages.append(chr(status) + stream[i:end])
+            i = end
+        else:
+            messages.append(chr(status) + stream[i:i + length])
+            i += length
+    return messages
+
+
+# output lanes of the MidiOutputQueue. lower lanes are always drained first so program changes (and the bank selects
+# that have to go out with them) leave before parameter ccs, and sysex dumps never hold anything else up.
+LANE_REALTIME = 0
+LANE_PROGRAM = 1
+LANE_CONTROL = 2
+LANE_SYSEX = 3
+LANE_COUNT = 4
+BANK_SELECT_CCS = [0, 32]
+SYSEX_BLOCKED_LANES = [LANE_PROGRAM, LANE_CONTROL]
+# a sysex is sent in chunks of SYSEX_CHUNK_SIZE bytes, never more than SYSEX_BUDGET bytes ahead of what the receiver
+# can have worked through at SYSEX_BYTE_RATE (3125 bytes a second is the speed of a midi din cable)
+SYSEX_CHUNK_SIZE = 32
+SYSEX_BUDGET = 256
+SYSEX_BYTE_RATE = 3125.0
+
+
+def message_lane(msg):
+    """ pick the output lane for a midi message from its status byte """
+    status = ord(msg[0])
+    if status >= 0xF8:
+        return LANE_REALTIME
+    elif status >= 0xF0 or status < 0x80:  # a chunk that doesn't start with a status byte continues a sysex
+        return LANE_SYSEX
+    elif status & 0xF0 == 0xC0:
+        return LANE_PROGRAM
+    elif status & 0xF0 == 0xB0 and len(msg) > 1 and ord(msg[1]) in BANK_SELECT_CCS:
+        return LANE_PROGRAM
+    return LANE_CONTROL
+
+
+def sent_log_level(messages):
+    """ realtime messages only log at debug, the clock sends 24 of them every beat """
+    if all(ord(msg[0]) >= 0xF8 for msg in messages):
+        return logging.DEBUG
+    return logging.INFO
+
+
+def sysex_left_open(chunk, was_open):
+    """ whether a sysex is still open after chunk was sent """
+    start = chunk.rfind("\xF0")
+    end = chunk.rfind("\xF7")
+    if start == end:  # neither in the chunk
+        return was_open
+    return start > end
+
+
+class MidiShadow(object):
+    """ the last value sent for every cc, and the last program, of every channel. MIDI.send and MIDI.send_burst keep
+    it up to date, so it is what the pedals have been told, including what is still waiting in the output queue. a
+    program change clears the ccs of its channel (except bank select), loading a preset sets them on the pedal. """
+
+    def __init__(self):
+        self.values = {}  # {status + cc: value} for ccs, {status: program} for program changes
+        self.lock = threading.Lock()
+
+    def record(self, messages):
+        with self.lock:
+            for msg in messages:
+                status = ord(msg[0])
+                if status & 0xF0 == 0xB0 and len(msg) == 3:
+                    self.values[msg[:2]] = msg[2]
+                elif status & 0xF0 == 0xC0 and len(msg) == 2:
+                    cc_status = chr(0xB0 | (status & 0x0F))
+                    for key in [key for key in self.values if len(key) == 2 and key[0] == cc_status and
+                                ord(key[1]) not in BANK_SELECT_CCS]:
+                        del self.values[key]
+                    self.values[msg[0]] = msg[1]
+
+    def changed(self, messages, trigger_ccs=()):
+        """ the messages that change something, leaving out each cc or program change that sets what was last sent.
+        kept anyway: ccs in trigger_ccs (tap tempo and the like, sending them again does something), a cc that is in
+        messages more than once (e.g. a tempo sent as hundreds then tens on one cc), ccs after a program change that
+        goes out and a program change after a bank select that goes out. """
+        cc_counts = collections.Counter(msg[:2] for msg in messages if ord(msg[0]) & 0xF0 == 0xB0)
+        reset_channels = set()  # a program change or bank select was kept for these
+        result = []
+        with self.lock:
+            for msg in messages:
+                status = ord(msg[0])
+                channel = status & 0x0F
+                redundant = False
+                if status & 0xF0 == 0xB0 and len(msg) == 3:
+                    redundant = channel not in reset_channels and ord(msg[1]) not in trigger_ccs and \
+                        cc_counts[msg[:2]] == 1 and self.values.get(msg[:2], None) == msg[2]
+                    if not redundant and ord(msg[1]) in BANK_SELECT_CCS:
+                        reset_channels.add(channel)
+                elif status & 0xF0 == 0xC0 and len(msg) == 2:
+                    redundant = channel not in reset_channels and self.values.get(msg[0], None) == msg[1]
+                    if not redundant:
+                        reset_channels.add(channel)
+                if not redundant:
+                    result.append(msg)
+        return result
+
+    def invalidate(self, channel=None):
+        """ forget what was sent on a channel (0 - 15), or on all of them, e.g. after a pedal was power cycled """
+        with self.lock:
+            if channel is None:
+                self.values.clear()
+            else:
+                for key in [key for key in self.values if ord(key[0]) & 0x0F == channel]:
+                    del self.values[key]
+
+
+class MidiOutputQueue(object):
+    """ bounded, multi lane queue of midi messages waiting for the writer thread. 'put' blocks while the queue is
+    full (backpressure) and 'flush' waits until everything queued so far has actually been written. while a sysex
+    streamed in chunks is open only realtime messages may go out between its chunks, anything else would end it. """
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.lanes = [collections.deque() for _ in range(LANE_COUNT)]
+        self.size = 0
+        self.in_flight = 0
+        self.dropped = 0
+        self.sysex_open = False
+        self.condition = threading.Condition()
+
+    def put(self, msg, lane=None, block=True, timeout=None, source=None, trace=None):
+        """ queue a message, with the (pedal, action) it came from and the latency trace of the press that sent it.
+        returns False if it could not be queued because the queue stayed full. realtime messages never wait for room,
+        a late clock tick is worse than a missing one. """
+        if lane is None:
+            lane = message_lane(msg)
+        with self.condition:
+            # the rest of an open sysex never waits for room, the messages filling the queue can't go out before it
+            if self.size >= self.capacity and not (lane == LANE_SYSEX and self.sysex_open):
+                if lane == LANE_REALTIME or not block or not self._wait(self._has_room, timeout):
+                    self.dropped += 1
+                    logger.warning("MIDI output queue full, dropped: %r", msg)
+                    return False
+            self.lanes[lane].append((msg, source, trace))
+            if trace is not None:
+                trace.hold()  # released by the writer once the message is written
+            self.size += 1
+            self.condition.notify_all()
+        return True
+
+    def put_burst(self, messages, block=True, timeout=None, sources=None, trace=None):
+        """ queue a list of messages; returns how many were queued """
+        queued = 0
+        for i, msg in enumerate(messages):
+            if self.put(msg, block=block, timeout=timeout, source=sources[i] if sources else None, trace=trace):
+                queued += 1
+        return queued
+
+    def take(self, max_messages, timeout=None):
+        """ writer side. waits for messages and returns up to max_messages (message, source, trace), highest priority
+        lane first. everything handed out has to be acknowledged with 'task_done' once it has been written. """
+        with self.condition:
+            if not self._wait(self._has_ready, timeout):
+                return []
+            messages = []
+            for i, lane in enumerate(self.lanes):
+                while lane and len(messages) < max_messages and not (self.sysex_open and i in SYSEX_BLOCKED_LANES):
+                    item = lane.popleft()
+                    if i == LANE_SYSEX:
+                        self.sysex_open = sysex_left_open(item[0], self.sysex_open)
+                    messages.append(item)
+            self.size -= len(messages)
+            self.in_flight += len(messages)
+            self.condition.notify_all()
+            return messages
+
+    def task_done(self, count):
+        with self.condition:
+            self.in_flight -= count
+            self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """ wait until the queue is empty and nothing is being written. returns False on timeout """
+        with self.condition:
+            return self._wait(lambda: self.size == 0 and self.in_flight == 0, timeout)
+
+    def sysex_lane_empty(self):
+        return not self.lanes[LANE_SYSEX]
+
+    def wait_for_sysex_lane(self, timeout=None):
+        """ wait until every queued sysex chunk has been handed to the writer """
+        with self.condition:
+            return self._wait(self.sysex_lane_empty, timeout)
+
+    def _has_room(self):
+        return self.size < self.capacity
+
+    def _has_ready(self):
+        """ whether there is something 'take' may hand out now """
+        if self.sysex_open:
+            return bool(self.lanes[LANE_REALTIME] or self.lanes[LANE_SYSEX])
+        return self.size > 0
+
+    def _wait(self, predicate, timeout):
+        """ wait on the condition (already held) until predicate is true or the timeout runs out """
+        end = None if timeout is None else time.time() + timeout
+        while not predicate():
+            if end is None:
+                self.condition.wait()
+            else:
+                remaining = end - time.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+
+class MidiWriterThread(threading.Thread):
+    """ the one thread that drains the MidiOutputQueue onto the bus """
+
+    def __init__(self, output_queue, write_burst, batch_size=32):
+        threading.Thread.__init__(self)
+        self.name = "MIDI-Writer-Thread"
+        self.daemon = True
+        self.output_queue = output_queue
+        self.write_burst = write_burst
+        self.batch_size = batch_size
+        self.running = True
+
+    def run(self):
+        logger.info("Starting " + self.name)
+        while self.running:
+            items = self.output_queue.take(self.batch_size, timeout=0.5)
+            if items:
+                try:
+                    self.write_burst([msg for msg, source, trace in items], [source for msg, source, trace in items])
+                except Exception as e:
+                    logger.exception(e)
+                finally:
+                    self.output_queue.task_done(len(items))
+                for msg, source, trace in items:
+                    if trace is not None:
+                        trace.mark(Latency.STAGE_MIDI_WRITTEN)
+                        trace.release()
+        logger.info("Exiting " + self.name)
+
+    def stop(self):
+        self.running = False
+
+
+def sysex_chunks(data, chunk_size):
+    """ split sysex data into chunks of at most chunk_size bytes. data is a byte string, a file open for reading
+    (e.g. a .syx preset dump), or an iterable of byte strings or ints, so a dump can be generated as it is sent """
+    if isinstance(data, (str, bytearray)):
+        data = str(data)
+        for i in range(0, len(data), chunk_size):
+            yield data[i:i + chunk_size]
+    elif hasattr(data, 'read'):
+        while True:
+            chunk = data.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        pending = ""
+        for part in data:
+            pending += chr(part) if isinstance(part, int) else part
+            while len(pending) >= chunk_size:
+                yield pending[:chunk_size]
+                pending = pending[chunk_size:]
+        if pending:
+            yield pending
+
+
+def sysex_size(data):
+    """ the size of sysex data in bytes, if it can be known before it is read """
+    if isinstance(data, (str, bytearray)):
+        return len(data)
+    elif hasattr(data, 'fileno'):
+        try:
+            return os.fstat(data.fileno()).st_size - data.tell()
+        except (OSError, IOError, AttributeError):
+            return None
+    return None
 
-i2c_device = I2C.get_i2c_device(address=0x04, busnum=I2C.get_default_bus())
+
+class SysexPacer(object):
+    """ token bucket for the receive buffer of a pedal: bytes sent count against budget until the pedal has had
+    time to work through them at byte_rate """
+
+    def __init__(self, budget=SYSEX_BUDGET, byte_rate=SYSEX_BYTE_RATE):
+        self.budget = budget
+        self.byte_rate = float(byte_rate)
+        self.level = 0.0
+        self.last = MonotonicClock.monotonic()
+
+    def drain(self):
+        now = MonotonicClock.monotonic()
+        self.level = max(0.0, self.level - (now - self.last) * self.byte_rate)
+        self.last = now
+
+    def wait(self, byte_count):
+        """ wait until byte_count more bytes fit in the budget, then count them """
+        self.drain()
+        excess = self.level + byte_count - self.budget
+        if excess > 0:
+            time.sleep(excess / self.byte_rate)
+            self.drain()
+        self.level += byte_count
+
+
+class SysexStream(threading.Thread):
+    """ sends one sysex stream (one or more sysex messages back to back) in paced chunks. with the output queue
+    running the chunks go through the sysex lane, so realtime messages still go out in between. 'run' sends it on
+    the calling thread, 'start' in the background. progress is called with (bytes sent, total bytes or None) after
+    every chunk. """
+    lock = threading.Lock()  # one stream at a time, two interleaved would garble each other
+
+    def __init__(self, data, progress=None, source=None, chunk_size=None, budget=None, byte_rate=None):
+        threading.Thread.__init__(self)
+        self.name = "MIDI-Sysex-Thread"
+        self.daemon = True
+        self.data = data
+        self.progress = progress
+        self.source = source
+        self.chunk_size = chunk_size or MIDI.sysex_chunk_size
+        self.pacer = SysexPacer(budget or MIDI.sysex_budget, byte_rate or MIDI.sysex_byte_rate)
+        self.chunk_size = min(self.chunk_size, self.pacer.budget)
+        self.total = sysex_size(data)
+        self.sent = 0
+        self.error = None
+
+    def run(self):
+        with SysexStream.lock:
+            sysex_open = False
+            try:
+                for chunk in sysex_chunks(self.data, self.chunk_size):
+                    if not self.sent and chunk[0] != "\xF0":
+                        raise ValueError("Sysex data has to start with 0xF0, not " + hex(ord(chunk[0])) + ".")
+                    self.send_chunk(chunk)
+                    sysex_open = sysex_left_open(chunk, sysex_open)
+            except Exception as e:
+                self.error = e
+                logger.exception(e)
+            if sysex_open:
+                logger.warning("Sysex stream ended without 0xF7, ending it.")
+                self.send_chunk("\xF7")
+            if MIDI.output_queue is not None:
+                MIDI.output_queue.wait_for_sysex_lane()
+        logger.info("Sysex stream of " + str(self.sent) + " bytes sent.")
+
+    def send_chunk(self, chunk):
+        self.pacer.wait(len(chunk))
+        if MIDI.output_queue is not None:
+            # keep at most one chunk waiting, so the pacing holds for when the chunks are actually written
+            MIDI.output_queue.wait_for_sysex_lane()
+            MIDI.output_queue.put(chunk, LANE_SYSEX, source=self.source)
+        else:
+            MIDI.write(chunk, self.source)
+        self.sent += len(chunk)
+        if self.progress is not None:
+            self.progress(self.sent, self.total)
 
 
 class MIDI(object):
@@ -30,6 +437,23 @@ class MIDI(object):
     pc_dict = {"1": "\xC0", "2": "\xC1", "3": "\xC2", "4": "\xC3", "5": "\xC4",
                "6": "\xC5", "7": "\xC6", "8": "\xC7", "9": "\xC8", "10": "\xC9", "11": "\xCA",
                "12": "\xCB", "13": "\xCC", "14": "\xCD", "15": "\xCE", "16": "\xCF"}
+    # where the bytes go, picked by the 'transport' section of the midi config. see MidiTransport
+    transport = None
+    # MidiCaptureBuffer that keeps every written message, when capture is on
+    capture = None
+    # when True bursts are sent with running status, set from the 'running_status' option in midi_controller.yaml
+    running_status = False
+    # when an output queue is running, messages are queued for the writer thread instead of written by the caller
+    output_queue = None
+    writer_thread = None
+    # MidiClock thread sending 24 ppqn clock at the song tempo, when the clock is on
+    clock = None
+    # the last cc values and programs sent on every channel
+    shadow = MidiShadow()
+    # chunking and pacing of streamed sysex, from the 'sysex' section of the midi config
+    sysex_chunk_size = SYSEX_CHUNK_SIZE
+    sysex_budget = SYSEX_BUDGET
+    sysex_byte_rate = SYSEX_BYTE_RATE
 
     def __init__(self, channel):
         self.cc_channel = self.cc_dict[str(channel)]
@@ -40,21 +464,154 @@ class MIDI(object):
             message = self.cc_channel + change_num + value
         else:
             message = self.cc_channel + change_num + chr(127)
-        self.write(message)
+        self.send(message)
 
     def midi_pc_tx(self, change_num, value=None):
         if value is not None:
             message = self.pc_channel + change_num + value
         else:
             message = self.pc_channel + change_num
-        self.write(message)
+        self.send(message)
 
-    def sysex_tx(self, message):
-        self.write(message)
+    def sysex_tx(self, message, progress=None, wait=True):
+        """ send sysex: a byte string, a file or a generator. see 'stream_sysex' """
+        return self.stream_sysex(message, progress, wait)
 
     @staticmethod
-    def write(msg):
-        logger.info("MIDI sent: " + repr(msg))
-        for byte in msg:
-            i2c_device.writeRaw8(ord(byte))
-            time.sleep(0.0001)
+    def send(msg, source=None):
+        """ queue the message for the writer thread if the output queue is running, otherwise write it now. source is
+        the (pedal, action) that sent it, for the capture """
+        MIDI.shadow.record([msg])
+        if MIDI.output_queue is not None:
+            logger.debug("MIDI queued: %r", msg)
+            MIDI.output_queue.put(msg, source=source, trace=Latency.current())
+            Latency.mark(Latency.STAGE_MIDI_QUEUED)
+        else:
+            MIDI.write(msg, source)
+            Latency.mark(Latency.STAGE_MIDI_WRITTEN)
+
+    @staticmethod
+    def send_burst(messages, sources=None):
+        """ 'send' for a list of messages that belong together; sources has a (pedal, action) per message """
+        MIDI.shadow.record(messages)
+        if MIDI.output_queue is not None:
+            logger.debug("MIDI burst queued: %r", messages)
+            MIDI.output_queue.put_burst(messages, sources=sources, trace=Latency.current())
+            Latency.mark(Latency.STAGE_MIDI_QUEUED)
+        elif messages:
+            MIDI.write_burst(messages, sources)
+            Latency.mark(Latency.STAGE_MIDI_WRITTEN)
+
+    @staticmethod
+    def stream_sysex(data, progress=None, wait=True, source=None):
+        """ send sysex in paced chunks. with wait=False, and the output queue running, it is sent from a thread of
+        its own and the SysexStream is returned to follow it with (progress, join). """
+        stream = SysexStream(data, progress, source)
+        if wait or MIDI.output_queue is None:
+            stream.run()
+        else:
+            stream.start()
+        return stream
+
+    @staticmethod
+    def invalidate_shadow(channel=None):
+        """ forget what was sent on a midi channel (1 - 16), or all of them, so the next sends all go out """
+        MIDI.shadow.invalidate(None if channel is None else int(channel) - 1)
+
+    @staticmethod
+    def start_capture(capacity=4096):
+        if MIDI.capture is None:
+            MIDI.capture = MidiCapture.MidiCaptureBuffer(capacity)
+
+    @staticmethod
+    def start_output_queue(capacity=256):
+        if MIDI.output_queue is None:
+            MIDI.output_queue = MidiOutputQueue(capacity)
+            MIDI.writer_thread = MidiWriterThread(MIDI.output_queue, MIDI.write_burst)
+            MIDI.writer_thread.start()
+
+    @staticmethod
+    def stop_output_queue(timeout=2.0):
+        """ write out whatever is still queued, then stop the writer thread """
+        if MIDI.output_queue is not None:
+            MIDI.output_queue.flush(timeout)
+            MIDI.writer_thread.stop()
+            MIDI.writer_thread.join(timeout)
+            MIDI.output_queue = None
+            MIDI.writer_thread = None
+
+    @staticmethod
+    def flush(timeout=None):
+        """ wait until every queued message has been written. returns False on timeout """
+        if MIDI.output_queue is not None:
+            return MIDI.output_queue.flush(timeout)
+        return True
+
+    @staticmethod
+    def start_clock(bpm=120.0, send_start=True):
+        """ start sending midi clock. ticks go through 'send', so with the output queue running they take the
+        realtime lane and overtake everything else waiting """
+        if MIDI.clock is None:
+            MIDI.clock = MidiClock.MidiClock(MIDI.send, bpm, send_start)
+            MIDI.clock.start()
+        MIDI.clock.start_clock()
+
+    @staticmethod
+    def stop_clock(timeout=2.0):
+        if MIDI.clock is not None:
+            MIDI.clock.stop_clock()
+            MIDI.clock.stop()
+            MIDI.clock.join(timeout)
+            MIDI.clock = None
+
+    @staticmethod
+    def set_tempo(bpm):
+        """ change the tempo of the midi clock, if it is running """
+        if MIDI.clock is not None:
+            MIDI.clock.set_tempo(bpm)
+
+    @staticmethod
+    def clock_stats():
+        if MIDI.clock is not None:
+            return MIDI.clock.jitter.summary()
+        return {}
+
+    @staticmethod
+    def set_transport(transport):
+        if MIDI.transport is not None and MIDI.transport is not transport:
+            MIDI.transport.close()
+        MIDI.transport = transport
+
+    @staticmethod
+    def get_transport():
+        """ the transport in use. the i2c arduino, as it always was, if none was set """
+        if MIDI.transport is None:
+            MIDI.transport = MidiTransport.I2cArduinoTransport()
+        return MIDI.transport
+
+    @staticmethod
+    def close_transport():
+        if MIDI.transport is not None:
+            MIDI.transport.close()
+            MIDI.transport = None
+
+    @staticmethod
+    def write(msg, source=None):
+        if logger.isEnabledFor(logging.INFO):
+            logger.log(sent_log_level([msg]), "MIDI sent: %r", msg)
+        MIDI.get_transport().write_burst([msg])
+        if MIDI.capture is not None:
+            MIDI.capture.record_burst([msg], [source])
+
+    @staticmethod
+    def write_burst(messages, sources=None):
+        """ send a list of messages back to back; the transport decides how (e.g. block transfer frames) """
+        if logger.isEnabledFor(logging.INFO):
+            logger.log(sent_log_level(messages), "MIDI burst sent: %r", messages)
+        if MIDI.running_status:
+            # running status only holds inside one burst, each burst starts over with a full status byte
+            MIDI.get_transport().write_burst([running_status_encode(messages)])
+        else:
+            MIDI.get_transport().write_burst(messages)
+        if MIDI.capture is not None:
+            MIDI.capture.record_burst(messages, sources)
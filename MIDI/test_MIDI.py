@@ -0,0 +1,53 @@
+# round trip tests of midi running status: python -m unittest discover -s MIDI -p "test_*.py"
+import unittest
+
+import MIDI
+
+
+def cc(channel, number, value):
+    return chr(0xB0 | channel) + chr(number) + chr(value)
+
+
+def pc(channel, program):
+    return chr(0xC0 | channel) + chr(program)
+
+
+class RunningStatusTest(unittest.TestCase):
+
+    def assert_round_trip(self, burst, encoded_length=None):
+        encoded = MIDI.running_status_encode(burst)
+        if encoded_length is not None:
+            self.assertEqual(len(encoded), encoded_length)
+        self.assertEqual(MIDI.running_status_decode(encoded), burst)
+
+    def test_empty_burst(self):
+        self.assertEqual(MIDI.running_status_encode([]), "")
+        self.assertEqual(MIDI.running_status_decode(""), [])
+
+    def test_repeated_status_is_left_out(self):
+        self.assert_round_trip([cc(0, 7, 100), cc(0, 10, 64), cc(0, 11, 127)], 3 + 2 + 2)
+
+    def test_channel_change(self):
+        self.assert_round_trip([cc(0, 7, 100), cc(1, 7, 100), cc(1, 8, 0), cc(0, 7, 1)], 3 + 3 + 2 + 3)
+
+    def test_message_type_change(self):
+        self.assert_round_trip([pc(2, 5), pc(2, 6), cc(2, 0, 1), cc(2, 32, 0), pc(2, 7)], 2 + 1 + 3 + 2 + 2)
+
+    def test_sysex_cancels_running_status(self):
+        sysex = "\xF0\x00\x20\x33\x01\x7F\xF7"
+        burst = [cc(3, 1, 2), sysex, cc(3, 1, 3), cc(3, 1, 4)]
+        self.assert_round_trip(burst, 3 + len(sysex) + 3 + 2)
+
+    def test_realtime_keeps_running_status(self):
+        burst = [cc(4, 1, 2), "\xF8", cc(4, 1, 3), "\xFA", "\xF8", cc(4, 2, 3)]
+        self.assert_round_trip(burst, 3 + 1 + 2 + 1 + 1 + 2)
+
+    def test_system_common_cancels_running_status(self):
+        self.assert_round_trip([cc(5, 1, 2), "\xF2\x10\x20", cc(5, 1, 3), "\xF6", cc(5, 1, 4)], 3 + 3 + 3 + 1 + 3)
+
+    def test_data_byte_without_status(self):
+        self.assertRaises(ValueError, MIDI.running_status_decode, "\x07\x64")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,5 @@
 #!/usr/bin/python
-import logging
+import functools
 import math
 import sys
 import time
@@ -11,7 +11,17 @@ from flask_cors import CORS
 import RPi.GPIO as GPIO  # for interfacing with raspberrypi GPIO
 import yaml
 import EffectLoops  # package for controlling the midi devices
+import EventLog  # package for the log every module writes to
+import FileWatcher  # package for watching the song, set and pedal config folders
 import Footswitches  # package for the footswitch inputs
+import Latency  # package for the footswitch to wire latency histograms
+import MIDI  # package for the midi output path
+import MidiTransport  # package for the midi output hardware
+import Morph  # package for ramping params between parts
+import PartSongSet  # package for the setlists and their songs
+import PedalConfig  # package for compiling the pedal configs
+import PartStager  # package for working out the next parts in the background
+import PressClassifier  # package for telling short, long, double and chord presses apart
 import RotaryEncoder  # package for the rotary encoder inputs
 import flask  # package for the webapp
 
@@ -64,13 +74,42 @@ def setup():
     controller_api = {k: v for k, v in config_file['controller_api'].iteritems()}
 
     # read config objects into variables
-    # tempo = float(current_settings['tempo'])
+    tempo = float(current_settings.get('tempo', 120))
+    log_config = config_file.get('logging', None) or {}
+    # records go to a ring buffer and a writer thread, the interrupt callbacks never wait on the console
+    EventLog.configure(log_config.get('level', 'info'), bool(log_config.get('console', True)),
+                       log_config.get('file', None), int(log_config.get('ring', EventLog.RING_CAPACITY)))
+    Latency.set_enabled((config_file.get('latency', None) or {}).get('enabled', False))
     knob_color = knob['color']
     knob_brightness = int(knob['brightness'])
     mode = current_settings['mode']
     set_list = current_settings['preset']['setList']
     song = current_settings['preset']['song']
     part = current_settings['preset']['part']
+    MIDI.MIDI.set_transport(MidiTransport.open_transport(midi.get('transport', None)))
+    MIDI.MIDI.running_status = bool(midi.get('running_status', False))
+    capture = midi.get('capture', None) or {}
+    if capture.get('enabled', False):
+        # keep the last messages written in a ring buffer that can be dumped with /midi_controller/capture/dump
+        MIDI.MIDI.start_capture(int(capture.get('capacity', 4096)))
+    sysex = midi.get('sysex', None) or {}
+    # sysex is streamed in chunks paced to what the pedals can take in
+    MIDI.MIDI.sysex_chunk_size = int(sysex.get('chunk_size', MIDI.SYSEX_CHUNK_SIZE))
+    MIDI.MIDI.sysex_budget = int(sysex.get('budget', MIDI.SYSEX_BUDGET))
+    MIDI.MIDI.sysex_byte_rate = float(sysex.get('byte_rate', MIDI.SYSEX_BYTE_RATE))
+    output_queue = midi.get('output_queue', None) or {}
+    if output_queue.get('enabled', False):
+        # midi goes out from a writer thread so interrupt callbacks and web requests don't wait on the i2c bus
+        MIDI.MIDI.start_output_queue(int(output_queue.get('capacity', 256)))
+    clock = midi.get('clock', None) or {}
+    if clock.get('enabled', False):
+        # 24 ppqn midi clock, loading a part sets it to the tempo of the song
+        MIDI.MIDI.start_clock(tempo, bool(clock.get('send_start', True)))
+
+    morph = midi.get('morph', None) or {}
+    if morph.get('enabled', False):
+        # parts with a 'morph' section ramp their params, never faster than max_rate messages a second
+        Morph.start(int(morph.get('max_rate', Morph.MAX_RATE)))
 
     # make a dictionary of {midi_channel: midi_obj}
     midi_channel_dict = {}
@@ -82,21 +121,31 @@ def setup():
             if channel_name:
                 pedal_conf = MIDI_PEDAL_CONF_FOLDER + channel_name + '.yaml'
                 if path.exists(pedal_conf):
-                    # read midi config yaml file into dictionaries
-                    with open(pedal_conf, 'r') as ymlfile:
-                        midi_conf = yaml.full_load(ymlfile)
+                    # validate and compile the midi config yaml file, or take it from the cache if it didn't change
+                    channel_midi = MIDI.MIDI(int(channel))
+                    compiled_conf = PedalConfig.load_pedal_conf(pedal_conf, channel_midi.cc_channel,
+                                                                channel_midi.pc_channel)
                     midi_channel_dict.update({
                         channel_name: EffectLoops.MidiPedal(channels[channel]['name'],
-                                                            bool(channels[channel]['state']), int(channel), midi_conf,
+                                                            bool(channels[channel]['state']), int(channel),
+                                                            compiled_conf.conf,
                                                             channels[channel]['preset'].get('number',
                                                                                             channels[channel][
-                                                                                                'preset'].get('name')))
+                                                                                                'preset'].get('name')),
+                                                            compiled_conf)
                     })
                 else:
                     logger.error(
                         'Cant add ' + channel_name + ' to the dictionary because it doesnt have a config file in '
                         + MIDI_PEDAL_CONF_FOLDER + '.')
 
+    songs = config_file.get('songs', None) or {}
+    # songs are parsed when they are first used, the ones next to the current song in the background
+    PartSongSet.configure_songs(int(songs.get('cache', PartSongSet.SONG_CACHE_SIZE)),
+                                int(songs.get('prefetch', PartSongSet.PREFETCH_RADIUS)))
+    if int(songs.get('prefetch', PartSongSet.PREFETCH_RADIUS)) > 0:
+        PartSongSet.start_prefetch()
+
     # make a dictionary of {ftsw_btn: footswitch_obj}
     footswitch_dict = {}
     # initialize the rotary encoder object
@@ -108,13 +157,25 @@ def setup():
     for ftsw_btn in button_setup.keys():
         ft_sw_obj = EffectLoops.ButtonOnPedalBoard(button_setup[ftsw_btn]['function'],
                                                    button_setup[ftsw_btn].get('partner_func', None),
-                                                   button_setup[ftsw_btn].get('long_press_func', None), ftsw_btn)
+                                                   button_setup[ftsw_btn].get('long_press_func', None), ftsw_btn,
+                                                   button_setup[ftsw_btn].get('double_tap_func', None))
+        ft_sw_obj.set_press_handler(functools.partial(handle_footswitch_press, ft_sw_obj))
         footswitch_dict.update({
             str(ft_sw_obj.get_pin()): ft_sw_obj
         })
 
     # pass a list of midi_pedal objects to the rotary encoder
     rotary_push_button.set_midi_pedal_list(midi_channel_dict, mode)
+    staging = config_file.get('staging', None) or {}
+    if staging.get('enabled', False):
+        # the parts next to the current one are planned in the background, loading one only sends its burst
+        rotary_push_button.start_staging(float(staging.get('delay', PartStager.STAGE_DELAY)))
+    watch = config_file.get('watch', None) or {}
+    if watch.get('enabled', False):
+        # songs, sets and pedal configs edited on disk are read again and patched into what is loaded
+        FileWatcher.start([PartSongSet.SONG_PATH, RotaryEncoder.SET_FOLDER, MIDI_PEDAL_CONF_FOLDER],
+                          rotary_push_button.reload_files, float(watch.get('poll', FileWatcher.POLL_INTERVAL)),
+                          bool(watch.get('inotify', True)))
 
     # define the input pin on the rpi for the MCP23017 bank A and B footswitch interrupt
     GPIO.setup([BANKA_INTPIN, BANKB_INTPIN], GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
@@ -167,16 +228,7 @@ def init_logging():
     logger.warning("warning message")
     logger.error("error message")
     """
-    logging_logger = logging.getLogger(__name__)
-    logging_logger.setLevel(logging.DEBUG)
-    logging_logger.propagate = False
-    # create console handler and set level to info
-    handler = logging.StreamHandler()
-    handler.setLevel(logging.INFO)
-    formatter = logging.Formatter("%(asctime)s [midi_controller.py] [%(levelname)-5.5s]  %(message)s")
-    handler.setFormatter(formatter)
-    logging_logger.addHandler(handler)
-    return logging_logger
+    return EventLog.get_logger(__name__)
 
 
 def get_button_function_dict(button):
@@ -209,6 +261,113 @@ def dpad_button_press(direction):
     return jsonify(display_message=rotary_push_button.get_message(), controller_locked=buttons_are_locked())
 
 
+@app.route('/midi_controller/resync', methods=['GET'])
+def resync_request():
+    rotary_push_button.load_part(force_resync=True)
+    logger.info("A full midi resync of the current part was requested using the controller API.")
+    return jsonify(display_message=rotary_push_button.get_message(), controller_locked=buttons_are_locked())
+
+
+@app.route('/midi_controller/resync/<midi_pedal>', methods=['GET'])
+def resync_pedal_request(midi_pedal):
+    if midi_pedal not in rotary_push_button.midi_pedal_dict:
+        logger.warn("A midi resync was requested for " + midi_pedal + ", which is not a midi pedal in the config.")
+        return jsonify(display_message="No pedal " + midi_pedal + ".", controller_locked=buttons_are_locked())
+    rotary_push_button.resync_midi(midi_pedal)
+    logger.info("A midi resync of " + midi_pedal + " was requested using the controller API.")
+    return jsonify(display_message=rotary_push_button.get_message(), controller_locked=buttons_are_locked())
+
+
+@app.route('/midi_controller/capture/dump', methods=['GET'])
+def capture_dump_request():
+    if MIDI.MIDI.capture is None:
+        logger.warn("A midi capture dump was requested but capture is not enabled in the midi config.")
+        return jsonify(display_message="Capture is off.", capture_file=None)
+    capture_file = MIDI.MIDI.capture.dump()
+    return jsonify(display_message="Capture dumped.", capture_file=capture_file)
+
+
+@app.route('/midi_controller/clock', methods=['GET'])
+def clock_request():
+    if MIDI.MIDI.clock is None:
+        return jsonify(display_message="Clock is off.", bpm=None, jitter={})
+    return jsonify(display_message="Clock at " + str(MIDI.MIDI.clock.get_tempo()) + " bpm.",
+                   bpm=MIDI.MIDI.clock.get_tempo(), jitter=MIDI.MIDI.clock_stats())
+
+
+@app.route('/midi_controller/latency', methods=['GET'])
+def latency_request():
+    return jsonify(display_message="Latency tracing is " + ("on." if Latency.is_enabled() else "off."),
+                   latency=Latency.summary())
+
+
+@app.route('/midi_controller/latency/dump', methods=['GET'])
+def latency_dump_request():
+    latency_file = Latency.dump()
+    return jsonify(display_message="Latency dumped.", latency_file=latency_file)
+
+
+@app.route('/midi_controller/latency/reset', methods=['GET'])
+def latency_reset_request():
+    Latency.reset()
+    return jsonify(display_message="Latency reset.")
+
+
+@app.route('/midi_controller/staging', methods=['GET'])
+def staging_request():
+    if not PartStager.is_running():
+        return jsonify(display_message="Staging is off.", staging={}, songs=PartSongSet.song_cache.stats(),
+                       store=PartSongSet.song_store.stats())
+    return jsonify(display_message="Staging is on.", staging=PartStager.stats(), songs=PartSongSet.song_cache.stats(),
+                   store=PartSongSet.song_store.stats())
+
+
+@app.route('/midi_controller/presses', methods=['GET'])
+def presses_request():
+    presses = dict((button.name, button.presses.stats()) for button in footswitch_dict.values())
+    return jsonify(display_message="Presses of " + str(len(presses)) + " buttons.", presses=presses)
+
+
+@app.route('/midi_controller/library', methods=['GET'])
+def library_request():
+    library = rotary_push_button.library
+    if request.args.get('refresh', 0, type=int):
+        library.refresh()
+    return jsonify(display_message="Library of " + str(len(library.song_names)) + " songs.", library=library.stats(),
+                   sets=library.get_set_names(), songs=library.get_song_names(), pedals=library.pedals(),
+                   watcher=FileWatcher.stats())
+
+
+@app.route('/midi_controller/library/song/<song_name>', methods=['GET'])
+def library_song_request(song_name):
+    library = rotary_push_button.library
+    song = library.song(song_name)
+    if song is None:
+        return jsonify(display_message="No song " + song_name + ".", song=None, sets=[])
+    return jsonify(display_message="Song " + song_name + ".", song=song, sets=library.sets_with_song(song_name))
+
+
+@app.route('/midi_controller/library/set/<set_name>', methods=['GET'])
+def library_set_request(set_name):
+    setlist = rotary_push_button.library.setlist(set_name)
+    if setlist is None:
+        return jsonify(display_message="No set " + set_name + ".", set=None)
+    return jsonify(display_message="Set " + set_name + ".", set=setlist)
+
+
+@app.route('/midi_controller/library/pedal/<midi_pedal>', methods=['GET'])
+def library_pedal_request(midi_pedal):
+    songs = rotary_push_button.library.songs_with_pedal(midi_pedal)
+    return jsonify(display_message=str(len(songs)) + " songs use " + midi_pedal + ".", songs=songs)
+
+
+@app.route('/midi_controller/log', methods=['GET'])
+def log_request():
+    count = request.args.get('count', 100, type=int)
+    return jsonify(display_message="Last " + str(count) + " log records.", log=EventLog.recent(count),
+                   stats=EventLog.stats())
+
+
 @app.route('/help', methods=['GET'])
 def help_request():
     message = "This is the help message."
@@ -232,20 +391,22 @@ def handle_button_request(bttn_func_dict, button, config_button_press_type, func
 
 
 def handle_dpad_request(direction):
-    if direction in ['CW', 'CCW']:
-        rotary_push_button.change_menu_pos(direction)
-    elif direction == 'up':
-        rotary_push_button.handle_long_press()
-    elif direction == 'down':
-        rotary_push_button.handle_short_press()
-    else:
-        logger.warn("No action taken for invalid direction: " + direction)
+    with PressClassifier.input_lock:
+        if direction in ['CW', 'CCW']:
+            rotary_push_button.change_menu_pos(direction)
+        elif direction == 'up':
+            rotary_push_button.handle_long_press()
+        elif direction == 'down':
+            rotary_push_button.handle_short_press()
+        else:
+            logger.warn("No action taken for invalid direction: " + direction)
 
 
 def handle_button_action(button, bttn_func, execution_func):
     if not buttons_are_locked():
         logger.info("running button function: " + str(bttn_func))
-        execution_func(bttn_func)
+        with PressClassifier.input_lock:
+            execution_func(bttn_func)
         logger.info("A button press request was made on the \"" + str(button)
                     + "\" button using the controller API. Function = " + str(bttn_func))
     else:
@@ -254,12 +415,23 @@ def handle_button_action(button, bttn_func, execution_func):
 
 
 def my_encoder_callback(encoder_interrupt_pin):
-    direction = rotary_push_button.get_rotary_movement(GPIO.input(ENCODE_A), GPIO.input(ENCODE_B))
-    if direction is not None:
-        rotary_push_button.change_menu_pos(direction)
+    # long presses and double taps are handled on timer threads, a turn waits for the one being handled
+    with PressClassifier.input_lock:
+        direction = rotary_push_button.get_rotary_movement(GPIO.input(ENCODE_A), GPIO.input(ENCODE_B))
+        if direction is not None:
+            rotary_push_button.change_menu_pos(direction)
 
 
 def my_button_callback(interrupt_pin):
+    # time every stage from here to the midi and the oled, see /midi_controller/latency
+    Latency.begin()
+    try:
+        handle_button_interrupt(interrupt_pin)
+    finally:
+        Latency.end()
+
+
+def handle_button_interrupt(interrupt_pin):
     # logger.info("interrupt enter")
     # Which bank sent the interrupt; bank A (pin 4) mod 2 is 0; bank B (pin 17) mod 2 is 1
     interrupt_bank = interrupt_pin % 2
@@ -281,45 +453,58 @@ def my_button_callback(interrupt_pin):
         switch_pins.disable_interrupt_pin(int_flag_pin)
         # read value of the pin that caused the interrupt at the time of the interrupt
         interrupt_value = switch_pins.read_interrupt_cap_pin(int_flag_pin)
+        Latency.mark(Latency.STAGE_REGISTER_READ)
+        Latency.set_action(int_button.name)
         # logger.info(int_button.name + "\'s interrupt pin's value: " + str(interrupt_value))
-        # rotary push button does not have a "partner" so no need to check that one
-        if int_button.name != "RotaryPB":
-            # print interrupt_bank, intFlagPin #TESTING PURPOSES
-            # check to see if the footswitch was pressed in combination with its partner for the 2-button function
-            # like bank up, bank down, next song, etc.
-            if int_button.partner and int_button.partner.is_pressed:
-                if interrupt_value:
-                    logger.info("partner func activated.")
-                    func_name = int_button.get_partner_function()
-                    if func_name:
-                        rotary_push_button.change_and_select(func_name)
-            else:
-                # button state determines which function of the btn whose footswitch was pressed to use
-                action = int_button.button_state(interrupt_value, rotary_push_button.mode)
-                # logger.info("interrupt button's action: " + str(action))
-                if interrupt_value:
-                    if rotary_push_button.mode == "standard":
-                        if time.time() - int_button.last_action_time <= 0.5:
-                            logger.info("running standard button function: " + str(action))
-                            rotary_push_button.button_executor(action)
-                        else:
-                            logger.info("running longpress button function: " + str(action))
-                            rotary_push_button.change_and_select(action)
-                    else:
-                        logger.info("in favorite mode, this action (" + str(action) + ") is not permitted")
-            int_button.last_action_time = time.time()
-        else:
-            # logger.info("rotary func")
-            # button state determines which function of the btn whose footswitch was pressed to use
-            int_button.button_state(interrupt_value)
+        # the press classifier of the button calls its handler once it knows what the press is. a long press is
+        # decided by a timer while the switch is still down, so it is not handled in this callback
+        if int_button.name == "RotaryPB":
+            Latency.mark(Latency.STAGE_DISPATCH)
+        int_button.button_state(interrupt_value)
         # enable the interrupts on the pin of the footswitch that was pressed
         switch_pins.enable_interrupt_pin(int_flag_pin)
 
 
+def handle_footswitch_press(button, event):
+    """ run what a decided press of a footswitch does: a chord with its partner runs the partner function, a short
+    press its function, a long press or a double tap the function for that """
+    if event.kind == PressClassifier.CHORD:
+        logger.info("partner func activated.")
+        func_name = button.get_partner_function()
+    elif rotary_push_button.mode != "standard":
+        logger.info("in favorite mode, this action (" + str(button.name) + ") is not permitted")
+        return
+    elif event.kind == PressClassifier.SHORT:
+        logger.info("running standard button function: " + str(button.name))
+        Latency.set_action(str(button.name))
+        Latency.mark(Latency.STAGE_DISPATCH)
+        rotary_push_button.button_executor(button.name)
+        return
+    elif event.kind == PressClassifier.LONG:
+        func_name = button.secondary_function()
+        logger.info("running longpress button function: " + str(func_name))
+    else:
+        func_name = button.double_tap_func
+        logger.info("running double tap button function: " + str(func_name))
+    if func_name:
+        Latency.set_action(func_name)
+        Latency.mark(Latency.STAGE_DISPATCH)
+        rotary_push_button.change_and_select(func_name)
+
+
 def clean_break():
     rotary_push_button.clean_up_display()
     rotary_push_button.stop_pwm()  # this will cause the PWM to stop if anything causes the program to stop
+    FileWatcher.stop()
+    PartStager.stop()
+    PartSongSet.stop_prefetch()
+    PartSongSet.save_cache()
+    Morph.stop()
+    MIDI.MIDI.stop_clock()
+    MIDI.MIDI.stop_output_queue()  # write out anything still queued
+    MIDI.MIDI.close_transport()
     EffectLoops.unload()
+    EventLog.stop()
 
 
 if __name__ == "__main__":
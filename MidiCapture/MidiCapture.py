@@ -0,0 +1,173 @@
+# capture of everything the midi output layer writes, and a tool to replay a capture.
+# usage: python MidiCapture.py show <capture file>
+#        python MidiCapture.py replay <capture file> [max] [transport type] [transport option=value ...]
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+import EventLog
+import MidiClock
+import MonotonicClock
+
+'''   ############ USAGE ###############
+logger.info("info message")
+logger.warning("warning message")
+logger.error("error message")
+'''
+logger = EventLog.get_logger(__name__)
+
+CAPTURE_FOLDER = "/home/pi/MidiController/Captures/"
+FILE_MAGIC = "MIDICAP1"
+# one record per message: monotonic time it was written, pedal id, action id, message length and the first
+# MESSAGE_BYTES bytes of the message. ids index the name table that is dumped along with the records.
+MESSAGE_BYTES = 16
+RECORD = struct.Struct("<dHHH" + str(MESSAGE_BYTES) + "s")
+HEADER = struct.Struct("<8sIII")  # magic, record size, record count, length of the json name table
+NO_NAME = 0
+
+
+class MidiCaptureBuffer(object):
+    """ fixed size binary ring buffer of the last 'capacity' midi messages that were written """
+
+    def __init__(self, capacity=4096, record_clock=False):
+        self.capacity = capacity
+        self.record_clock = record_clock  # midi clock ticks would push everything else out of the buffer in seconds
+        self.buffer = bytearray(capacity * RECORD.size)
+        self.count = 0
+        self.names = [""]
+        self.name_ids = {"": NO_NAME}
+        self.lock = threading.Lock()
+
+    def name_id(self, name):
+        if name is None:
+            return NO_NAME
+        name_id = self.name_ids.get(name, None)
+        if name_id is None:
+            name_id = len(self.names)
+            self.names.append(name)
+            self.name_ids[name] = name_id
+        return name_id
+
+    def record_burst(self, messages, sources=None, timestamp=None):
+        """ record messages written together at timestamp. sources is a (pedal, action) pair, or None, per message """
+        if timestamp is None:
+            timestamp = MonotonicClock.monotonic()
+        with self.lock:
+            for i, msg in enumerate(messages):
+                if msg == MidiClock.CLOCK_TICK and not self.record_clock:
+                    continue
+                pedal, action = sources[i] if sources and sources[i] else (None, None)
+                RECORD.pack_into(self.buffer, (self.count % self.capacity) * RECORD.size, timestamp,
+                                 self.name_id(pedal), self.name_id(action), len(msg), msg[:MESSAGE_BYTES])
+                self.count += 1
+
+    def records(self):
+        """ the records in the buffer, oldest first, as (timestamp, pedal, action, message, message length) """
+        with self.lock:
+            first = max(0, self.count - self.capacity)
+            raw = [RECORD.unpack_from(self.buffer, (i % self.capacity) * RECORD.size) for i in range(first, self.count)]
+            names = list(self.names)
+        return [(timestamp, names[pedal_id], names[action_id], data[:min(length, MESSAGE_BYTES)], length)
+                for timestamp, pedal_id, action_id, length, data in raw]
+
+    def dump(self, path=None):
+        """ write the buffer to a capture file, oldest record first. returns the path of the file """
+        if path is None:
+            if not os.path.isdir(CAPTURE_FOLDER):
+                os.makedirs(CAPTURE_FOLDER)
+            path = CAPTURE_FOLDER + "capture-" + time.strftime("%Y%m%d-%H%M%S") + ".bin"
+        with self.lock:
+            first = max(0, self.count - self.capacity)
+            record_count = self.count - first
+            start = (first % self.capacity) * RECORD.size
+            # unwrap the ring so the file is in order
+            data = self.buffer[start:] + self.buffer[:start] if self.count > self.capacity \
+                else self.buffer[:record_count * RECORD.size]
+            name_table = json.dumps(self.names)
+        with open(path, 'wb') as capture_file:
+            capture_file.write(HEADER.pack(FILE_MAGIC, RECORD.size, record_count, len(name_table)))
+            capture_file.write(name_table)
+            capture_file.write(data)
+        logger.info("Dumped " + str(record_count) + " midi messages to " + path + ".")
+        return path
+
+
+def load_capture(path):
+    """ read a capture file. returns [(timestamp, pedal, action, message, length)], oldest first """
+    with open(path, 'rb') as capture_file:
+        magic, record_size, record_count, name_table_length = HEADER.unpack(capture_file.read(HEADER.size))
+        if magic != FILE_MAGIC or record_size != RECORD.size:
+            raise ValueError(path + " is not a midi capture file.")
+        names = json.loads(capture_file.read(name_table_length))
+        data = capture_file.read(record_count * record_size)
+    records = []
+    for i in range(record_count):
+        timestamp, pedal_id, action_id, length, msg = RECORD.unpack_from(data, i * record_size)
+        records.append((timestamp, names[pedal_id], names[action_id], msg[:min(length, MESSAGE_BYTES)], length))
+    return records
+
+
+def replay(records, transport, original_speed=True):
+    """ send the messages of a capture through a transport, either spaced out as they were captured or as fast as the
+    transport takes them. messages that were cut short in the capture (long sysex) are skipped. returns
+    (messages sent, seconds it took, captured duration) """
+    if not records:
+        return 0, 0.0, 0.0
+    first_timestamp = records[0][0]
+    start = MonotonicClock.monotonic()
+    sent = 0
+    for timestamp, pedal, action, msg, length in records:
+        if length > len(msg):
+            logger.warning("Skipping a " + str(length) + " byte message of " + str(pedal) + " that was cut short.")
+            continue
+        if original_speed:
+            delay = (timestamp - first_timestamp) - (MonotonicClock.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+        transport.write_burst([msg])
+        sent += 1
+    return sent, MonotonicClock.monotonic() - start, records[-1][0] - first_timestamp
+
+
+def show(records):
+    first_timestamp = records[0][0] if records else 0
+    for timestamp, pedal, action, msg, length in records:
+        print("{0:>10.4f}  {1:<14} {2:<24} {3}{4}".format(timestamp - first_timestamp, pedal, action,
+                                                        " ".join("%02X" % ord(byte) for byte in msg),
+                                                        " ..." if length > len(msg) else ""))
+
+
+def main(args):
+    if len(args) < 2 or args[0] not in ["show", "replay"]:
+        print("usage: python MidiCapture.py show <capture file>")
+        print("       python MidiCapture.py replay <capture file> [max] [transport type] [option=value ...]")
+        return 1
+    records = load_capture(args[1])
+    if args[0] == "show":
+        show(records)
+        return 0
+    import MidiTransport
+    options = args[2:]
+    original_speed = not (options and options[0] == "max")
+    if not original_speed:
+        options = options[1:]
+    transport_config = {}
+    if options:
+        transport_config['type'] = options[0]
+        for option in options[1:]:
+            key, value = option.split("=", 1)
+            transport_config[key] = int(value) if value.isdigit() else value
+    transport = MidiTransport.open_transport(transport_config)
+    try:
+        sent, elapsed, captured = replay(records, transport, original_speed)
+    finally:
+        transport.close()
+    print("replayed " + str(sent) + " messages in {0:.4f} s (captured over {1:.4f} s)".format(elapsed, captured))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1 @@
+from MidiCapture import *
@@ -0,0 +1,184 @@
+# midi beat clock: 24 timing clock messages per quarter note at the tempo of the current song, for pedals that sync
+# their delay time to it (TimeLine, BigSky, ...).
+import math
+import threading
+import time
+
+import EventLog
+import MonotonicClock
+
+'''   ############ USAGE ###############
+logger.info("info message")
+logger.warning("warning message")
+logger.error("error message")
+'''
+logger = EventLog.get_logger(__name__)
+
+CLOCK_TICK = "\xF8"
+CLOCK_START = "\xFA"
+CLOCK_CONTINUE = "\xFB"
+CLOCK_STOP = "\xFC"
+PPQN = 24  # clock messages per quarter note
+MIN_BPM = 40
+MAX_BPM = 500
+# the scheduler sleeps until this long before a tick and spins for the rest, sleep alone wakes up too late on the pi
+SPIN_TIME = 0.002
+# when the clock is more than this many ticks late it starts over from now instead of sending the missed ticks in a
+# burst, a burst would make the pedals jump to a much faster tempo for a moment
+MAX_TICKS_BEHIND = 2
+
+
+def tick_interval(bpm):
+    """ seconds between two clock messages at bpm """
+    return 60.0 / (bpm * PPQN)
+
+
+def clamp_bpm(bpm):
+    return min(MAX_BPM, max(MIN_BPM, float(bpm)))
+
+
+class JitterStats(object):
+    """ how late each tick went out compared to when it was scheduled, over the last 'window' ticks """
+
+    def __init__(self, window=PPQN * 60):
+        self.window = window
+        self.late = []
+        self.next_index = 0
+        self.ticks = 0
+        self.resyncs = 0
+        self.lock = threading.Lock()
+
+    def add(self, late):
+        with self.lock:
+            if len(self.late) < self.window:
+                self.late.append(late)
+            else:
+                self.late[self.next_index] = late
+            self.next_index = (self.next_index + 1) % self.window
+            self.ticks += 1
+
+    def add_resync(self):
+        with self.lock:
+            self.resyncs += 1
+
+    def reset(self):
+        with self.lock:
+            self.late = []
+            self.next_index = 0
+            self.ticks = 0
+            self.resyncs = 0
+
+    def summary(self):
+        """ jitter of the last window of ticks in milliseconds: mean, standard deviation, p50, p99 and max """
+        with self.lock:
+            late = sorted(self.late)
+            ticks = self.ticks
+            resyncs = self.resyncs
+        stats = {'ticks': ticks, 'resyncs': resyncs, 'window': len(late)}
+        if late:
+            mean = sum(late) / len(late)
+            stats.update({
+                'mean_ms': mean * 1000.0,
+                'stdev_ms': math.sqrt(sum((x - mean) ** 2 for x in late) / len(late)) * 1000.0,
+                'p50_ms': late[len(late) // 2] * 1000.0,
+                'p99_ms': late[min(len(late) - 1, int(len(late) * 0.99))] * 1000.0,
+                'max_ms': late[-1] * 1000.0,
+            })
+        return stats
+
+
+class MidiClock(threading.Thread):
+    """ sends midi clock through 'send' at the current tempo. every tick is scheduled on the monotonic clock relative
+    to the first one, so the time it takes to send a tick, and the sleep waking up late, never add up to drift. a
+    tempo change keeps the phase: the next tick is due one new interval after the last one. """
+
+    def __init__(self, send, bpm=120.0, send_start=True):
+        threading.Thread.__init__(self)
+        self.name = "MIDI-Clock-Thread"
+        self.daemon = True
+        self.send = send
+        self.send_start = send_start
+        self.interval = tick_interval(clamp_bpm(bpm))
+        self.bpm = clamp_bpm(bpm)
+        self.running = True
+        self.ticking = False
+        self.next_tick = None
+        self.jitter = JitterStats()
+        self.condition = threading.Condition()
+
+    def set_tempo(self, bpm):
+        bpm = clamp_bpm(bpm)
+        with self.condition:
+            if bpm != self.bpm:
+                logger.info("MIDI clock tempo set to " + str(bpm) + " bpm.")
+                if self.next_tick is not None:
+                    self.next_tick += tick_interval(bpm) - self.interval
+                self.bpm = bpm
+                self.interval = tick_interval(bpm)
+            self.condition.notify_all()
+
+    def get_tempo(self):
+        return self.bpm
+
+    def start_clock(self):
+        """ start sending clock, with a midi start message first if send_start is set """
+        with self.condition:
+            if not self.ticking:
+                if self.send_start:
+                    self.send(CLOCK_START)
+                self.ticking = True
+                self.next_tick = None
+                self.condition.notify_all()
+
+    def stop_clock(self):
+        with self.condition:
+            if self.ticking:
+                self.ticking = False
+                if self.send_start:
+                    self.send(CLOCK_STOP)
+                self.condition.notify_all()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def run(self):
+        logger.info("Starting " + self.name)
+        while True:
+            with self.condition:
+                while self.running and not self.ticking:
+                    self.condition.wait()
+                if not self.running:
+                    break
+                now = MonotonicClock.monotonic()
+                if self.next_tick is None or now - self.next_tick > self.interval * MAX_TICKS_BEHIND:
+                    if self.next_tick is not None:
+                        self.jitter.add_resync()
+                    self.next_tick = now
+                due = self.next_tick
+            if not self.wait_until(due):
+                continue  # woken up by a tempo change or a stop, 'due' may have moved
+            try:
+                self.send(CLOCK_TICK)
+            except Exception as e:
+                logger.exception(e)
+            self.jitter.add(MonotonicClock.monotonic() - due)
+            with self.condition:
+                if self.next_tick == due:
+                    self.next_tick = due + self.interval
+        logger.info("Exiting " + self.name)
+
+    def wait_until(self, due):
+        """ sleep, then spin, until due. returns False if the schedule changed while waiting """
+        with self.condition:
+            while True:
+                if not self.running or not self.ticking or self.next_tick != due:
+                    return False
+                remaining = due - MonotonicClock.monotonic()
+                if remaining <= SPIN_TIME:
+                    break
+                self.condition.wait(remaining - SPIN_TIME)
+        while MonotonicClock.monotonic() < due:
+            time.sleep(0)
+        return True
@@ -0,0 +1 @@
+from MidiClock import *
@@ -0,0 +1,198 @@
+import os
+import threading
+import time
+import tty
+
+import EventLog
+
+'''   ############ USAGE ###############
+logger.info("info message")
+logger.warning("warning message")
+logger.error("error message")
+'''
+logger = EventLog.get_logger(__name__)
+
+'''   ############ BLOCK TRANSFER FRAMING ###############
+in block transfer mode a frame goes to the arduino as one i2c block write:
+    FRAME_START, length, payload[0], ..., payload[length - 1], checksum
+FRAME_START (0xFD) is an undefined midi system real-time byte so it never shows up in a midi stream. the arduino
+treats a transaction that starts with it as a frame and anything else as the old one-byte-per-transaction path.
+the checksum is the xor of the length byte and every payload byte. the arduino Wire receive buffer is 32 bytes, so
+the payload of a frame is at most 29 bytes (32 minus start, length and checksum).
+'''
+FRAME_START = 0xFD
+I2C_BLOCK_MAX = 32
+FRAME_PAYLOAD_MAX = I2C_BLOCK_MAX - 3
+
+
+def frame_checksum(payload):
+    checksum = len(payload)
+    for byte in payload:
+        checksum ^= byte
+    return checksum
+
+
+def pack_frames(messages, payload_max=FRAME_PAYLOAD_MAX):
+    """ pack whole midi messages into as few frame payloads as possible. a message is only split across frames when
+    it is longer than a frame on its own (sysex) """
+    frames = []
+    frame = []
+    for msg in messages:
+        data = [ord(byte) for byte in msg]
+        if frame and len(frame) + len(data) > payload_max:
+            frames.append(frame)
+            frame = []
+        while len(data) > payload_max:
+            frames.append(data[:payload_max])
+            data = data[payload_max:]
+        frame.extend(data)
+    if frame:
+        frames.append(frame)
+    return frames
+
+
+class MidiTransport(object):
+    """ puts midi bytes on a wire. 'write_burst' gets a list of byte strings that go out back to back """
+    name = None
+
+    def write_burst(self, messages):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class I2cArduinoTransport(MidiTransport):
+    """ the arduino pro micro on the i2c bus that turns what it receives into a serial midi stream """
+    name = "i2c"
+
+    def __init__(self, address=0x04, busnum=None, block_transfer=False):
+        import Adafruit_GPIO.I2C as I2C  # only there on the pi
+        self.i2c_device = I2C.get_i2c_device(address=address,
+                                             busnum=I2C.get_default_bus() if busnum is None else busnum)
+        self.block_transfer = block_transfer
+
+    def write_burst(self, messages):
+        """ in block transfer mode the whole burst is packed into as few frames as possible, otherwise every byte is
+        its own i2c transaction """
+        if self.block_transfer:
+            self.write_frames(pack_frames(messages))
+        else:
+            for msg in messages:
+                self.write_bytes(msg)
+
+    def write_bytes(self, msg):
+        for byte in msg:
+            self.i2c_device.writeRaw8(ord(byte))
+            time.sleep(0.0001)
+
+    def write_frames(self, frames):
+        for payload in frames:
+            self.i2c_device.writeList(FRAME_START, [len(payload)] + payload + [frame_checksum(payload)])
+
+
+class AlsaRawMidiTransport(MidiTransport):
+    """ writes to an alsa rawmidi device: a usb midi interface (e.g. /dev/snd/midiC1D0) or a virtual port made by the
+    snd-virmidi kernel module, which shows up to other programs as an alsa sequencer port """
+    name = "alsa"
+
+    def __init__(self, device="/dev/snd/midiC1D0"):
+        self.device = device
+        self.fd = os.open(device, os.O_WRONLY)
+
+    def write_burst(self, messages):
+        data = "".join(messages)
+        while data:
+            data = data[os.write(self.fd, data):]
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LoopbackTransport(MidiTransport):
+    """ stand-in that needs no hardware. bytes are kept in memory, or with use_pty they go through a pseudo terminal
+    and a reader thread collects them from the other end, so the cost of a real device write and the time until the
+    bytes arrive can be measured on any linux box """
+    name = "loopback"
+
+    def __init__(self, use_pty=False):
+        self.received = bytearray()
+        self.condition = threading.Condition()
+        self.reader_thread = None
+        self.write_fd = None
+        self.read_fd = None
+        if use_pty:
+            self.read_fd, self.write_fd = os.openpty()
+            tty.setraw(self.write_fd)
+            tty.setraw(self.read_fd)
+            self.reader_thread = threading.Thread(target=self.read_loop, name="MIDI-Loopback-Reader")
+            self.reader_thread.daemon = True
+            self.reader_thread.start()
+
+    def write_burst(self, messages):
+        data = "".join(messages)
+        if self.write_fd is None:
+            self.receive(data)
+        else:
+            while data:
+                data = data[os.write(self.write_fd, data):]
+
+    def read_loop(self):
+        read_fd = self.read_fd  # close() sets it to None, the read then fails on the closed fd
+        while True:
+            try:
+                data = os.read(read_fd, 4096)
+            except OSError:
+                break
+            if not data:
+                break
+            self.receive(data)
+
+    def receive(self, data):
+        with self.condition:
+            self.received.extend(data)
+            self.condition.notify_all()
+
+    def wait_for(self, byte_count, timeout=1.0):
+        """ wait until at least byte_count bytes have been received. returns False on timeout """
+        end = time.time() + timeout
+        with self.condition:
+            while len(self.received) < byte_count:
+                remaining = end - time.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def clear(self):
+        with self.condition:
+            del self.received[:]
+
+    def close(self):
+        for fd in [self.write_fd, self.read_fd]:
+            if fd is not None:
+                os.close(fd)
+        self.write_fd = self.read_fd = None
+        if self.reader_thread is not None:
+            self.reader_thread.join(1.0)  # the read fails once the pty is closed
+            self.reader_thread = None
+
+
+TRANSPORTS = {
+    I2cArduinoTransport.name: I2cArduinoTransport,
+    AlsaRawMidiTransport.name: AlsaRawMidiTransport,
+    LoopbackTransport.name: LoopbackTransport
+}
+
+
+def open_transport(transport_config=None):
+    """ make the transport the 'transport' section of the midi config asks for; type is one of 'i2c' (default),
+    'alsa' or 'loopback' and every other key is passed on to the transport """
+    options = dict(transport_config or {})
+    transport_type = options.pop('type', I2cArduinoTransport.name)
+    if transport_type not in TRANSPORTS:
+        logger.error("Unknown midi transport \'" + str(transport_type) + "\'. Using \'" + I2cArduinoTransport.name +
+                     "\'.")
+        transport_type = I2cArduinoTransport.name
+    logger.info("Opening " + transport_type + " midi transport with options " + str(options) + ".")
+    return TRANSPORTS[transport_type](**options)
@@ -0,0 +1 @@
+from MidiTransport import *
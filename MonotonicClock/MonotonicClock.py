@@ -0,0 +1,33 @@
+# a clock that never jumps when ntp or the user sets the time. python 2 has no time.monotonic, so on the pi it is
+# clock_gettime(CLOCK_MONOTONIC) through ctypes.
+import ctypes
+import ctypes.util
+import os
+import time
+
+CLOCK_MONOTONIC = 1
+
+
+class Timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+def _clock_gettime_monotonic():
+    librt = ctypes.CDLL(ctypes.util.find_library("rt") or "librt.so.1", use_errno=True)
+    clock_gettime = librt.clock_gettime
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(Timespec)]
+
+    def monotonic():
+        """ seconds since some fixed point in the past, as a float """
+        timespec = Timespec()
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(timespec)) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return timespec.tv_sec + timespec.tv_nsec * 1e-9
+    return monotonic
+
+
+if hasattr(time, "monotonic"):
+    monotonic = time.monotonic
+else:
+    monotonic = _clock_gettime_monotonic()
@@ -0,0 +1 @@
+from MonotonicClock import *
@@ -0,0 +1,185 @@
+# morphs between parts: instead of jumping to the values of the new part, parameters like Mix or Repeats are ramped
+# there over a number of seconds or beats. the whole ramp is worked out in one go with numpy, a scheduler thread then
+# sends it step by step, never faster than max_rate messages a second.
+import threading
+
+import numpy
+
+import EventLog
+import MIDI
+import MonotonicClock
+
+'''   ############ USAGE ###############
+logger.info("info message")
+logger.warning("warning message")
+logger.error("error message")
+'''
+logger = EventLog.get_logger(__name__)
+
+MAX_RATE = 200  # messages a second, all ramps together
+MIN_STEP_TIME = 0.01  # no ramp steps closer together than this, however few params are ramped
+
+
+class Ramp(object):
+    """ one parameter of one pedal going from start to end """
+
+    def __init__(self, pedal, param, table, start, end):
+        self.pedal = pedal
+        self.param = param
+        self.table = table
+        self.start = start
+        self.end = end
+
+
+def morph_duration(morph_config, bpm):
+    """ seconds a morph takes, from the 'morph' config of a part: 'seconds', or 'beats' at the tempo of the song """
+    if not morph_config:
+        return 0.0
+    if morph_config.get('beats', None) is not None:
+        try:
+            return float(morph_config['beats']) * 60.0 / float(bpm)
+        except (TypeError, ValueError, ZeroDivisionError):
+            logger.warning("Can't morph over " + str(morph_config['beats']) + " beats at " + str(bpm) + " bpm.")
+            return 0.0
+    try:
+        return float(morph_config.get('seconds', 0.0))
+    except (TypeError, ValueError):
+        logger.warning("Can't morph over " + str(morph_config['seconds']) + " seconds.")
+        return 0.0
+
+
+def compute_ramps(starts, ends, duration, max_rate=MAX_RATE):
+    """ the values of every ramp at every step, all at once. returns (times, values): the time of each step from the
+    start of the morph, and a steps x ramps array of whole numbers. there are never more steps than the biggest ramp
+    has values to go through, or than max_rate allows over the duration """
+    starts = numpy.asarray(starts, dtype=float)
+    ends = numpy.asarray(ends, dtype=float)
+    distinct = int(numpy.max(numpy.abs(ends - starts))) + 1
+    by_rate = int(duration * max_rate / len(starts)) + 1
+    by_step_time = int(duration / MIN_STEP_TIME) + 1
+    steps = max(2, min(distinct, by_rate, by_step_time))
+    times = numpy.linspace(0.0, duration, steps)
+    fractions = numpy.linspace(0.0, 1.0, steps)[:, numpy.newaxis]
+    values = numpy.rint(starts + (ends - starts) * fractions).astype(int)
+    return times, values
+
+
+class MorphScheduler(threading.Thread):
+    """ sends the steps of one morph at a time. starting a new morph, or a part change, cancels the one running, and
+    a cancelled morph sends the end values straight away so no pedal is left half way """
+
+    def __init__(self, max_rate=MAX_RATE):
+        threading.Thread.__init__(self)
+        self.name = "Morph-Thread"
+        self.daemon = True
+        self.max_rate = max_rate
+        self.running = True
+        self.ramps = []
+        self.times = None
+        self.values = None
+        self.step = 0
+        self.start_time = None
+        self.condition = threading.Condition()
+
+    def morph(self, ramps, duration):
+        """ start ramping. ramps with nothing to do are left out, a zero duration sends the end values now """
+        ramps = [ramp for ramp in ramps if ramp.start != ramp.end]
+        self.cancel()
+        if not ramps:
+            return
+        if duration <= 0:
+            self.send_step([(ramp, ramp.end) for ramp in ramps])
+            return
+        times, values = compute_ramps([ramp.start for ramp in ramps], [ramp.end for ramp in ramps], duration,
+                                      self.max_rate)
+        logger.info("Morphing " + ", ".join(ramp.pedal.name + " " + str(ramp.param) for ramp in ramps) + " in " +
+                    str(len(times) - 1) + " steps over " + str(round(duration, 2)) + " s.")
+        with self.condition:
+            self.ramps = ramps
+            self.times = times
+            self.values = values
+            self.step = 1  # step 0 is where the pedals already are
+            self.start_time = MonotonicClock.monotonic()
+            self.condition.notify_all()
+
+    def cancel(self):
+        """ stop the running morph, sending the end values of the ramps it didn't finish """
+        with self.condition:
+            if not self.ramps:
+                return
+            last = self.values[-1]
+            current = self.values[self.step - 1]
+            self.send_step([(ramp, int(last[i])) for i, ramp in enumerate(self.ramps) if current[i] != last[i]])
+            self.ramps = []
+            self.condition.notify_all()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def run(self):
+        logger.info("Starting " + self.name)
+        while True:
+            with self.condition:
+                while self.running and not self.ramps:
+                    self.condition.wait()
+                if not self.running:
+                    break
+                ramps = self.ramps
+                due = self.start_time + self.times[self.step]
+                remaining = due - MonotonicClock.monotonic()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue  # check again, the morph may have been cancelled or replaced
+                previous = self.values[self.step - 1]
+                row = self.values[self.step]
+                # sent while holding the condition, so a cancel can't slip its end values in before this step
+                self.send_step([(ramp, int(row[i])) for i, ramp in enumerate(ramps) if row[i] != previous[i]])
+                self.step += 1
+                if self.step == len(self.times):
+                    self.ramps = []
+        logger.info("Exiting " + self.name)
+
+    @staticmethod
+    def send_step(changes):
+        messages = []
+        sources = []
+        for ramp, value in changes:
+            ramp_messages = ramp.table.messages(value)
+            messages.extend(ramp_messages)
+            sources.extend([(ramp.pedal.name, "Morph " + str(ramp.param))] * len(ramp_messages))
+        if messages:
+            MIDI.MIDI.send_burst(messages, sources)
+
+
+_scheduler = None
+
+
+def start(max_rate=MAX_RATE):
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = MorphScheduler(max_rate)
+        _scheduler.start()
+
+
+def stop():
+    global _scheduler
+    if _scheduler is not None:
+        _scheduler.cancel()
+        _scheduler.stop()
+        _scheduler = None
+
+
+def is_running():
+    return _scheduler is not None
+
+
+def morph(ramps, duration):
+    if _scheduler is not None:
+        _scheduler.morph(ramps, duration)
+
+
+def cancel():
+    if _scheduler is not None:
+        _scheduler.cancel()
@@ -0,0 +1 @@
+from Morph import *
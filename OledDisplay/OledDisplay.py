@@ -1,4 +1,3 @@
-import logging
 import time
 import re
 import Adafruit_GPIO.SPI as SPI
@@ -6,6 +5,8 @@ from PIL import Image
 from PIL import ImageDraw
 from PIL import ImageFont
 
+import EventLog
+import Latency
 import SSD1306
 
 DISPLAY_X_START = 2
@@ -21,15 +22,7 @@ logger.info("info message")
 logger.warning("warning message")
 logger.error("error message")
 '''
-logger = logging.getLogger(__name__)   
-logger.setLevel(logging.DEBUG)
-logger.propagate = False
-# create console handler and set level to info
-handler = logging.StreamHandler()
-handler.setLevel(logging.INFO)
-formatter = logging.Formatter("%(asctime)s [OledDisplay.py] [%(levelname)-5.5s]  %(message)s")
-handler.setFormatter(formatter)
-logger.addHandler(handler)
+logger = EventLog.get_logger(__name__)
 
 class OledDisplay(object):
 	font_type = None
@@ -77,6 +70,7 @@ class OledDisplay(object):
 			# self.draw_centered(msg, draw, y, textColor)
 		self.spi_disp.image(image)
 		self.spi_disp.display()
+		Latency.mark(Latency.STAGE_OLED_SENT)
 
 	def draw_centered(self, msg, draw, y, text_color):
 		for msg_str in re.split(' - ', msg):
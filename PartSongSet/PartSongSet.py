@@ -1,36 +1,46 @@
+import collections
+import hashlib
+import os
+import threading
+import weakref
+
 import yaml
-import DoublyLinkedList
-import logging
+import EventLog
+import PickleFile
+import Sequence
 
 SONG_PATH = "/home/pi/MidiController/PartSongSet/Songs/"
+CACHE_FILE = "/home/pi/MidiController/PartSongSet/.cache/compiled.pickle"
+CACHE_VERSION = 1  # the layout of compile_setlist and compile_song, a new one throws the cache away
+# so does an edit of this file, which has compile_setlist and compile_song in it
+CACHE_KEY = (CACHE_VERSION, PickleFile.source_digest(__name__))
+SONG_CACHE_SIZE = 32  # songs kept parsed, the least recently used one is dropped past this
+PREFETCH_RADIUS = 2  # songs on each side of the current one that are parsed in the background
 
 '''   ############ USAGE ###############
 logger.info("info message")
 logger.warning("warning message")
 logger.error("error message")
 '''
-logger = logging.getLogger(__name__)   
-logger.setLevel(logging.DEBUG)
-logger.propagate = False
-# create console handler and set level to info
-handler = logging.StreamHandler()
-handler.setLevel(logging.INFO)
-formatter = logging.Formatter("%(asctime)s [PartSongSet.py] [%(levelname)-5.5s]  %(message)s")
-handler.setFormatter(formatter)
-logger.addHandler(handler)
+logger = EventLog.get_logger(__name__)
 
 
 class Setlist(object):
 	""" class for importing, editing, and maintaining a setlist.
 	"""
-	def __init__(self):
+	def __init__(self, song_path=SONG_PATH, cache=None, store=None):
 		self.songs = None
 		self.song_list = None
 		self._setlist_name = None
+		self.song_path = song_path
+		# the set and song files are read through the compiled cache, or parsed every time without one
+		self.cache = cache
+		# where the Song objects come from, the shared song_store or one of its own
+		self.store = store if store is not None else SongStore(song_path, cache)
 		self.clear_song_data()
 
 	def clear_song_data(self):
-		self.songs = DoublyLinkedList.DoublyLinkedList()  # create an empty list for keeping multiple Song objects
+		self.songs = Sequence.Sequence()  # create an empty list for keeping multiple Song objects
 		self.song_list = []  # create an empty list for keeping song names that correspond to the setlist songs
 
 	@property
@@ -54,81 +64,569 @@ class Setlist(object):
 			config_dict = yaml.full_load(ymlfile)
 		return config_dict
 
+	def read_compiled(self, path, compile_func):
+		""" the compiled form of a set or song file, from the cache if the file didn't change
+		"""
+		if self.cache is not None:
+			return self.cache.get(path, compile_func)
+		with open(path, 'rb') as ymlfile:
+			return compile_func(ymlfile.read())
+
 	def load_setlist(self, setlist_path):
-		""" read and load the setlist. calls the getsongnames method and then calls the loadsong method
+		""" read the setlist. only the set file is parsed here, each song is parsed the first time it is used
+		(see Song.load) or when it is prefetched
 		"""
 		logger.info("set setlist to: " + setlist_path)
 		self.clear_song_data()
 		self.get_song_names(setlist_path)
 		for song_name in self.song_list:
 			self.load_song(song_name)
+		if self.cache is not None:
+			self.cache.save()
 
 	def get_song_names(self, setlist_path):  # get songs from yaml, put in List
 		""" method for reading the setlist and appending song names to a list
 		"""
-		setlist_dict = self.read_config(setlist_path + '.yaml')
-		self.setlist_name = setlist_dict['name']
-		[self.song_list.append(song) for song in setlist_dict['songs']]
+		self.setlist_name, song_names = self.read_compiled(setlist_path + '.yaml', compile_setlist)
+		[self.song_list.append(song) for song in song_names]
 
 	def load_song(self, song_name):
-		""" gets song names from list and then opens each individual song
-		file from the song directory and reads it into memory.
-		"""
-		logger.info("set song to: " + song_name) 
-		song_dict = self.read_config(SONG_PATH + song_name + '.yaml')      
-		tempo = str(song_dict['tempo'])  # get the tempo of the song
-		new_song = Song(song_name, tempo)   # create a new song object
-		parts = song_dict['parts']
-		part_position_dict = {part['position']: part_name for (part_name, part) in parts.iteritems()}
-		for i in range(0, len(part_position_dict)):  # iterate the song yaml over each part
-			part_name = part_position_dict.get(i + 1)
-			new_part = Part(part_name)   # create a new part object
-			part = parts[part_name]
-			pedals = part['pedals']
-			for pedal_name in pedals.keys():  # iterate all the pedals for each part
-				pedal = pedals[pedal_name]
-				engaged = bool(pedal.get('engaged', False))  # and if it has a setting associated with it
-				preset = pedal.get('preset', '')
-				params = pedal.get('params', '')
-				settings = pedal.get('settings', '')
+		""" add a song of the set. it is parsed from the song directory the first time its tempo or parts are
+		needed, a song another set already has is the same Song object. a song without a file is left out of the set
+		"""
+		song = self.store.get(song_name)
+		if song is None:
+			logger.error("Song " + song_name + " has no file in " + self.song_path + ", it is left out of the set.")
+			return
+		self.songs.append(song)  # add song to the "songs" Sequence in Setlist
+
+	def add_song_loaded_callback(self, callback):
+		""" callback(song name, parts) is called every time a song of the store is parsed, e.g. to check its params
+		"""
+		self.store.add_song_loaded_callback(callback)
+
+	def prefetch(self, *songs):
+		""" have the songs around each of songs (entries of songs, e.g. the current and the displayed one) parsed
+		in the background, nearest first. songs themselves go to the front of the song cache, so they are the last
+		to be dropped from it
+		"""
+		centers = [song for song in songs if song is not None and song.sequence is self.songs]
+		for song in centers:
+			if song.data.is_loaded():
+				song_cache.touch(song.data)
+		neighbors = []
+		for offset in range(1, PREFETCH_RADIUS + 1):
+			for song in centers:
+				for index in [song.index + offset, song.index - offset]:
+					if 1 <= index <= len(self.songs):
+						neighbors.append(self.songs.index_to_node(index).data)
+		prefetch_songs(neighbors)
+
+
+def compile_setlist(data):
+	""" (name, song names) of a set file
+	"""
+	setlist_dict = yaml.full_load(data)
+	return setlist_dict['name'], tuple(setlist_dict['songs'])
+
+
+def compile_song(data):
+	""" (tempo, parts) of a song file. parts are (name, morph, pedals) in position order, pedals are
+	(name, engaged, preset, params, settings)
+	"""
+	song_dict = yaml.full_load(data)
+	tempo = str(song_dict['tempo'])  # get the tempo of the song
+	parts = song_dict['parts']
+	part_position_dict = {part['position']: part_name for (part_name, part) in parts.iteritems()}
+	compiled_parts = []
+	for i in range(0, len(part_position_dict)):  # iterate the song yaml over each part
+		part_name = part_position_dict.get(i + 1)
+		part = parts[part_name]
+		pedals = part['pedals']
+		compiled_pedals = []
+		for pedal_name in pedals.keys():  # iterate all the pedals for each part
+			pedal = pedals[pedal_name]
+			engaged = bool(pedal.get('engaged', False))  # and if it has a setting associated with it
+			compiled_pedals.append((pedal_name, engaged, pedal.get('preset', ''), pedal.get('params', ''),
+									pedal.get('settings', '')))
+		compiled_parts.append((part_name, part.get('morph', None), tuple(compiled_pedals)))
+	return tempo, tuple(compiled_parts)
+
+
+class CompiledCache(object):
+	""" the compiled form of every set and song file read, in one binary file. an entry is used as long as its
+	file has the same mtime and size. when those changed the file is hashed, and only compiled again if the hash
+	changed too. the file is written back by save, when something was compiled
+	"""
+	def __init__(self, path=CACHE_FILE):
+		self.path = path
+		self.entries = None  # {file path: (mtime, size, sha1, compiled)}
+		self.changes = 0  # entries stored since it was read
+		self.saved_changes = 0  # of those, the ones in the file
+		self.lock = threading.Lock()
+		self.save_lock = threading.Lock()  # one save at a time, from whichever thread
+		self.hits = 0
+		self.rehashed = 0
+		self.compiled = 0
+
+	def read(self):
+		cached = PickleFile.read(self.path)
+		version, entries = cached if isinstance(cached, tuple) and len(cached) == 2 else (None, None)
+		self.entries = entries if version == CACHE_KEY and isinstance(entries, dict) else {}
+
+	def get(self, path, compile_func):
+		""" the compiled form of the file at path. compile_func(data) compiles it from the contents of the file.
+		the lock is only held to look the entry up and to store it, a file being compiled on one thread doesn't hold
+		up the others
+		"""
+		stat = os.stat(path)
+		with self.lock:
+			if self.entries is None:
+				self.read()
+			entry = self.entries.get(path, None)
+			if entry is not None and entry[0] == stat.st_mtime and entry[1] == stat.st_size:
+				self.hits += 1
+				return entry[3]
+		with open(path, 'rb') as source_file:
+			data = source_file.read()
+		digest = hashlib.sha1(data).hexdigest()
+		if entry is not None and entry[2] == digest:
+			compiled = entry[3]  # touched but not changed
+		else:
+			compiled = compile_func(data)
+		with self.lock:
+			if entry is not None and entry[2] == digest:
+				self.rehashed += 1
+			else:
+				self.compiled += 1
+			self.entries[path] = (stat.st_mtime, stat.st_size, digest, compiled)
+			self.changes += 1
+		return compiled
+
+	def save(self):
+		""" write the cache if anything was compiled since it was last written, leaving out files that are gone.
+		the set loading, the prefetcher, the library and the file watcher all save, one at a time. what is stored
+		while the file is written is saved the next time
+		"""
+		with self.save_lock:
+			with self.lock:
+				if self.entries is None or self.changes == self.saved_changes:
+					return
+				entries = dict((path, entry) for path, entry in self.entries.items() if os.path.isfile(path))
+				self.entries = entries
+				changes = self.changes
+			if PickleFile.write(self.path, (CACHE_KEY, entries), "the compiled setlist cache"):
+				with self.lock:
+					self.saved_changes = changes
+
+	def digest(self, path):
+		""" the sha1 of the file at path, without compiling it. None if there is no file
+		"""
+		try:
+			stat = os.stat(path)
+		except OSError:
+			return None
+		with self.lock:
+			if self.entries is None:
+				self.read()
+			entry = self.entries.get(path, None)
+			if entry is not None and entry[0] == stat.st_mtime and entry[1] == stat.st_size:
+				return entry[2]
+		return file_digest(path)
+
+	def stats(self):
+		with self.lock:
+			return {'files': len(self.entries or {}), 'hits': self.hits, 'rehashed': self.rehashed,
+					'compiled': self.compiled}
+
+
+def file_digest(path):
+	""" the sha1 of the file at path, None if there is no file
+	"""
+	try:
+		with open(path, 'rb') as source_file:
+			return hashlib.sha1(source_file.read()).hexdigest()
+	except (IOError, OSError):
+		return None
+
+
+class SongStore(object):
+	""" the Song objects of every setlist, by song name and the sha1 of its file. a set with a song another set
+	has gets the same Song, so it is parsed once and switching between the sets parses nothing. a Song no set holds
+	any more drops out of the store, and an edited song file is a new Song
+	"""
+	def __init__(self, song_path=SONG_PATH, cache=None):
+		self.song_path = song_path
+		self.cache = cache
+		self.songs = weakref.WeakValueDictionary()  # {(song name, sha1): Song}
+		self.song_loaded_callbacks = []
+		self.lock = threading.Lock()
+		self.shared = 0
+		self.created = 0
+
+	def get(self, song_name):
+		""" the Song of song_name's file as it is now, None if it has no file
+		"""
+		path = self.song_path + song_name + '.yaml'
+		digest = self.cache.digest(path) if self.cache is not None else file_digest(path)
+		if digest is None:
+			return None
+		with self.lock:
+			song = self.songs.get((song_name, digest), None)
+			if song is None:
+				song = Song(song_name, loader=self.read_song)
+				self.songs[(song_name, digest)] = song
+				self.created += 1
+			else:
+				self.shared += 1
+		return song
+
+	def read_song(self, song_name):
+		""" parse a song file into its tempo and a Sequence of its parts
+		"""
+		logger.info("set song to: " + song_name)
+		path = self.song_path + song_name + '.yaml'
+		if self.cache is not None:
+			tempo, compiled_parts = self.cache.get(path, compile_song)
+		else:
+			with open(path, 'rb') as ymlfile:
+				tempo, compiled_parts = compile_song(ymlfile.read())
+		song_parts = Sequence.Sequence()
+		for part_name, morph, pedals in compiled_parts:
+			new_part = Part(part_name, morph)   # create a new part object
+			for pedal_name, engaged, preset, params, settings in pedals:
 				new_part.add_pedal(pedal_name, engaged, preset, params, settings)  # add each pedal to a dictionary of pedals
-			new_song.add_part(new_part)  # add part to the "parts" doublyLinkedList in Song
-		self.songs.append(new_song)  # add song to the "songs" doublyLinkedList in Setlist
+			song_parts.append(new_part)  # add part to the "parts" Sequence of the song
+		for callback in self.song_loaded_callbacks:
+			callback(song_name, song_parts)
+		return tempo, song_parts
+
+	def add_song_loaded_callback(self, callback):
+		if callback not in self.song_loaded_callbacks:
+			self.song_loaded_callbacks.append(callback)
+
+	def stats(self):
+		with self.lock:
+			return {'songs': len(self.songs), 'created': self.created, 'shared': self.shared}
 
 
 class Song(object):
-	""" class "has-a" a doubly linked list of parts, "is-a" object
-	methods are 'add_part' and 'get_tempo'.
+	""" class "has-a" Sequence of parts, "is-a" object
+	methods are 'add_part' and 'get_tempo'. a song made with a loader gets its tempo and parts from
+	loader(name) the first time they are used, and can be dropped from the song cache and loaded again
 	"""
-	def __init__(self, name, bpm):
-		self.parts = DoublyLinkedList.DoublyLinkedList() 
+	def __init__(self, name, bpm=None, loader=None):
 		self.name = name
-		self.bpm = bpm
+		self.loader = loader
+		self._bpm = bpm
+		self._parts = None if loader else Sequence.Sequence()
+		self.load_lock = threading.Lock()
+
+	@property
+	def bpm(self):
+		if self._parts is None:
+			self.load()
+		return self._bpm
+
+	@property
+	def parts(self):
+		parts = self._parts
+		if parts is None:
+			parts = self.load()
+		else:
+			song_cache.touch(self)
+		return parts
+
+	def is_loaded(self):
+		return self._parts is not None
+
+	def load(self):
+		""" parse the song if it isn't, and put it at the front of the song cache. returns its parts
+		"""
+		with self.load_lock:
+			parts = self._parts
+			if parts is None:
+				bpm, parts = self.loader(self.name)
+				self._bpm = bpm
+				self._parts = parts
+		song_cache.touch(self)
+		return parts
+
+	def unload(self):
+		""" drop the parsed parts, they are parsed again the next time they are used. anything still holding one
+		of the parts keeps it
+		"""
+		if self.loader is not None:
+			with self.load_lock:
+				self._parts = None
 
 	def add_part(self, new_part, i=None):
-		""" method calls the doublylinkedlist object 'parts' to append
+		""" method calls the Sequence object 'parts' to append
 		or insert a new part depending on 'i'
 		"""
 		if i is None:
 			self.parts.append(new_part)
 		elif i >= 0:
 			self.parts.insert(new_part, i)
-	
+
 	def get_tempo(self):
 		""" returns the tempo for the song object that called 'get_tempo'
 		"""
 		return self.bpm
 
+	def __repr__(self):
+		return "Song(" + repr(self.name) + ")"
+
+
+class SongCache(object):
+	""" the songs that are parsed, least recently used first. past 'capacity' the least recently used one is
+	unloaded
+	"""
+	def __init__(self, capacity=SONG_CACHE_SIZE):
+		self.capacity = capacity
+		self.songs = collections.OrderedDict()
+		self.lock = threading.Lock()
+		self.loads = 0
+		self.evictions = 0
+
+	def touch(self, song):
+		if song.loader is None:
+			return  # built in code, there is nothing to load again
+		evicted = []
+		with self.lock:
+			if self.songs.pop(song, None) is None:
+				self.loads += 1
+			self.songs[song] = True
+			while len(self.songs) > self.capacity:
+				evicted.append(self.songs.popitem(last=False)[0])
+				self.evictions += 1
+		for old_song in evicted:
+			old_song.unload()
+
+	def resize(self, capacity):
+		self.capacity = max(1, capacity)
+
+	def stats(self):
+		with self.lock:
+			return {'cached': len(self.songs), 'capacity': self.capacity, 'loads': self.loads,
+					'evictions': self.evictions}
+
+
+class SongPrefetchThread(threading.Thread):
+	""" parses the songs it is given, one at a time. a new list replaces the songs not parsed yet
+	"""
+	def __init__(self):
+		threading.Thread.__init__(self)
+		self.name = "Song-Prefetch-Thread"
+		self.daemon = True
+		self.running = True
+		self.pending = []
+		self.condition = threading.Condition()
+
+	def prefetch(self, songs):
+		with self.condition:
+			self.pending = [song for song in songs if not song.is_loaded()]
+			self.condition.notify_all()
+
+	def stop(self):
+		with self.condition:
+			self.running = False
+			self.condition.notify_all()
+
+	def run(self):
+		logger.info("Starting " + self.name)
+		while True:
+			with self.condition:
+				while self.running and not self.pending:
+					self.condition.wait()
+				if not self.running:
+					break
+				song = self.pending.pop(0)
+				idle = not self.pending
+			try:
+				song.load()
+				if idle:
+					compiled_cache.save()  # whatever the songs just prefetched needed compiling
+			except Exception as e:
+				logger.exception(e)
+		logger.info("Exiting " + self.name)
+
+
+def freeze(value):
+	""" a hashable form of a value from a song file, dicts and lists become sorted tuples and tuples. everything
+	is tagged with its type, True, 1 and 1.0 are equal in python but not to a pedal, and neither are {} and []
+	"""
+	if isinstance(value, dict):
+		return dict, tuple(sorted((freeze(key), freeze(item)) for key, item in value.iteritems()))
+	if isinstance(value, (list, tuple)):
+		return type(value), tuple(freeze(item) for item in value)
+	return type(value), value
+
+
+class PedalState(object):
+	""" what a part asks of one pedal: engaged, preset, params and settings. it doesn't change once made, and
+	pedal_state gives every equal state the same object, so parts share them and two parts ask the same of a pedal
+	exactly when their states are the same object. params is a dict that must not be changed
+	"""
+	__slots__ = ['engaged', 'preset', 'params', 'settings', 'key', 'hash', '__weakref__']
+
+	def __init__(self, engaged, preset, params, settings, key=None):
+		self.engaged = engaged
+		self.preset = preset
+		self.params = params
+		self.settings = settings
+		self.key = key if key is not None else (freeze(engaged), freeze(preset), freeze(params), freeze(settings))
+		self.hash = hash(self.key)
+
+	def __hash__(self):
+		return self.hash
+
+	def __eq__(self, other):
+		return self is other or (isinstance(other, PedalState) and self.hash == other.hash and self.key == other.key)
+
+	def __ne__(self, other):
+		return not self.__eq__(other)
+
+	def __repr__(self):
+		return "PedalState(" + ", ".join(repr(value) for value in [self.engaged, self.preset, self.params,
+																	 self.settings]) + ")"
+
+
+_pedal_states = weakref.WeakValueDictionary()  # {PedalState key: PedalState}
+_pedal_states_lock = threading.Lock()
+
+
+def pedal_state(engaged, preset, params, settings):
+	""" the PedalState of these values, the same object as every other part's with equal ones
+	"""
+	key = (freeze(engaged), freeze(preset), freeze(params), freeze(settings))
+	with _pedal_states_lock:
+		state = _pedal_states.get(key, None)
+		if state is None:
+			state = PedalState(engaged, preset, params, settings, key)
+			_pedal_states[key] = state
+	return state
+
+
+def pedal_state_stats():
+	with _pedal_states_lock:
+		return {'states': len(_pedal_states)}
+
 
 class Part(object):
-	""" part class has a 'name' property, holds each pedal and its tuple of (engaged, setting)
-	in a dictionary 'pedal_dictionary'. Its methods are add pedal and 'IsEngaged'
+	""" part class has a 'name' property, holds the PedalState of each pedal
+	in a dictionary 'pedal_dictionary'. Its method is add pedal
 	"""
-	def __init__(self, part_name):
+	def __init__(self, part_name, morph=None):
 		self.part_name = part_name
 		self.pedal_dictionary = {}
+		# how to get to this part from the one before: {beats or seconds, params: {pedal name: [param, ..]}}
+		self.morph = morph
 
 	def add_pedal(self, pedal_name, engaged, preset, params, settings):
-		""" adds a pedal to the dict
+		""" adds a pedal to the dict, with the shared PedalState of its values
+		"""
+		self.pedal_dictionary[pedal_name] = pedal_state(engaged, preset, params, settings)
+
+
+song_cache = SongCache()
+compiled_cache = CompiledCache()
+song_store = SongStore(SONG_PATH, compiled_cache)
+_prefetcher = None
+
+
+def configure_songs(cache_size=SONG_CACHE_SIZE, prefetch_radius=PREFETCH_RADIUS):
+	""" how many songs are kept parsed, and how many on each side of the current one are prefetched. the cache
+	always keeps room for the songs prefetched around the current and the displayed one
+	"""
+	global PREFETCH_RADIUS
+	PREFETCH_RADIUS = max(0, prefetch_radius)
+	song_cache.resize(max(cache_size, 4 * PREFETCH_RADIUS + 2))
+
+
+def start_prefetch():
+	global _prefetcher
+	if _prefetcher is None:
+		_prefetcher = SongPrefetchThread()
+		_prefetcher.start()
+
+
+def stop_prefetch():
+	global _prefetcher
+	if _prefetcher is not None:
+		_prefetcher.stop()
+		_prefetcher.join(1.0)
+		_prefetcher = None
+
+
+def save_cache():
+	compiled_cache.save()
+
+
+def prefetch_songs(songs):
+	if _prefetcher is not None:
+		_prefetcher.prefetch(songs)
+
+
+class SetlistCursor(object):
+	""" a song of a setlist and a part of that song, e.g. the part that is loaded or the one on display.
+	moving to another song puts the part cursor on its first part
+	"""
+	def __init__(self, setlist):
+		self.setlist = setlist
+		self.songs = Sequence.Cursor(setlist.songs)
+		self.parts = Sequence.Cursor(self.songs.data.parts if self.songs.node else Sequence.Sequence())
+
+	@property
+	def song(self):
+		return self.songs.node
+
+	@property
+	def part(self):
+		return self.parts.node
+
+	@property
+	def song_index(self):
+		return self.songs.index
+
+	@property
+	def part_index(self):
+		return self.parts.index
+
+	def at(self, song, part=None):
+		""" move to song (an entry of the setlist's songs) and part (an entry of its parts), its first part if None
 		"""
-		self.pedal_dictionary[pedal_name] = (engaged, preset, params, settings)
+		self.songs.at(song)
+		self.parts = Sequence.Cursor(song.data.parts, part)
+
+	def set(self, other):
+		""" move to where another cursor is """
+		self.at(other.song, other.part)
+
+	def find(self, song_name, part_name):
+		""" move to the song and part with these names. a name that isn't there gives the last song or part
+		"""
+		songs = self.setlist.songs
+		song = songs.find(lambda song_data: song_data.name == song_name) or songs.tail
+		parts = song.data.parts
+		self.at(song, parts.find(lambda part_data: part_data.part_name == part_name) or parts.tail)
+
+	def step_part(self, offset):
+		""" move offset parts within the song. returns False, without moving, if that is past either end """
+		return self.parts.step(offset)
+
+	def step_song(self, offset):
+		""" move offset songs, to the first part. returns False, without moving, if that is past either end """
+		if not self.songs.step(offset):
+			return False
+		self.parts = Sequence.Cursor(self.songs.data.parts)
+		return True
+
+	def seek_song(self, index):
+		if not self.songs.seek(index):
+			return False
+		self.parts = Sequence.Cursor(self.songs.data.parts)
+		return True
+
+	def seek_part(self, index):
+		return self.parts.seek(index)
@@ -0,0 +1,152 @@
+# pre-stages the parts a press is likely to load next (next part, previous part, first part of the next song): a
+# background thread works out their PartPlans while nothing is happening, so loading one of them only has to send a
+# burst that is already built. everything staged is thrown away when the setlist or the state of a pedal changes.
+import threading
+
+import EventLog
+
+'''   ############ USAGE ###############
+logger.info("info message")
+logger.warning("warning message")
+logger.error("error message")
+'''
+logger = EventLog.get_logger(__name__)
+
+# staging starts this long after the last change, a part load changes every pedal one after the other
+STAGE_DELAY = 0.05
+
+
+class PartStager(threading.Thread):
+    """ keeps the payloads of the parts 'targets' names ready. targets() returns the parts to stage, build(part) the
+    payload of one. every invalidate starts a new generation: payloads of an older one are never handed out, and the
+    thread stages the targets again once things have been quiet for 'delay' seconds """
+
+    def __init__(self, targets, build, delay=STAGE_DELAY):
+        threading.Thread.__init__(self)
+        self.name = "Part-Stager-Thread"
+        self.daemon = True
+        self.targets = targets
+        self.build = build
+        self.delay = delay
+        self.running = True
+        self.generation = 0
+        self.staged = {}
+        self.dirty = True
+        self.hits = 0
+        self.misses = 0
+        self.condition = threading.Condition()
+
+    def invalidate(self):
+        with self.condition:
+            self.generation += 1
+            self.staged = {}
+            self.dirty = True
+            self.condition.notify_all()
+
+    def restage(self):
+        """ the targets moved (e.g. a part was browsed to) but nothing staged went stale """
+        with self.condition:
+            self.dirty = True
+            self.condition.notify_all()
+
+    def take(self, part):
+        """ the payload staged for part, or None if it isn't staged for the current generation """
+        with self.condition:
+            entry = self.staged.get(part, None)
+            if entry is not None and entry[0] == self.generation:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def stats(self):
+        with self.condition:
+            return {'generation': self.generation, 'staged': len(self.staged), 'hits': self.hits,
+                    'misses': self.misses}
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def run(self):
+        logger.info("Starting " + self.name)
+        while True:
+            with self.condition:
+                while self.running and not self.dirty:
+                    self.condition.wait()
+                if not self.running:
+                    break
+                generation = self.generation
+                self.condition.wait(self.delay)
+                if generation != self.generation:
+                    continue  # changed again, wait for it to settle
+                self.dirty = False
+            self.stage(generation)
+        logger.info("Exiting " + self.name)
+
+    def stage(self, generation):
+        """ build the payload of every target, giving up as soon as the generation moves on """
+        try:
+            targets = self.targets()
+        except Exception as e:
+            logger.exception(e)
+            return
+        for part in targets:
+            if part is None or part in self.staged:
+                continue
+            try:
+                payload = self.build(part)
+            except Exception as e:
+                logger.exception(e)
+                continue
+            with self.condition:
+                if generation != self.generation:
+                    return
+                self.staged[part] = (generation, payload)
+        logger.debug("Staged " + str(len(self.staged)) + " parts.")
+
+
+_stager = None
+
+
+def start(targets, build, delay=STAGE_DELAY):
+    global _stager
+    if _stager is None:
+        _stager = PartStager(targets, build, delay)
+        _stager.start()
+
+
+def stop():
+    global _stager
+    if _stager is not None:
+        _stager.stop()
+        _stager.join(1.0)
+        _stager = None
+
+
+def is_running():
+    return _stager is not None
+
+
+def invalidate():
+    """ the setlist or the state of a pedal changed, nothing staged so far can be sent any more """
+    if _stager is not None:
+        _stager.invalidate()
+
+
+def restage():
+    if _stager is not None:
+        _stager.restage()
+
+
+def take(part):
+    if _stager is not None:
+        return _stager.take(part)
+    return None
+
+
+def stats():
+    if _stager is not None:
+        return _stager.stats()
+    return {}
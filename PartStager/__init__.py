@@ -0,0 +1 @@
+from PartStager import *
@@ -0,0 +1,463 @@
+import hashlib
+import os
+
+import yaml
+
+import EventLog
+import FuncExpression
+import PickleFile
+
+'''   ############ USAGE ###############
+logger.info("info message")
+logger.warning("warning message")
+logger.error("error message")
+'''
+logger = EventLog.get_logger(__name__)
+
+ACTION_GROUPS = ["Engage", "Bypass", "Toggle Bypass", "Set Preset", "Set Tempo"]
+PARAM_GROUPS = ["Knobs/Switches", "Parameters"]
+PARAM_VALUE_KEYS = ["on", "off", "press", "release"]
+ACTION = "action"
+PARAM = "param"
+# the keys the schema knows. an action can have more: the steps its 'multi' names
+ACTION_KEYS = ["cc", "value", "program change", "control change", "multi", "min", "max", "func", "options", "display",
+               "notes"]
+CHANGE_KEYS = ["func", "min", "max", "options"]  # inside 'program change' and 'control change'
+PARAM_KEYS = ["cc", "value", "dict", "min", "max", "func", "notes"] + PARAM_VALUE_KEYS
+CACHE_FOLDER = "/home/pi/MidiController/Main/Conf/MidiPedals/.cache/"
+CACHE_VERSION = 1  # part of the cache key, change it when the compiled form changes
+# part of the cache key too: an edit of the compiler or of the funcs throws the cached configs away by itself
+COMPILER_DIGEST = PickleFile.source_digest(__name__, FuncExpression.compile_func.__module__)
+
+
+def check_for_func(change_dict, v):
+    new_v = v
+    if change_dict.get('func', None):
+        new_v = FuncExpression.compile_func(change_dict['func'])(v)
+    return new_v
+
+
+def check_value_for_engaged(v):
+    new_v = v
+    if isinstance(v, dict):
+        engaged = v.get('engaged', None)
+        if engaged is not None:
+            return engaged
+    return new_v
+
+
+def convert_to_int(change_dict, v):
+    converted_to_int = None
+    try:
+        dict_val = change_dict.get(v, change_dict.get('dict', {}).get(v, None))
+        if dict_val is not None:
+            converted_to_int = int(dict_val)
+        elif change_dict.get('value', None) == v:
+            converted_to_int = int(v)
+        elif isinstance(v, bool):
+            converted_to_int = change_dict.get('on') if v else change_dict.get('off')
+        else:
+            min_val = change_dict.get('min', None)
+            max_val = change_dict.get('max', None)
+            if min_val is not None and max_val is not None:
+                val = int(v)
+                if min_val <= val <= max_val:
+                    converted_to_int = val
+                else:
+                    logger.info("The value, %s, is not in the range [%s, %s]", v, min_val, max_val)
+            else:
+                logger.info("Key, %s, not found in dict -> %s", v, change_dict)
+    except ValueError:
+        logger.error("Value \'" + str(v) + "\' cannot be converted to an int.")
+    return converted_to_int
+
+
+def action_messages(action_dict, value, cc_status, pc_status):
+    """ build the midi messages for an action dict (Engage, Bypass, Set Preset, ...). every step of a 'multi' action
+    gets the value the action was called with, e.g. the bank and the program of a preset number. """
+    if value is None:
+        value = action_dict.get('value', None)
+    if action_dict.get('cc', None) is not None:
+        return [cc_status + chr(action_dict['cc']) + chr(check_for_func(action_dict, value))]
+    elif action_dict.get('program change', None) is not None:
+        return [pc_status + chr(check_for_func(action_dict['program change'], value))]
+    elif action_dict.get('control change', None) is not None:
+        return [cc_status + chr(check_for_func(action_dict['control change'], value)) + chr(127)]
+    elif action_dict.get('multi', None):
+        messages = []
+        actions = action_dict['multi']
+        for i in range(len(actions)):
+            todo = action_dict.get(actions[i + 1], None)
+            if todo:
+                messages.extend(action_messages(todo, value, cc_status, pc_status))
+        return messages
+    return []
+
+
+def param_messages(param_dict, value, cc_status):
+    """ build the midi message that sets a parameter (an entry of 'Knobs/Switches' or 'Parameters') to value """
+    if value is None:
+        value = param_dict.get('value', None)
+    if param_dict.get('cc', None) is None:
+        return []
+    value = check_for_func(param_dict, value)
+    value = check_value_for_engaged(value)
+    value = convert_to_int(param_dict, value)
+    if value is None:
+        return []
+    return [cc_status + chr(param_dict['cc']) + chr(value)]
+
+
+def value_range(change_dict):
+    if isinstance(change_dict, dict) and None not in [change_dict.get('min', None), change_dict.get('max', None)]:
+        return range(change_dict['min'], change_dict['max'] + 1)
+    return []
+
+
+def action_domain(action_dict):
+    """ the values an action can be called with, as far as its config tells """
+    values = []
+    for change_dict in [action_dict, action_dict.get('program change', None), action_dict.get('control change', None)]:
+        values.extend(value_range(change_dict))
+        if isinstance(change_dict, dict):
+            values.extend(change_dict.get('options', []))
+    if 'value' in action_dict:
+        values.append(None)
+    return values
+
+
+def param_domain(param_dict):
+    """ the values a parameter can be set to, as far as its config tells """
+    values = list(param_dict.get('dict', {}).keys())
+    values.extend([key for key in PARAM_VALUE_KEYS if key in param_dict])
+    if None not in [param_dict.get('on', None), param_dict.get('off', None)]:
+        values.extend([True, False])
+    values.extend(value_range(param_dict))
+    if 'value' in param_dict:
+        values.append(None)
+    return values
+
+
+class MessageTable(object):
+    """ ready to send midi messages for one action or parameter of a pedal, keyed by the value it is called with.
+    the values the config describes are compiled when the table is built, anything else the first time it is used.
+    a table only holds plain data, so a compiled pedal config can be pickled to the cache. """
+    __slots__ = ['name', 'kind', 'conf', 'cc_status', 'pc_status', 'raw_value', 'table']
+
+    def __init__(self, name, kind, conf, cc_status, pc_status=None, problems=None):
+        self.name = name
+        self.kind = kind
+        self.conf = conf
+        self.cc_status = cc_status
+        self.pc_status = pc_status
+        # a func has to see the raw value, otherwise {name: .., engaged: ..} is looked up by its engaged state
+        self.raw_value = kind == ACTION or bool(conf.get('func', None))
+        self.table = {}
+        for value in action_domain(conf) if kind == ACTION else param_domain(conf):
+            self.compile(value, problems)
+
+    def build(self, value):
+        if self.kind == ACTION:
+            return action_messages(self.conf, value, self.cc_status, self.pc_status)
+        return param_messages(self.conf, value, self.cc_status)
+
+    def compile(self, value, problems=None):
+        """ build and keep the messages for value. errors go to problems when it is given, to the log otherwise """
+        try:
+            messages = tuple(self.build(value))
+        except (TypeError, ValueError) as e:
+            problem = "Cant build the midi messages of \'" + str(self.name) + "\' for value \'" + str(value) + \
+                      "\': " + str(e)
+            if problems is not None:
+                problems.append(problem)
+            else:
+                logger.error(problem)
+            messages = ()
+        try:
+            self.table[self.table_key(value)] = messages
+        except TypeError:
+            pass  # unhashable values (e.g. dicts) are rebuilt every time
+        return messages
+
+    def messages(self, value=None):
+        if not self.raw_value:
+            value = check_value_for_engaged(value)
+        try:
+            return self.table[self.table_key(value)]
+        except (KeyError, TypeError):
+            return self.compile(value)
+
+    @staticmethod
+    def table_key(value):
+        # True == 1 and False == 0 as dict keys, but 'on'/'off' and a range value of 1/0 can map to different bytes
+        return (bool, value) if isinstance(value, bool) else value
+
+
+def compile_actions(midi_pedal_conf_dict, cc_status, pc_status, problems=None):
+    """ returns {action name: MessageTable} for every action group a pedal config defines """
+    tables = {}
+    for action_name in ACTION_GROUPS:
+        action_dict = midi_pedal_conf_dict.get(action_name, None)
+        if action_dict:
+            tables[action_name] = MessageTable(action_name, ACTION, action_dict, cc_status, pc_status, problems)
+    return tables
+
+
+def compile_settings(midi_pedal_conf_dict, cc_status, pc_status, problems=None):
+    """ returns {setting name: MessageTable} for the settings of a pedal config: the top level entries that are not
+    one of the action or parameter groups. a setting is run with its own name as the value """
+    tables = {}
+    for setting, setting_dict in midi_pedal_conf_dict.items():
+        if setting not in ACTION_GROUPS and setting not in PARAM_GROUPS and isinstance(setting_dict, dict):
+            tables[setting] = MessageTable(setting, ACTION, setting_dict, cc_status, pc_status, problems)
+            tables[setting].compile(setting, problems)
+    return tables
+
+
+def param_table(param_name, param_dict, cc_status, problems=None):
+    return MessageTable(param_name, PARAM, param_dict, cc_status, None, problems)
+
+
+def compile_param_index(midi_pedal_conf_dict, cc_status, problems=None):
+    """ returns ({param name: MessageTable}, [names of entries that can't be sent]) for every parameter in
+    'Knobs/Switches' and 'Parameters'. a group of parameters (e.g. the settings of one BigSky machine, 'Room') is
+    flattened into 'Room/Diffusion', and its parameters can go by their own name too, as long as no other parameter
+    has it. """
+    index = {}
+    unusable = []
+    nested = {}
+    for param_type in PARAM_GROUPS:
+        for param_name, param_dict in (midi_pedal_conf_dict.get(param_type, None) or {}).items():
+            if not isinstance(param_dict, dict):
+                unusable.append(param_name)
+            elif param_dict.get('cc', None) is not None:
+                index.setdefault(param_name, param_table(param_name, param_dict, cc_status, problems))
+            elif param_dict and all(isinstance(sub_dict, dict) for sub_dict in param_dict.values()):
+                for sub_name, sub_dict in param_dict.items():
+                    if sub_dict.get('cc', None) is not None:
+                        full_name = str(param_name) + "/" + str(sub_name)
+                        index[full_name] = param_table(full_name, sub_dict, cc_status, problems)
+                        nested.setdefault(sub_name, []).append(full_name)
+                    else:
+                        unusable.append(str(param_name) + "/" + str(sub_name))
+            else:
+                unusable.append(param_name)
+    for sub_name, full_names in nested.items():
+        if sub_name not in index and len(full_names) == 1:
+            index[sub_name] = index[full_names[0]]
+    return index, unusable
+
+
+def trigger_ccs(tables):
+    """ the ccs a pedal config only ever sends with one value (tap tempo, next preset, an engage on a cc of its own).
+    sending one of them again does something on the pedal, so they never count as redundant """
+    values = {}
+    for table in tables:
+        for messages in table.table.values():
+            for msg in messages:
+                if ord(msg[0]) & 0xF0 == 0xB0 and len(msg) == 3:
+                    values.setdefault(ord(msg[1]), set()).add(msg[2])
+    return set(cc for cc, cc_values in values.items() if len(cc_values) == 1)
+
+
+class PedalConfigError(ValueError):
+    pass
+
+
+def is_int(value):
+    return isinstance(value, (int, long)) and not isinstance(value, bool)
+
+
+def check_data_byte(problems, where, key, value):
+    if not is_int(value) or not 0 <= value <= 127:
+        problems.append(where + ": '" + str(key) + "' is " + repr(value) + ", not a midi data byte (0 - 127).")
+
+
+def check_func(problems, where, change_dict):
+    if change_dict.get('func', None) is not None:
+        try:
+            FuncExpression.compile_func(str(change_dict['func']))
+        except FuncExpression.FuncExpressionError as e:
+            problems.append(where + ": " + str(e))
+
+
+def check_range(problems, where, change_dict, data_bytes):
+    """ min and max come together, min <= max, and they are data bytes when they go on the wire as they are """
+    min_val = change_dict.get('min', None)
+    max_val = change_dict.get('max', None)
+    if min_val is None and max_val is None:
+        return
+    if not is_int(min_val) or not is_int(max_val):
+        problems.append(where + ": 'min' and 'max' have to be whole numbers, they are " + repr(min_val) + " and " +
+                        repr(max_val) + ".")
+    elif min_val > max_val:
+        problems.append(where + ": 'min' " + str(min_val) + " is above 'max' " + str(max_val) + ".")
+    elif data_bytes:
+        check_data_byte(problems, where, 'min', min_val)
+        check_data_byte(problems, where, 'max', max_val)
+
+
+def check_keys(problems, where, conf_dict, known):
+    for key in conf_dict:
+        if key not in known:
+            problems.append(where + ": unknown key '" + str(key) + "'.")
+
+
+def validate_action(problems, where, action_dict):
+    """ an action (Engage, Set Preset, a setting, a step of a multi): one of cc, program change, control change or
+    multi, and values that fit """
+    if not isinstance(action_dict, dict):
+        problems.append(where + ": has to be a dictionary, it is " + repr(action_dict) + ".")
+        return
+    steps = []
+    multi = action_dict.get('multi', None)
+    if multi is not None:
+        if not isinstance(multi, dict) or sorted(multi.keys()) != range(1, len(multi) + 1):
+            problems.append(where + ": 'multi' has to number its steps 1, 2, ... it is " + repr(multi) + ".")
+        else:
+            steps = [multi[i] for i in range(1, len(multi) + 1)]
+            for step in steps:
+                if step not in action_dict:
+                    problems.append(where + ": 'multi' step '" + str(step) + "' is not defined.")
+                else:
+                    validate_action(problems, where + "/" + str(step), action_dict[step])
+    check_keys(problems, where, action_dict, ACTION_KEYS + steps)
+    check_func(problems, where, action_dict)
+    has_func = action_dict.get('func', None) is not None
+    if action_dict.get('cc', None) is not None:
+        check_data_byte(problems, where, 'cc', action_dict['cc'])
+        if action_dict.get('value', None) is not None and not has_func:
+            check_data_byte(problems, where, 'value', action_dict['value'])
+    elif action_dict.get('program change', None) is None and action_dict.get('control change', None) is None \
+            and multi is None:
+        problems.append(where + ": sends nothing, it needs 'cc', 'program change', 'control change' or 'multi'.")
+    check_range(problems, where, action_dict, multi is None and not has_func)
+    for change_key in ['program change', 'control change']:
+        change_dict = action_dict.get(change_key, None)
+        if change_dict is None:
+            continue
+        change_where = where + "/" + change_key
+        if not isinstance(change_dict, dict):
+            problems.append(change_where + ": has to be a dictionary, it is " + repr(change_dict) + ".")
+            continue
+        check_keys(problems, change_where, change_dict, CHANGE_KEYS)
+        check_func(problems, change_where, change_dict)
+        check_range(problems, change_where, change_dict, change_dict.get('func', None) is None)
+
+
+def validate_param(problems, where, param_dict):
+    """ a parameter: a cc, and a dict, on/off, press/release, a range or a value for what goes out on it. a group of
+    parameters (the settings of one BigSky machine) is a dictionary of them """
+    if not isinstance(param_dict, dict):
+        problems.append(where + ": has to be a dictionary, it is " + repr(param_dict) + ".")
+        return
+    if param_dict.get('cc', None) is None:
+        if param_dict and all(isinstance(sub_dict, dict) for sub_dict in param_dict.values()):
+            for sub_name, sub_dict in param_dict.items():
+                validate_param(problems, where + "/" + str(sub_name), sub_dict)
+        else:
+            problems.append(where + ": has no 'cc'.")
+        return
+    check_keys(problems, where, param_dict, PARAM_KEYS)
+    check_func(problems, where, param_dict)
+    check_data_byte(problems, where, 'cc', param_dict['cc'])
+    for key in PARAM_VALUE_KEYS:
+        if key in param_dict:
+            check_data_byte(problems, where, key, param_dict[key])
+    if 'dict' in param_dict:
+        if not isinstance(param_dict['dict'], dict):
+            problems.append(where + ": 'dict' has to be a dictionary, it is " + repr(param_dict['dict']) + ".")
+        else:
+            for key, value in param_dict['dict'].items():
+                check_data_byte(problems, where + "/dict", key, value)
+    if is_int(param_dict.get('value', None)):
+        check_data_byte(problems, where, 'value', param_dict['value'])
+    check_range(problems, where, param_dict, param_dict.get('func', None) is None)
+
+
+def validate(name, conf):
+    """ check a pedal config against the schema. returns the problems found, an empty list for a good config """
+    problems = []
+    if not isinstance(conf, dict):
+        return [str(name) + ": a pedal config has to be a dictionary."]
+    for key, value in conf.items():
+        where = str(name) + "/" + str(key)
+        if key in PARAM_GROUPS:
+            if value is None:
+                continue
+            if not isinstance(value, dict):
+                problems.append(where + ": has to be a dictionary of parameters.")
+                continue
+            for param_name, param_dict in value.items():
+                validate_param(problems, where + "/" + str(param_name), param_dict)
+        elif value is not None:
+            validate_action(problems, where, value)  # an action group or a setting
+    return problems
+
+
+class CompiledPedalConf(object):
+    """ a validated pedal config turned into MessageTables: its actions, settings and a flat index of its params.
+    conf is the config as it was read, for the menus """
+    __slots__ = ['name', 'conf', 'actions', 'settings', 'params', 'unusable', 'trigger_ccs', 'problems']
+
+    def __init__(self, name, conf, cc_status, pc_status):
+        self.name = name
+        self.conf = conf if isinstance(conf, dict) else {}
+        self.problems = validate(name, conf)
+        self.actions = compile_actions(self.conf, cc_status, pc_status, self.problems)
+        self.settings = compile_settings(self.conf, cc_status, pc_status, self.problems)
+        self.params, self.unusable = compile_param_index(self.conf, cc_status, self.problems)
+        self.trigger_ccs = trigger_ccs(list(self.actions.values()) + list(self.params.values()) +
+                                       list(self.settings.values()))
+
+    def report(self):
+        """ log the problems of the config. returns True when there are none """
+        for problem in self.problems:
+            logger.error(problem)
+        return not self.problems
+
+
+def cache_path(name, data, cc_status, pc_status, cache_folder):
+    """ the cache file of a pedal config on one channel: <pedal>-<channel>-<key>.pickle, the key a hash of the file,
+    the channel it is compiled for, CACHE_VERSION and the source of the compiler """
+    key = hashlib.sha1(str(CACHE_VERSION) + COMPILER_DIGEST + cc_status + pc_status + data).hexdigest()
+    channel = str((ord(cc_status) & 0x0F) + 1)
+    return os.path.join(cache_folder, name + "-" + channel + "-" + key + ".pickle")
+
+
+def read_cache(path):
+    compiled = PickleFile.read(path)
+    return compiled if isinstance(compiled, CompiledPedalConf) else None
+
+
+def write_cache(path, compiled):
+    """ write the compiled config next to the old ones of the pedal on the same channel, then remove those. the
+    ones of other channels are left alone """
+    folder, file_name = os.path.split(path)
+    prefix = file_name[:file_name.rindex("-") + 1]  # <pedal>-<channel>-
+    if not PickleFile.write(path, compiled, "the compiled config of " + compiled.name):
+        return
+    try:
+        for old_file in os.listdir(folder):
+            if old_file.startswith(prefix) and old_file.endswith(".pickle") and old_file != file_name \
+                    and old_file[len(prefix):].count("-") == 0:
+                os.remove(os.path.join(folder, old_file))
+    except OSError as e:
+        logger.warning("Cant remove the old cached configs of " + compiled.name + ": " + str(e))
+
+
+def load_pedal_conf(path, cc_status, pc_status, cache_folder=CACHE_FOLDER):
+    """ the CompiledPedalConf of a pedal yaml for one channel. it comes from the cache when the file hasn't changed
+    since it was last compiled, otherwise the yaml is read, validated, compiled and cached. problems are logged
+    either way """
+    name = os.path.basename(path)[:-5] if path.endswith(".yaml") else os.path.basename(path)
+    with open(path, 'rb') as yaml_file:
+        data = yaml_file.read()
+    compiled_path = cache_path(name, data, cc_status, pc_status, cache_folder)
+    compiled = read_cache(compiled_path)
+    if compiled is None:
+        compiled = CompiledPedalConf(name, yaml.full_load(data), cc_status, pc_status)
+        write_cache(compiled_path, compiled)
+        logger.info("Compiled the pedal config of " + name + ".")
+    compiled.report()
+    return compiled
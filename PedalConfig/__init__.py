@@ -0,0 +1 @@
+from PedalConfig import *
@@ -0,0 +1,74 @@
+# the caches next to the song, set and pedal config files are pickles. reading one that is missing, from an older
+# version or cut short gives a default instead of an error, it is only compiled again. writing goes to a temporary
+# file of its own in the same folder that is renamed over the old one, so two threads saving the same cache at once
+# never mix their writes, and a reader sees the old file or the new one, never half of one. source_digest is for the
+# keys of the caches, so a change to the code that compiles what is cached throws the old entries away.
+import cPickle
+import hashlib
+import os
+import sys
+import tempfile
+
+import EventLog
+
+'''   ############ USAGE ###############
+entries = PickleFile.read(path, {})
+PickleFile.write(path, entries, "the compiled setlist cache")
+CACHE_KEY = (CACHE_VERSION, PickleFile.source_digest(__name__))  # the cache of what this module compiles
+'''
+logger = EventLog.get_logger(__name__)
+
+READ_ERRORS = (IOError, OSError, EOFError, cPickle.UnpicklingError, AttributeError, ImportError, IndexError,
+               ValueError, TypeError)
+TMP_SUFFIX = ".tmp"
+
+
+def source_digest(*module_names):
+    """ the sha1 of the source files of the modules, which have to be imported (a module is while it runs) """
+    digest = hashlib.sha1()
+    for module_name in module_names:
+        path = getattr(sys.modules[module_name], '__file__', None) or module_name
+        if path[-4:] in (".pyc", ".pyo") and os.path.isfile(path[:-1]):
+            path = path[:-1]
+        try:
+            with open(path, 'rb') as source_file:
+                digest.update(source_file.read())
+        except IOError:
+            digest.update(path.encode("utf-8") if not isinstance(path, bytes) else path)
+    return digest.hexdigest()
+
+
+def read(path, default=None):
+    """ the value pickled at path, or default if it can't be read """
+    try:
+        with open(path, 'rb') as pickle_file:
+            return cPickle.load(pickle_file)
+    except READ_ERRORS:
+        return default
+
+
+def write(path, value, what):
+    """ pickle value to path, through a temporary file. what names it in the warning if that fails. returns True
+    when the file was written """
+    folder, file_name = os.path.split(path)
+    tmp_path = None
+    try:
+        if folder and not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                if not os.path.isdir(folder):  # another thread made it meanwhile
+                    raise
+        fd, tmp_path = tempfile.mkstemp(suffix=TMP_SUFFIX, prefix="." + file_name + ".", dir=folder or ".")
+        with os.fdopen(fd, 'wb') as pickle_file:
+            cPickle.dump(value, pickle_file, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+        return True
+    except (IOError, OSError, cPickle.PicklingError, TypeError) as e:
+        logger.warning("Cant write " + what + " " + path + ": " + str(e))
+        if tmp_path is not None and os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        return False
@@ -0,0 +1 @@
+from PickleFile import *
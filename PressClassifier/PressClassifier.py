@@ -0,0 +1,201 @@
+# works out what a footswitch press is while it happens: a short press, a long press, a double tap, or a chord with
+# the partner switch. a long press fires from a timer the moment its hold time passes, not when the switch is let go.
+# every transition of a switch is stamped with the monotonic clock, so how late a press was decided can be measured.
+import collections
+import logging
+import threading
+
+import EventLog
+import Latency
+import MonotonicClock
+
+'''   ############ USAGE ###############
+presses = PressClassifier.PressClassifier("Part Up", handler, hold_times=[PressClassifier.LONG_PRESS])
+presses.press()  # switch went down
+presses.release()  # switch came up, handler(event) is called once the press is decided
+'''
+logger = EventLog.get_logger(__name__)
+
+LONG_PRESS = 0.5  # seconds held before a press is a long press
+DOUBLE_TAP = 0.25  # seconds after a release that a second press makes it a double tap
+TRANSITION_CAPACITY = 64  # transitions kept per switch
+
+# states of a switch
+IDLE = "idle"
+PRESSED = "pressed"  # down, what the press is isn't known yet
+HELD = "held"  # down past the last hold time, the long press fired and the release does nothing
+TAPPED = "tapped"  # let go after a short press, waiting DOUBLE_TAP for a second one
+CONSUMED = "consumed"  # down, but the press already fired as a double tap or a chord, the release does nothing
+
+# what a press turned out to be
+SHORT = "short"
+LONG = "long"
+DOUBLE = "double tap"
+CHORD = "chord"
+
+# one lock for every switch: a chord changes two of them, and presses are handled one at a time like the interrupts.
+# handlers run while it is held, on the gpio callback thread or a timer thread, so anything else that works the menus,
+# the display or the midi from an input (the rotary encoder callback) takes it too
+input_lock = threading.RLock()
+
+
+class PressEvent(object):
+    """ a decided press. level is how many hold times it was held past (LONG only). pressed_at is when the switch
+    went down, decided_at when the press could be told apart (release, hold time, second press), fired_at when the
+    handler was called """
+    __slots__ = ['switch', 'kind', 'level', 'pressed_at', 'decided_at', 'fired_at']
+
+    def __init__(self, switch, kind, level, pressed_at, decided_at, fired_at):
+        self.switch = switch
+        self.kind = kind
+        self.level = level
+        self.pressed_at = pressed_at
+        self.decided_at = decided_at
+        self.fired_at = fired_at
+
+    def __repr__(self):
+        return "PressEvent(" + self.switch + ", " + self.kind + ", level " + str(self.level) + ")"
+
+
+class PressClassifier(object):
+    """ the press state machine of one switch. hold_times are the seconds from the press at which it is held one
+    level longer: the last one fires a long press as soon as it passes, one of the others fires on release. with no
+    hold times every press is short. double_tap is the window for a second press, None for no double taps, in which
+    case a short press fires on release without waiting """
+
+    def __init__(self, name, handler=None, hold_times=None, double_tap=None):
+        self.name = name
+        self.handler = handler
+        self.hold_times = list(hold_times) if hold_times is not None else [LONG_PRESS]
+        self.double_tap = double_tap
+        self.partner = None
+        self.state = IDLE
+        self.level = 0
+        self.press_id = 0  # timers of an earlier press do nothing
+        self.pressed_at = None
+        self.timer = None
+        self.transitions = collections.deque(maxlen=TRANSITION_CAPACITY)
+        self.counts = {}
+
+    def set_partner(self, partner):
+        self.partner = partner
+        if partner is not None:
+            partner.partner = self
+
+    def is_pressed(self):
+        return self.state in (PRESSED, HELD, CONSUMED)
+
+    def press(self, now=None):
+        """ the switch went down """
+        now = MonotonicClock.monotonic() if now is None else now
+        with input_lock:
+            self.cancel_timer()
+            self.press_id += 1
+            if self.state == TAPPED:
+                self.transition(CONSUMED, "press", now)
+                self.fire(DOUBLE, now, now)  # pressed_at stays the first press
+                return
+            if self.state != IDLE:
+                logger.debug("%s pressed while %s, its release was missed", self.name, self.state)
+            self.pressed_at = now
+            self.level = 0
+            partner = self.partner
+            if partner is not None and partner.state == PRESSED:
+                partner.cancel_timer()
+                partner.transition(CONSUMED, "chord", now)
+                self.transition(CONSUMED, "press", now)
+                self.fire(CHORD, now, now)
+                return
+            self.transition(PRESSED, "press", now)
+            if self.hold_times:
+                self.start_timer(now + self.hold_times[0], self.on_hold)
+
+    def release(self, now=None):
+        """ the switch came up """
+        now = MonotonicClock.monotonic() if now is None else now
+        with input_lock:
+            if self.state == PRESSED:
+                self.cancel_timer()
+                if self.level:
+                    self.transition(IDLE, "release", now)
+                    self.fire(LONG, now, now)
+                elif self.double_tap:
+                    self.transition(TAPPED, "release", now)
+                    self.start_timer(now + self.double_tap, self.on_tap_timeout)
+                else:
+                    self.transition(IDLE, "release", now)
+                    self.fire(SHORT, now, now)
+            elif self.state in (HELD, CONSUMED):
+                self.transition(IDLE, "release", now)
+            # already up (IDLE, TAPPED): a bounce, nothing to do
+
+    def on_hold(self, press_id, due):
+        """ timer: the switch has been held for the next hold time """
+        now = MonotonicClock.monotonic()
+        with input_lock:
+            if press_id != self.press_id or self.state != PRESSED:
+                return  # let go, or made a chord, since the timer was started
+            self.timer = None
+            self.level += 1
+            if self.level < len(self.hold_times):
+                self.transition(PRESSED, "hold " + str(self.level), now)
+                self.start_timer(self.pressed_at + self.hold_times[self.level], self.on_hold)
+                return
+            self.transition(HELD, "hold " + str(self.level), now)
+            self.fire_from_timer(LONG, due, now)
+
+    def on_tap_timeout(self, press_id, due):
+        """ timer: no second press came, so it was a short press """
+        now = MonotonicClock.monotonic()
+        with input_lock:
+            if press_id != self.press_id or self.state != TAPPED:
+                return
+            self.timer = None
+            self.transition(IDLE, "tap timeout", now)
+            self.fire_from_timer(SHORT, due, now)
+
+    def start_timer(self, due, callback):
+        self.timer = threading.Timer(max(0.0, due - MonotonicClock.monotonic()), callback, [self.press_id, due])
+        self.timer.daemon = True
+        self.timer.start()
+
+    def cancel_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def transition(self, state, cause, now):
+        self.transitions.append((now, self.state, state, cause))
+        self.state = state
+
+    def fire_from_timer(self, kind, decided_at, now):
+        # there is no interrupt callback around a press a timer decided, its latency trace starts when it was decided
+        Latency.begin(self.name, decided_at)
+        try:
+            self.fire(kind, decided_at, now)
+        finally:
+            Latency.end()
+
+    def fire(self, kind, decided_at, now):
+        event = PressEvent(self.name, kind, self.level, self.pressed_at, decided_at, now)
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        EventLog.event(logger, logging.DEBUG, "press", switch=self.name, kind=kind, hold_level=self.level,
+                       held_ms=round((decided_at - self.pressed_at) * 1000.0, 1),
+                       late_ms=round((now - decided_at) * 1000.0, 2))
+        if self.handler is not None:
+            try:
+                self.handler(event)
+            except Exception as e:
+                logger.exception(e)
+
+    def stats(self):
+        """ state, how many presses of each kind, and the last transitions with their time since the first one kept """
+        with input_lock:
+            transitions = list(self.transitions)
+            start = transitions[0][0] if transitions else 0.0
+            return {
+                'state': self.state,
+                'counts': dict(self.counts),
+                'transitions': [{'ms': round((now - start) * 1000.0, 2), 'from': from_state, 'to': to_state,
+                                 'cause': cause} for now, from_state, to_state, cause in transitions],
+            }
@@ -0,0 +1 @@
+from PressClassifier import *
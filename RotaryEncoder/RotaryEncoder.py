@@ -10,28 +10,28 @@ import yaml
 from numpy import arange, cos
 
 import EffectLoops
+import EventLog
+import MIDI
+import Morph
 import N_Tree
 import OledDisplay
 import PartSongSet
+import PartStager
+import PedalConfig
+import PressClassifier
+import SongLibrary
 
 """   ############ USAGE ###############
 logger.info("info message")
 logger.warning("warning message")
 logger.error("error message")
 """
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-logger.propagate = False
-# create console handler and set level to info
-handler = logging.StreamHandler()
-handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter("%(asctime)s [RotaryEncoder.py] [%(levelname)-5.5s]  %(message)s")
-handler.setFormatter(formatter)
-logger.addHandler(handler)
+logger = EventLog.get_logger(__name__)
 
 SET_FOLDER = "/home/pi/MidiController/PartSongSet/Sets/"
 MIDI_PEDAL_CONF_FOLDER = "/home/pi/MidiController/Main/Conf/MidiPedals/"
 CONFIG_FILE = "/home/pi/MidiController/Main/Conf/midi_controller.yaml"
+ROTARY_HOLD_TIMES = [0.5, 2, 5]  # seconds the knob is held to go up a menu, to the global/main menu, to power off
 
 
 # define class for the PWM driver for the colors part of the rotary knob
@@ -167,23 +167,24 @@ class RotaryEncoder(RgbKnob):
         super(RotaryEncoder, self).__init__(knob_color)
         self.oled = OledDisplay.OledDisplay()
         # self.lcd = Adafruit_CharLCD.Adafruit_CharLCDPlate() #: " "has-a" lcd
-        self.setlist = PartSongSet.Setlist()  # : " "has-a" Setlist
+        # : " "has-a" Setlist, read through the compiled cache so a set that didn't change is not parsed again
+        self.setlist = PartSongSet.Setlist(cache=PartSongSet.compiled_cache, store=PartSongSet.song_store)
+        self.setlist.add_song_loaded_callback(self.check_song_params)
+        # index of every song and set file, for the menus and the controller api. the index saved last time is
+        # there straight away, the files that changed since are read in the background
+        self.library = SongLibrary.SongLibrary(PartSongSet.SONG_PATH, SET_FOLDER, cache=PartSongSet.compiled_cache)
+        self.library.refresh_in_background()
         self.displayed_msg = ""
         self.setlist_name = previously_loaded_set
         # load the set, song, and part that was last used that was saved to the default file
         self.setlist.load_setlist(SET_FOLDER + previously_loaded_set)
-        self.current_song = self.setlist.songs.head
-        while self.current_song.next is not None and previously_loaded_song != self.current_song.data.name:
-            self.current_song = self.current_song.next
-        self.current_part = self.current_song.data.parts.head
-        while self.current_part.next is not None and previously_loaded_part != self.current_part.data.part_name:
-            self.current_part = self.current_part.next
-        self.displayed_song = self.current_song
-        self.displayed_part = self.current_part
-        self.displayed_song_index = self.setlist.songs.node_to_index(self.displayed_song)
-        self.displayed_part_index = self.current_song.data.parts.node_to_index(self.displayed_part)
-        logger.info("{displayed song index: " + str(self.displayed_song_index) + ", displayed part index: " + str(
-            self.displayed_part_index) + "}")
+        # the part that is loaded, and the one on display that select would load
+        self.current = PartSongSet.SetlistCursor(self.setlist)
+        self.current.find(previously_loaded_song, previously_loaded_part)
+        self.displayed = PartSongSet.SetlistCursor(self.setlist)
+        self.displayed.set(self.current)
+        logger.info("{displayed song index: " + str(self.displayed.song_index) + ", displayed part index: " + str(
+            self.displayed.part_index) + "}")
 
         # set up the MidiController setup menus (set, seong, part, midi_pedal, bpm)
         self.setlist_menu = self.setup_menu.add_child("Sets", self.show_setlists, self.load_set_func)
@@ -199,6 +200,8 @@ class RotaryEncoder(RgbKnob):
 
         self.midi_pedal_config_menu = {}
         self.set_midi_pedal_conf_grps_menu()
+        # set when files the menus are built from changed, see rebuild_menu
+        self.menu_outdated = False
 
         # define power menu
         self.power_menu = self.menu.root.add_child("Power", self.set_menu_data_message)
@@ -213,6 +216,10 @@ class RotaryEncoder(RgbKnob):
                                                                self.load_brightness_func)
         self.about_menu = self.global_menu.add_child("About", self.show_about, self.load_about_func)
         self.button_lock_menu = self.global_menu.add_child("Button Lock", self.show_lock, self.lock_unlock_func)
+        self.resync_menu = self.global_menu.add_child("Resync MIDI", self.set_menu_data_message)
+        self.resync_menu.menu_data_prompt = "Resend Part?"
+        self.resync_menu.menu_data_items = ["NO yes", "no YES"]
+        self.resync_menu.menu_data_dict = {"NO yes": self.change_menu_nodes, "no YES": self.resync_midi}
 
         # variables for the rotary movement interpretation loop
         self.last_good_seq = 0
@@ -223,16 +230,118 @@ class RotaryEncoder(RgbKnob):
         self.menu.current_node.current_child = 0
 
     def set_midi_pedal_conf_grps_menu(self):
-        for midi_pedal_conf in os.listdir(MIDI_PEDAL_CONF_FOLDER):
-            if midi_pedal_conf[-5:] == ".yaml":
-                midi_pedal_name = midi_pedal_conf[:-5]
+        """ a node under midi pedals for every pedal config file, none for a file that is gone """
+        midi_pedal_names = [midi_pedal_conf[:-5] for midi_pedal_conf in os.listdir(MIDI_PEDAL_CONF_FOLDER)
+                            if midi_pedal_conf[-5:] == ".yaml"]
+        for midi_pedal_name in midi_pedal_names:
+            if midi_pedal_name not in self.midi_pedal_config_menu:
                 self.midi_pedal_config_menu[midi_pedal_name] = \
                     self.midi_pedal_menu.add_child(midi_pedal_name, self.show_midi_pedal_configuration_groups)
+        for midi_pedal_name in [name for name in self.midi_pedal_config_menu if name not in midi_pedal_names]:
+            self.midi_pedal_menu.remove_child(self.midi_pedal_config_menu.pop(midi_pedal_name))
+        if self.midi_pedal_menu.children:
+            self.midi_pedal_menu.current_child = min(self.midi_pedal_menu.current_child,
+                                                     len(self.midi_pedal_menu.children) - 1)
 
-    # TODO: this is broken. it should be a way to set the contents of the menu.
     def rebuild_menu(self):
-        # build setup menu based on current files stored in filesystem
-        pass
+        """ bring the menus built from files up to date after they changed on disk: the pedal config nodes, and the
+        set, song or part list on display, which stays on the item it was on if that is still there. does nothing
+        if no file changed since the last time """
+        if not self.menu_outdated:
+            return
+        self.menu_outdated = False
+        self.set_midi_pedal_conf_grps_menu()
+        node = self.menu.current_node
+        if node in (self.setlist_menu, self.songs_menu, self.parts_menu) and node.menu_data_loaded:
+            position = node.menu_data_position or 0
+            selected = node.menu_data_items[position] if position < len(node.menu_data_items) else None
+            node.func()
+            if selected in node.menu_data_items:
+                node.menu_data_position = node.menu_data_items.index(selected)
+            else:
+                node.menu_data_position = max(0, min(position, len(node.menu_data_items) - 1))
+            self.set_menu_data_message()
+
+    def reload_files(self, paths):
+        """ the song, set and pedal config files that changed on disk (FileWatcher). they are read and compiled on
+        the watcher thread, then the live setlist, pedals and menus are swapped over under the input lock, so no
+        button, encoder or timer press sees them half way. the song and part on display and the loaded one stay
+        where they are, the changes go out with the next part """
+        changed_songs = set()
+        changed_sets = set()
+        compiled_pedals = []
+        for path in paths:
+            folder, file_name = os.path.split(path)
+            name = file_name[:-5]
+            folder = os.path.join(folder, "")
+            if folder == PartSongSet.SONG_PATH:
+                changed_songs.add(name)
+            elif folder == SET_FOLDER:
+                changed_sets.add(name)
+            elif folder == MIDI_PEDAL_CONF_FOLDER:
+                compiled_pedal = self.read_midi_pedal(name, path)
+                if compiled_pedal is not None:
+                    compiled_pedals.append(compiled_pedal)
+            else:
+                continue
+            self.library.update_file(path)
+        if changed_songs or changed_sets:
+            self.library.write_index()
+        setlist_name = self.setlist_name
+        setlist = None
+        if setlist_name in changed_sets or changed_songs.intersection(self.setlist.song_list):
+            setlist = self.read_setlist(setlist_name)
+        PartSongSet.save_cache()
+        with PressClassifier.input_lock:
+            for midi_pedal_obj, compiled in compiled_pedals:
+                midi_pedal_obj.reload_config(compiled)
+            if setlist is not None and setlist_name == self.setlist_name:  # not if another set was loaded meanwhile
+                self.use_setlist(setlist)
+            PartStager.invalidate()
+            self.menu_outdated = True
+            self.rebuild_menu()
+
+    def read_setlist(self, setlist_name):
+        """ read the set again, with the songs the cursors are on parsed, so use_setlist has nothing left to read.
+        songs that didn't change are the same Song objects (PartSongSet.SongStore), so only the changed ones are
+        parsed. None if the set has no songs now """
+        setlist = PartSongSet.Setlist(cache=PartSongSet.compiled_cache, store=PartSongSet.song_store)
+        setlist.load_setlist(SET_FOLDER + setlist_name)
+        if not setlist.songs:
+            logger.error("The set " + setlist_name + " has no songs now, the one loaded is kept.")
+            return None
+        for song_name in set([self.current.song.data.name, self.displayed.song.data.name]):
+            song = setlist.songs.find(lambda song_data: song_data.name == song_name)
+            if song is not None:
+                song.data.load()
+        return setlist
+
+    def use_setlist(self, setlist):
+        """ swap the set read by read_setlist in, with the cursors on the songs and parts with the names they were on.
+        called with the input lock held """
+        current = PartSongSet.SetlistCursor(setlist)
+        current.find(self.current.song.data.name, self.current.part.data.part_name)
+        displayed = PartSongSet.SetlistCursor(setlist)
+        displayed.find(self.displayed.song.data.name, self.displayed.part.data.part_name)
+        self.setlist = setlist
+        self.current = current
+        self.displayed = displayed
+        logger.info("Reloaded the set " + self.setlist_name + ", still on " + str(self.current.song.data.name) +
+                    ": " + str(self.current.part.data.part_name) + ".")
+        self.check_setlist_params()
+        self.prefetch_songs()
+
+    def read_midi_pedal(self, midi_pedal_name, path):
+        """ compile the config of a pedal again, as (pedal, compiled config) for reload_config. None for a pedal that
+        isn't on a channel or a config that is gone, which leaves the pedal as it is """
+        midi_pedal_obj = self.midi_pedal_dict.get(midi_pedal_name, None)
+        if midi_pedal_obj is None:
+            return None  # not on a channel, only its menu node changes
+        if not os.path.isfile(path):
+            logger.warning("The config of " + midi_pedal_name + " is gone, the one loaded is kept.")
+            return None
+        return midi_pedal_obj, PedalConfig.load_pedal_conf(path, midi_pedal_obj.midi.cc_channel,
+                                                           midi_pedal_obj.midi.pc_channel)
 
     def clean_up_display(self):
         self.oled.clear_display()
@@ -326,13 +435,15 @@ class RotaryEncoder(RgbKnob):
 
     @staticmethod
     def test_point_node_printer(the_node):
+        if not logger.isEnabledFor(logging.DEBUG):
+            return  # runs on every menu change, don't build the strings for nothing
         this_data_item = str(None)
         try:
             if the_node.menu_data_items:
                 this_data_item = str(the_node.menu_data_items[the_node.menu_data_position])
-            logger.info("\nnode: " + str(the_node) + "prompt: " + the_node.menu_data_prompt +
-                        "\nitems: " + str(the_node.menu_data_items) + "\ncurrent item: " + this_data_item +
-                        "\nposition: " + str(the_node.menu_data_position))
+            logger.debug("\nnode: %s prompt: %s\nitems: %s\ncurrent item: %s\nposition: %s", the_node,
+                         the_node.menu_data_prompt, the_node.menu_data_items, this_data_item,
+                         the_node.menu_data_position)
         except Exception as e:
             logger.exception(e)
             logger.error("Ran into an error trying to print using stuff using the following data:" +
@@ -347,10 +458,11 @@ class RotaryEncoder(RgbKnob):
         # display the first item in the list
         self.setlist_menu.menu_data_items = []
         self.setlist_menu.menu_data_prompt = self.setlist_menu.name + ":"
-        setlist_files = os.listdir(SET_FOLDER)
-        for setlist_file in setlist_files:
-            if setlist_file[-5:] == ".yaml":
-                self.setlist_menu.menu_data_items.append(setlist_file[:-5])
+        # the library index only reads the set folder again if a set was added or removed since the last visit. set
+        # files are small, the songs are left to the background refresh and the file watcher. a refresh that is
+        # running, e.g. the one at startup, isn't waited for, it picks the sets up itself
+        self.library.refresh_if_changed([SongLibrary.SET], wait=False)
+        self.setlist_menu.menu_data_items = self.library.get_set_names()
         self.test_point_node_printer(self.setlist_menu)
 
     def show_songs(self):
@@ -365,8 +477,8 @@ class RotaryEncoder(RgbKnob):
     def show_parts(self):
         self.parts_menu.menu_data_items = []
         self.parts_menu.menu_data_prompt = self.parts_menu.name + ":"
-        logger.info(self.current_song.data.parts.show())
-        for part in self.current_song.data.parts.to_list():
+        logger.info(self.current.song.data.parts.show())
+        for part in self.current.song.data.parts.to_list():
             logger.info(part)
             self.parts_menu.menu_data_items.append(part.part_name)
         self.test_point_node_printer(self.parts_menu)
@@ -505,36 +617,34 @@ class RotaryEncoder(RgbKnob):
     #     self.bpm_menu.menu_data_prompt = self.bpm_menu.name + ":"
     #     self.bpm_menu.menu_data_items = self.tempo_range
     #     # tempo range starts at 40 and goes to 500 by 0.5
-    #     logger.info("bpm: " + self.current_song.data.bpm)
+    #     logger.info("bpm: " + self.current.song.data.bpm)
     #     logger.info("position in list: " + str(self.bpm_menu.menu_data_position))
-    #     self.bpm_menu.menu_data_position = int(2 * (float(self.current_song.data.bpm) - 40))
+    #     self.bpm_menu.menu_data_position = int(2 * (float(self.current.song.data.bpm) - 40))
     #     self.test_point_node_printer(self.midi_pedal_config_menu)
 
     def load_set_func(self):
         self.set_message("Loading set...")
         self.setlist_name = self.setlist_menu.menu_data_items[self.setlist_menu.menu_data_position]
         self.setlist.load_setlist(SET_FOLDER + self.setlist_name)
+        PartStager.invalidate()
         logger.info("switched current setlist to: " + self.setlist_name + "\n" +
-                    "switched current song to: " + str(self.current_song.data.name) + str(self.current_song) + "\n" +
-                    "switched current part to: " + str(self.current_part.data.part_name) + str(self.current_part))
-        self.current_song = self.setlist.songs.head
-        self.current_part = self.current_song.data.parts.head
+                    "switched current song to: " + str(self.current.song.data.name) + str(self.current.song) + "\n" +
+                    "switched current part to: " + str(self.current.part.data.part_name) + str(self.current.part))
+        self.current = PartSongSet.SetlistCursor(self.setlist)
         self.songs_menu.menu_data_position = self.menu_data_item_position_init(self.songs_menu.menu_data_position)
         self.parts_menu.menu_data_position = self.menu_data_item_position_init(self.parts_menu.menu_data_position)
-        self.displayed_song = self.current_song
-        self.displayed_part = self.current_part
-        self.displayed_song_index = self.setlist.songs.node_to_index(self.displayed_song)
-        self.displayed_part_index = self.current_song.data.parts.node_to_index(self.displayed_part)
+        self.displayed = PartSongSet.SetlistCursor(self.setlist)
+        self.check_setlist_params()
         self.load_part()
         self.change_menu_nodes()
 
     def load_song_func(self):
-        self.current_song = self.setlist.songs.index_to_node(self.songs_menu.menu_data_position + 1)
+        self.displayed.seek_song(self.songs_menu.menu_data_position + 1)
         self.load_song()
         self.change_menu_nodes()
 
     def load_part_func(self):
-        self.current_part = self.current_song.data.parts.index_to_node(self.parts_menu.menu_data_position + 1)
+        self.current.seek_part(self.parts_menu.menu_data_position + 1)
         self.load_part()
         self.change_menu_nodes()
 
@@ -553,13 +663,12 @@ class RotaryEncoder(RgbKnob):
         if current_midi_pedal_option_dict:
             logger.info("Executing " + midi_pedal_conf_group_name + " function for " + midi_pedal_name + ".")
             midi_pedal = self.midi_pedal_dict[midi_pedal_name]
-            action_dict = midi_pedal.midi_pedal_conf_dict.get(midi_pedal_conf_group_name, {})
-            if action_dict:
+            if midi_pedal_conf_group_name in midi_pedal.action_tables:
                 if len(self.menu.current_node.menu_data_items) > self.menu.current_node.menu_data_position:
                     action_value = self.menu.current_node.menu_data_items[self.menu.current_node.menu_data_position]
-                    midi_pedal.determine_action_method(action_dict, action_value)
+                    midi_pedal.run_action(midi_pedal_conf_group_name, action_value)
                 else:
-                    midi_pedal.determine_action_method(action_dict)
+                    midi_pedal.run_action(midi_pedal_conf_group_name)
         else:
             logger.warn(
                 "NOT executing " + midi_pedal_conf_group_name + " function for " + midi_pedal_name +
@@ -591,12 +700,21 @@ class RotaryEncoder(RgbKnob):
         self.midi_pedal_dict[midi_pedal_name].set_params({option: value})
 
     # def load_bpm_func(self):
-    #     self.current_song.data.bpm = str(self.bpm_menu.menu_data_items[self.bpm_menu.menu_data_position])
+    #     self.current.song.data.bpm = str(self.bpm_menu.menu_data_items[self.bpm_menu.menu_data_position])
     #     for midi_pedal_obj in self.all_midi_pedals:
     #         if midi_pedal_obj.name is "TapTempo":
-    #             midi_pedal_obj.setTempo(float(self.current_song.data.bpm))
+    #             midi_pedal_obj.setTempo(float(self.current.song.data.bpm))
     #     self.change_menu_nodes(self.menu.current_node.parent)
 
+    def resync_midi(self, midi_pedal_name=None):
+        """ resend the whole current part to one pedal, or to all of them, e.g. after a pedal was power cycled """
+        if midi_pedal_name is None:
+            self.load_part(force_resync=True)
+        else:
+            self.midi_pedal_dict[midi_pedal_name].invalidate()
+            self.load_part()
+        self.change_menu_nodes()
+
     def change_and_select(self, func_name):
         func_dict = {
             "Select Song Dn": self.prev_song,
@@ -609,42 +727,90 @@ class RotaryEncoder(RgbKnob):
             func()
             self.select_choice()
 
-    def load_part(self):
+    def load_part(self, force_resync=False):
+        """ send the part to the pedals. only what differs from what the pedals were last sent goes out, unless
+        force_resync is set, then every pedal gets its whole state again """
         logger.info(
-            "switching current part to: " + str(self.current_part.data.part_name) + ": " + str(self.current_part))
-        tempo_obj = None
-        self.displayed_part_index = self.current_song.data.parts.node_to_index(self.current_part)
-        for midi_pedal_obj in self.all_midi_pedals:
-            if midi_pedal_obj.name == "TapTempo":
-                tempo_obj = midi_pedal_obj  # store this object for later use.
-            else:
-                state, preset, params, settings = self.current_part.data.pedal_dictionary[midi_pedal_obj.name]
-                if state:
-                    midi_pedal_obj.turn_on()
-                else:
-                    midi_pedal_obj.turn_off()
-                if preset is not None:
-                    midi_pedal_obj.set_preset(preset)
-                if params:
-                    midi_pedal_obj.set_params(params)
-                if settings:
-                    midi_pedal_obj.set_setting(settings)
-
-            # if midi_pedal_obj.name == "TimeLine":
-            # 	midi_pedal_obj.setTempo(float(self.current_song.data.bpm))
-            # need to get all the midi_pedals to their correct state before messing with tempo
-        # now that we are out of the for loop, set the tempo
+            "switching current part to: " + str(self.current.part.data.part_name) + ": " + str(self.current.part))
+        self.displayed.set(self.current)
+        Morph.cancel()  # a morph still running finishes at its end values before the new part goes out
+        if force_resync:
+            for midi_pedal_obj in self.all_midi_pedals:
+                midi_pedal_obj.invalidate()
+        # a part the stager worked out in the background only has to be sent
+        part_plans = None if force_resync else PartStager.take(self.current.part)
+        if part_plans is None:
+            part_plans = self.plan_part(self.current.part, force_resync)
+        EffectLoops.send_part_plans(part_plans, "Part " + str(self.current.part.data.part_name))
+        ramps = [ramp for plan in part_plans for ramp in plan.ramps]
+        if ramps:
+            Morph.morph(ramps, Morph.morph_duration(self.current.part.data.morph, self.current.song.data.get_tempo()))
+        # the pedals have their presets now, so a tempo sent next is not overwritten by the one saved in the preset
+        self.load_tempo(force_resync)
         self.rebuild_menu()
         self.set_song_info_message()
-        if tempo_obj is not None:
-            tempo_obj.setTempo(float(self.current_song.data.bpm))
         self.save_part_to_default()
+        self.prefetch_songs()
+
+    def plan_part(self, part, force_resync=False):
+        """ the PartPlans that take every pedal from what it was last sent to part. only reads the pedals, so the
+        stager can call it from its thread """
+        morph = part.data.morph if Morph.is_running() and not force_resync else None
+        part_plans = []
+        for midi_pedal_obj in self.all_midi_pedals:
+            state = part.data.pedal_dictionary[midi_pedal_obj.name]
+            part_plans.append(midi_pedal_obj.plan_part_state(state, force_resync,
+                                                             self.morph_params(morph, midi_pedal_obj)))
+        return part_plans
+
+    def staging_targets(self):
+        """ the parts a press is likely to load next: the one on display, the next and previous part and the first
+        part of the next song """
+        parts = []
+        if self.displayed.part is not self.current.part:
+            parts.append(self.displayed.part)
+        parts.extend([self.current.part.next, self.current.part.prev])
+        if self.current.song.next is not None:
+            parts.append(self.current.song.next.data.parts.head)
+        return [part for part in parts if part is not None]
+
+    def prefetch_songs(self):
+        """ have the songs next to the current and the displayed one parsed in the background """
+        self.setlist.prefetch(self.current.song, self.displayed.song)
+
+    def start_staging(self, delay=PartStager.STAGE_DELAY):
+        PartStager.start(self.staging_targets, self.plan_part, delay)
+
+    @staticmethod
+    def morph_params(morph, midi_pedal_obj):
+        """ the params of a pedal the part morphs to: the ones listed for the pedal in the morph config, or all of its
+        'Knobs/Switches' if the config lists none """
+        if not morph:
+            return None
+        if morph.get('params', None) is not None:
+            return morph['params'].get(midi_pedal_obj.name, None)
+        return (midi_pedal_obj.midi_pedal_conf_dict.get('Knobs/Switches', None) or {}).keys()
+
+    def load_tempo(self, force_resync=False):
+        """ set the midi clock and every pedal with a 'Set Tempo' action to the tempo of the current song. pedals
+        only get it again when it changed (or on a resync) so they keep their tapped tempo between parts """
+        try:
+            bpm = float(self.current.song.data.get_tempo())
+        except ValueError:
+            logger.warning("Song " + str(self.current.song.data.name) + " has no usable tempo: " +
+                           str(self.current.song.data.get_tempo()))
+            return
+        MIDI.MIDI.set_tempo(bpm)
+        tempo = int(round(bpm))  # 'Set Tempo' actions are built from whole bpm
+        for midi_pedal_obj in self.all_midi_pedals:
+            if midi_pedal_obj.has_tempo() and (force_resync or midi_pedal_obj.sent_tempo != tempo):
+                midi_pedal_obj.set_tempo(tempo)
 
     def get_rotary_movement(self, a, b):
         """ accepts pins a and b from rpi gpio, determines the direction of the movement, and returns CW or CCW """
         move = None  # initialize move to None
         seq = b * 2 + a * 1 | b << 1
-        logger.info("sequence: " + str(seq))
+        logger.debug("sequence: %s", seq)  # every edge of the encoder, only formatted when debug is on
         if seq in [1, 3]:
             self.last_good_seq = seq
         elif seq == 2:
@@ -661,16 +827,14 @@ class RotaryEncoder(RgbKnob):
         return move
 
     def load_song(self):
-        self.current_song = self.displayed_song
-        self.current_part = self.displayed_part
-        logger.info("switching current song to: " + str(self.current_song.data.name) + ": " + str(self.current_song))
-        self.displayed_song_index = self.setlist.songs.node_to_index(self.current_song)
+        self.current.set(self.displayed)
+        logger.info("switching current song to: " + str(self.current.song.data.name) + ": " + str(self.current.song))
         self.load_part()
 
     def change_menu_pos(self, direction):
         """ change the current position of the menu and display the new menu item unless the end or the beginning of
         the list has been reached """
-        logger.info("direction: " + direction)
+        logger.debug("direction: %s", direction)
         if self.menu.current_node is not self.menu.root:
             if self.menu.current_node.children:
                 if direction == "CW":
@@ -681,30 +845,31 @@ class RotaryEncoder(RgbKnob):
                     if self.menu.current_node.current_child > 0:
                         self.menu.current_node.current_child -= 1
                         self.set_children_message()
-                try:
-                    logger.info(
-                        "current node name: " + self.menu.current_node.name + ",\nnumber of children in node: " +
-                        str(len(self.menu.current_node.children)) + ",\ncurrent child in node: " +
-                        str(self.menu.current_node.current_child))
-                except Exception as e:
-                    logger.exception(e)
-                    # logger.info(sys.exc_info()[0])
-                    logger.info("current node name: " + self.menu.current_node.name + ",\ncurrent child in node: " +
-                                str(self.menu.current_node.current_child))
+                if logger.isEnabledFor(logging.DEBUG):
+                    try:
+                        logger.debug("current node name: %s,\nnumber of children in node: %s,\ncurrent child in node: "
+                                     "%s", self.menu.current_node.name, len(self.menu.current_node.children),
+                                     self.menu.current_node.current_child)
+                    except Exception as e:
+                        logger.exception(e)
+                        # logger.info(sys.exc_info()[0])
+                        logger.debug("current node name: %s,\ncurrent child in node: %s", self.menu.current_node.name,
+                                     self.menu.current_node.current_child)
             else:
                 if direction == "CW":
                     self.next_menu_list_item()
                 elif direction == "CCW":
                     self.prev_menu_list_item()
-                try:
-                    logger.info("current node name: " + self.menu.current_node.name + ",\nnumber of elems in list: " +
-                                str(len(self.menu.current_node.menu_data_items)) + ",\ncurrent elem in list: " +
-                                str(self.menu.current_node.menu_data_position))
-                except Exception as e:
-                    logger.exception(e)
-                    # logger.info(sys.exc_info()[0])
-                    logger.info("current node name: " + self.menu.current_node.name + ",\ncurrent elem in list: " +
-                                str(self.menu.current_node.menu_data_items[self.menu.current_node.menu_data_position]))
+                if logger.isEnabledFor(logging.DEBUG):
+                    try:
+                        logger.debug("current node name: %s,\nnumber of elems in list: %s,\ncurrent elem in list: %s",
+                                     self.menu.current_node.name, len(self.menu.current_node.menu_data_items),
+                                     self.menu.current_node.menu_data_position)
+                    except Exception as e:
+                        logger.exception(e)
+                        # logger.info(sys.exc_info()[0])
+                        logger.debug("current node name: %s,\ncurrent elem in list: %s", self.menu.current_node.name,
+                                     self.menu.current_node.menu_data_items[self.menu.current_node.menu_data_position])
 
         # TODO: don't let the tempo go below 40 or above 500
         # if tap tempo button is pressed,
@@ -723,19 +888,19 @@ class RotaryEncoder(RgbKnob):
         elif menu_str == "SongInfo":
             self.set_song_info_message()
         elif menu_str == "Song":
-            self.display_word_wrap(self.current_song.data.name)
+            self.display_word_wrap(self.current.song.data.name)
         elif menu_str == "Part":
-            self.set_message(self.current_part.data.part_name)
+            self.set_message(self.current.part.data.part_name)
         else:
-            self.set_message(self.current_song.data.bpm + "BPM")
+            self.set_message(self.current.song.data.bpm + "BPM")
 
     # def getMenuItemString(self):
     # 	"""get the current menu item from the menulist associated with the currentmenu
     # 	"""
     # 	if self.currentMenu == "PartMenu":
-    # 		return self.current_part.data.part_name
+    # 		return self.current.part.data.part_name
     # 	if self.currentMenu == "SongMenu":
-    # 		return self.current_song.data.name
+    # 		return self.current.song.data.name
     # 	else:
     # 		return self.menuDictionary[self.currentMenu][self.menu_data_position]
 
@@ -754,15 +919,15 @@ class RotaryEncoder(RgbKnob):
             self.set_message(text)
 
     def set_song_info_message(self):
-        self.set_message(self.current_song.data.name + " - "
-                         + self.current_song.data.bpm + "BPM - " + self.current_part.data.part_name)
-        logger.info("Now displaying indices song: " + str(self.displayed_song_index) + "; part: " + str(
-            self.displayed_part_index))
+        self.set_message(self.current.song.data.name + " - "
+                         + self.current.song.data.bpm + "BPM - " + self.current.part.data.part_name)
+        logger.info("Now displaying indices song: " + str(self.displayed.song_index) + "; part: " + str(
+            self.displayed.part_index))
 
     def set_song_info_message_by_value(self, song, part):
         self.set_message(song.data.name + " - " + song.data.bpm + "BPM - " + part.data.part_name)
-        logger.info("Now displaying indices song: " + str(self.displayed_song_index) + "; part: " + str(
-            self.displayed_part_index))
+        logger.info("Now displaying indices song: " + str(self.displayed.song_index) + "; part: " + str(
+            self.displayed.part_index))
 
     def get_message(self):
         """ return the message on the lcd screen """
@@ -781,11 +946,26 @@ class RotaryEncoder(RgbKnob):
         for midi_pedal_obj in self.all_midi_pedals:
             if isinstance(midi_pedal_obj, EffectLoops.MidiPedal):
                 self.midi_pedal_dict[midi_pedal_obj.name] = midi_pedal_obj
+        self.check_setlist_params()
         if mode == "favorite":
             self.change_to_footswitch_item()
             self.load_part()
         self.switch_modes(mode)
 
+    def check_setlist_params(self):
+        """ report the params in the setlist that a pedal has no config for when the set is loaded, not every time a
+        part with them is switched to """
+        for song in self.setlist.songs.to_list():
+            if song.is_loaded():  # the others are checked as they are parsed, by check_song_params
+                self.check_song_params(song.name, song.parts)
+
+    def check_song_params(self, song_name, parts):
+        for part in parts.to_list():
+            for midi_pedal_name, state in part.pedal_dictionary.iteritems():
+                midi_pedal_obj = self.midi_pedal_dict.get(midi_pedal_name, None)
+                if midi_pedal_obj is not None and isinstance(state.params, dict):
+                    midi_pedal_obj.check_params(state.params, " (" + str(song_name) + ", " + str(part.part_name) + ")")
+
     def get_midi_pedals_list(self):
         """ returns the midi_pedal list for the current midi_pedal layout """
         return self.all_midi_pedals
@@ -809,8 +989,8 @@ class RotaryEncoder(RgbKnob):
         defaults = self.read_config()
         defaults['current_settings']['preset'].update({
             'setList': self.setlist_name,
-            'song': self.current_song.data.name,
-            'part': self.current_part.data.part_name
+            'song': self.current.song.data.name,
+            'part': self.current.part.data.part_name
         })
         self.write_config(defaults)
 
@@ -837,10 +1017,7 @@ class RotaryEncoder(RgbKnob):
 
     def change_to_footswitch_item(self, button=None):
         if button:
-            if button <= self.current_song.data.parts.get_length() and \
-                    not self.current_part == self.current_song.data.parts.index_to_node(
-                        button):
-                self.current_part = self.current_song.data.parts.index_to_node(button)
+            if button != self.current.part_index and self.current.seek_part(button):
                 self.load_part()
 
     @staticmethod
@@ -850,34 +1027,30 @@ class RotaryEncoder(RgbKnob):
 
     def prev_part(self):
         logger.info("This is the \'previous part\' action.")
-        self.displayed_part = self.displayed_song.data.parts.index_to_node(self.displayed_part_index - 1)
-        if self.displayed_part and (self.displayed_part_index > 1):
+        if self.displayed.step_part(-1):
             self.displaying_current_songpart = False
             self.start_new_thread()
-            self.displayed_part_index -= 1
-            self.set_song_info_message_by_value(self.displayed_song, self.displayed_part)
+            self.set_song_info_message_by_value(self.displayed.song, self.displayed.part)
+            PartStager.restage()  # have the part on display ready for select
         # TODO: set a timer so the menu changes back to current part after expiration
 
     def next_part(self):
         logger.info("This is the \'next part\' action.")
-        self.displayed_part = self.displayed_song.data.parts.index_to_node(self.displayed_part_index + 1)
-        if self.displayed_part and (self.displayed_part_index < self.displayed_song.data.parts.length):
+        if self.displayed.step_part(1):
             self.displaying_current_songpart = False
             self.start_new_thread()
-            self.displayed_part_index += 1
-            self.set_song_info_message_by_value(self.displayed_song, self.displayed_part)
+            self.set_song_info_message_by_value(self.displayed.song, self.displayed.part)
+            PartStager.restage()
         # TODO: set a timer so the menu changes back to current part after expiration
 
     def prev_song(self):
         logger.info("This is the \'previous song\' action.")
-        self.displayed_song = self.setlist.songs.index_to_node(self.displayed_song_index - 1)
-        if self.displayed_song and (self.displayed_song_index > 1):
+        if self.displayed.step_song(-1):
             self.displaying_current_songpart = False
             self.start_new_thread()
-            self.displayed_song_index -= 1
-            self.displayed_part_index = 1
-            self.displayed_part = self.displayed_song.data.parts.head
-            self.set_song_info_message_by_value(self.displayed_song, self.displayed_song.data.parts.head)
+            self.set_song_info_message_by_value(self.displayed.song, self.displayed.part)
+            PartStager.restage()
+            self.prefetch_songs()
         # TODO: set a timer so the menu changes back to current song after expiration
 
     def start_new_thread(self):
@@ -893,24 +1066,21 @@ class RotaryEncoder(RgbKnob):
 
     def next_song(self):
         logger.info("This is the \'next song\' action.")
-        self.displayed_song = self.setlist.songs.index_to_node(self.displayed_song_index + 1)
-        if self.displayed_song and (self.displayed_song_index < self.setlist.songs.length):
+        if self.displayed.step_song(1):
             self.displaying_current_songpart = False
             self.start_new_thread()
-            self.displayed_song_index += 1
-            self.displayed_part_index = 1
-            self.displayed_part = self.displayed_song.data.parts.head
-            self.set_song_info_message_by_value(self.displayed_song, self.displayed_song.data.parts.head)
+            self.set_song_info_message_by_value(self.displayed.song, self.displayed.part)
+            PartStager.restage()
+            self.prefetch_songs()
         # TODO: set a timer so the menu changes back to current song after expiration
 
     def select_choice(self):
         logger.info("This is the \'select\' action.")
         self.displaying_current_songpart = True
-        if self.current_song is not self.displayed_song:
-            # self.current_song = self.displayed_song
+        if self.current.song is not self.displayed.song:
             self.load_song()
-        elif self.current_part is not self.displayed_part:
-            self.current_part = self.displayed_part
+        elif self.current.part is not self.displayed.part:
+            self.current.set(self.displayed)
             self.load_part()
 
     def next_menu_list_item(self):
@@ -1003,6 +1173,7 @@ class RotaryPushButton(EffectLoops.ButtonOnPedalBoard, RotaryEncoder):
         RotaryEncoder.__init__(self, **kwargs)  # initialize parent class rotary encoder
         # initialize parent class ButtonOnPedalBoard
         super(RotaryPushButton, self).__init__(name, None, None, button)
+        self.set_press_handler(self.handle_press)
 
     def switch_modes(self, mode=None):
         if mode:
@@ -1040,32 +1211,28 @@ class RotaryPushButton(EffectLoops.ButtonOnPedalBoard, RotaryEncoder):
         })
         self.write_config(defaults)
 
-    def button_state(self, int_capture_pin_val):
-        """ sets the state (is_pressed) of the rotaryPushButton and captures the time of the press so that when it is
-        released, the difference can be calculated """
-        if not int_capture_pin_val:  # when the button was pressed
-            self.is_pressed = True
-            self.start = time.time()
-        else:  # on button release
-            self.end = time.time()
-            delta_t = self.end - self.start
-            if delta_t < 0.5:  # if the press was shorter than half a second
-                # select the item or go into the menu currently on the display
-                self.handle_short_press()
-            elif delta_t < 2:  # longer than half a second but shorter than 2 seconds
-                self.handle_long_press()
+    def hold_times(self):
+        """ held past 0.5 s goes up a menu, past 2 s to the global or main menu (both on release), and past 5 s
+        straight to the power menu """
+        return ROTARY_HOLD_TIMES
+
+    def handle_press(self, event):
+        """ what a press of the knob does, once its press classifier has decided it """
+        if event.kind == PressClassifier.SHORT:
+            # select the item or go into the menu currently on the display
+            self.handle_short_press()
+        elif event.level == 1:
+            self.handle_long_press()
+        elif event.level == 2:
+            if self.menu.current_node is self.menu.root:
+                logger.info(self.menu.current_node.name + ": ? -> global menu")
+                self.change_menu_nodes(self.global_menu)  # if the currentmenu is mainmenu swap to 'Global'
             else:
-                if delta_t > 5:  # if button held for more than 5 seconds
-                    if self.menu.current_node is not self.power_menu:
-                        logger.info(self.menu.current_node.name + ": ? -> power menu")
-                        self.change_menu_nodes(self.power_menu)
-                elif self.menu.current_node is self.menu.root:  # if the button was pressed between 2 and 5 secs
-                    logger.info(self.menu.current_node.name + ": ? -> global menu")
-                    self.change_menu_nodes(self.global_menu)  # if the currentmenu is mainmenu swap to 'Global'
-                else:
-                    logger.info(self.menu.current_node.name + ": ? -> MidiController main menu")
-                    self.change_menu_nodes(self.menu.root)
-            self.is_pressed = False  # was released
+                logger.info(self.menu.current_node.name + ": ? -> MidiController main menu")
+                self.change_menu_nodes(self.menu.root)
+        elif self.menu.current_node is not self.power_menu:
+            logger.info(self.menu.current_node.name + ": ? -> power menu")
+            self.change_menu_nodes(self.power_menu)
 
     def handle_short_press(self):
         if self.menu.current_node is self.menu.root:
@@ -0,0 +1,212 @@
+# an ordered list of songs or parts, kept in a python list. each item sits in an Entry that knows its own position,
+# so going from an entry to its index and from an index to its entry is a lookup, and entry.next/entry.prev work like
+# the nodes of the doubly linked list it replaces. positions are numbered from 1 like DoublyLinkedList's.
+'''   ############ USAGE ###############
+songs = Sequence.Sequence()
+songs.append(song)
+entry = songs.index_to_node(3)  # entry.data is the song, entry.index is 3
+cursor = Sequence.Cursor(songs)
+cursor.step(1)  # False at the end of the sequence
+'''
+
+
+class Entry(object):
+    """ one item of a Sequence. index is its position from 1, sequence is None once it is removed """
+    __slots__ = ['data', '_index', 'sequence']
+
+    def __init__(self, data, index, sequence):
+        self.data = data
+        self._index = index
+        self.sequence = sequence
+
+    @property
+    def index(self):
+        # a splice only moves the entries from its splice point on, so an entry below the numbered part of the
+        # sequence still has its right index, one above it gets the rest of the sequence renumbered first
+        sequence = self.sequence
+        if sequence is not None and self._index > sequence.numbered:
+            sequence.renumber()
+        return self._index
+
+    @property
+    def next(self):
+        if self.sequence is None or self.index >= len(self.sequence.entries):
+            return None
+        return self.sequence.entries[self.index]
+
+    @property
+    def prev(self):
+        if self.sequence is None or self.index <= 1:
+            return None
+        return self.sequence.entries[self.index - 2]
+
+    def __repr__(self):
+        return "Entry(" + str(self.index) + ", " + repr(self.data) + ")"
+
+
+class Sequence(object):
+    """ the items in order. a splice is one list insert or delete, the entries after the splice point are only
+    renumbered when the index of one of them is asked for, so a run of splices renumbers once """
+
+    def __init__(self, items=None):
+        self.entries = []
+        self.numbered = 0  # entries[:numbered] have the right index
+        for data in items or []:
+            self.append(data)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    @property
+    def length(self):
+        return len(self.entries)
+
+    @property
+    def head(self):
+        return self.entries[0] if self.entries else None
+
+    @property
+    def tail(self):
+        return self.entries[-1] if self.entries else None
+
+    def append(self, data):
+        entry = Entry(data, len(self.entries) + 1, self)
+        if self.numbered == len(self.entries):
+            self.numbered += 1
+        self.entries.append(entry)
+        return entry
+
+    def prepend(self, data):
+        return self.insert(data, 0)
+
+    def insert(self, data, position):
+        """ put data before the item at index 'position' + 1, i.e. after the first 'position' items """
+        position = max(0, min(position, len(self.entries)))
+        entry = Entry(data, position + 1, self)
+        self.entries.insert(position, entry)
+        self.numbered = min(self.numbered, position)
+        return entry
+
+    def remove(self, data):
+        """ remove the first item equal to data. returns its entry, or None if there is none """
+        for entry in self.entries:
+            if entry.data == data:
+                return self.remove_entry(entry)
+        return None
+
+    def remove_entry(self, entry):
+        if entry.sequence is not self:
+            return None
+        index = entry.index
+        del self.entries[index - 1]
+        self.numbered = min(self.numbered, index - 1)
+        entry.sequence = None
+        return entry
+
+    def move(self, entry, index):
+        """ move entry to position index (from 1), the entries in between shift over by one """
+        if entry.sequence is not self:
+            return
+        index = max(1, min(index, len(self.entries)))
+        start = entry.index
+        del self.entries[start - 1]
+        self.entries.insert(index - 1, entry)
+        self.numbered = min(self.numbered, min(start, index) - 1)
+
+    def renumber(self):
+        entries = self.entries
+        for i in range(self.numbered, len(entries)):
+            entries[i]._index = i + 1
+        self.numbered = len(entries)
+
+    def index_to_node(self, index):
+        """ the entry at index, from 1. an index past either end gives the first or last entry, like the linked list
+        walk did """
+        if not self.entries:
+            return None
+        return self.entries[max(1, min(index, len(self.entries))) - 1]
+
+    def node_to_index(self, entry):
+        return entry.index if entry is not None and entry.sequence is self else None
+
+    def find(self, match):
+        """ the first entry whose data match(data) is true for, or None """
+        for entry in self.entries:
+            if match(entry.data):
+                return entry
+        return None
+
+    def to_list(self):
+        return [entry.data for entry in self.entries]
+
+    def show(self):
+        return "\n".join(str(entry.data) for entry in self.entries)
+
+    def get_length(self):
+        return len(self.entries)
+
+    def get_head(self):
+        return self.head
+
+    def get_tail(self):
+        return self.tail
+
+
+class Cursor(object):
+    """ a position in a Sequence. it holds the entry, not the index, so it stays on its item when other items are
+    spliced in or out before it. if its own item is removed it moves to whatever took its place """
+
+    def __init__(self, sequence, entry=None):
+        self.sequence = sequence
+        self._entry = entry if entry is not None else sequence.head
+        self._index = self._entry.index if self._entry is not None else 0
+
+    @property
+    def node(self):
+        entry = self._entry
+        if entry is None:
+            return None
+        if entry.sequence is not self.sequence:
+            entry = self.sequence.index_to_node(self._index)  # removed, None if the sequence is empty now
+            self._entry = entry
+        if entry is not None:
+            self._index = entry.index
+        return entry
+
+    @property
+    def data(self):
+        entry = self.node
+        return entry.data if entry is not None else None
+
+    @property
+    def index(self):
+        entry = self.node
+        return entry.index if entry is not None else None
+
+    def at(self, entry):
+        """ move to entry (of this sequence) """
+        self._entry = entry
+        self._index = entry.index if entry is not None else 0
+
+    def seek(self, index):
+        """ move to index (from 1). returns False, without moving, if there is nothing there """
+        if not 1 <= index <= len(self.sequence):
+            return False
+        self.at(self.sequence.entries[index - 1])
+        return True
+
+    def step(self, offset):
+        """ move by offset. returns False, without moving, if that is past either end """
+        entry = self.node
+        return entry is not None and self.seek(entry.index + offset)
+
+    def at_start(self):
+        entry = self.node
+        return entry is None or entry.index == 1
+
+    def at_end(self):
+        entry = self.node
+        return entry is None or entry.index == len(self.sequence)
@@ -0,0 +1 @@
+from Sequence import *
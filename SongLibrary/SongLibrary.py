@@ -0,0 +1,261 @@
+# an index over every song and set file: the name, tempo, parts and pedals of each song, and which sets each song is
+# in. it is kept in a file next to the compiled cache, so opening it only has to stat the song and set files, and
+# only files that changed since are read again. lookups by name, set or pedal are dictionary lookups, the name lists
+# for the menus are kept sorted.
+import bisect
+import os
+import threading
+
+import EventLog
+import PartSongSet
+import PickleFile
+
+'''   ############ USAGE ###############
+library = SongLibrary.SongLibrary(song_folder, set_folder, cache=PartSongSet.compiled_cache)
+library.refresh()  # stats every file, reads the ones that changed
+library.sets_with_song("Victory - Lead")
+library.songs_with_pedal("TimeLine")
+'''
+logger = EventLog.get_logger(__name__)
+
+INDEX_FILE = "/home/pi/MidiController/PartSongSet/.cache/library.pickle"
+INDEX_VERSION = 1
+# the index is thrown away when its layout, song_info or the song and set compiler changes
+INDEX_KEY = (INDEX_VERSION, PickleFile.source_digest(__name__, PartSongSet.compile_song.__module__))
+SONG = "song"
+SET = "set"
+
+
+def song_info(name, compiled):
+    """ what the index keeps of a song, from its compile_song form. 'pedals' are the pedals engaged in at least one
+    part """
+    tempo, parts = compiled
+    pedals = set()
+    for part_name, morph, part_pedals in parts:
+        pedals.update(pedal_name for pedal_name, engaged, preset, params, settings in part_pedals if engaged)
+    return {'kind': SONG, 'name': name, 'tempo': tempo, 'parts': [part[0] for part in parts],
+            'pedals': sorted(pedals)}
+
+
+def set_info(name, compiled):
+    """ what the index keeps of a set, from its compile_setlist form. name is the file name the menus use, title
+    the name in the file """
+    title, songs = compiled
+    return {'kind': SET, 'name': name, 'title': title, 'songs': list(songs)}
+
+
+def insort_unique(names, name):
+    i = bisect.bisect_left(names, name)
+    if i == len(names) or names[i] != name:
+        names.insert(i, name)
+
+
+def remove_sorted(names, name):
+    i = bisect.bisect_left(names, name)
+    if i < len(names) and names[i] == name:
+        del names[i]
+
+
+class SongLibrary(object):
+    """ the index of a song folder and a set folder. every file is indexed by path with the mtime and size it had
+    when it was read. refresh brings the whole index up to date, update_file one file of it """
+
+    def __init__(self, song_folder, set_folder, index_path=INDEX_FILE, cache=None):
+        self.folders = [(SONG, os.path.join(song_folder, "")), (SET, os.path.join(set_folder, ""))]
+        self.index_path = index_path
+        self.cache = cache  # a PartSongSet.CompiledCache to read the files through, or None to parse them
+        self.files = {}  # {path: (mtime, size, info)}
+        self.songs = {}  # {song name: info}
+        self.sets = {}  # {set name: info}
+        self.sets_by_song = {}  # {song name: set of set names}
+        self.songs_by_pedal = {}  # {pedal name: set of song names}
+        self.song_names = []  # sorted
+        self.set_names = []  # sorted
+        self.folder_mtimes = {}
+        self.lock = threading.RLock()
+        # one refresh or index write at a time: the startup refresh, the set menu, the api and the file watcher
+        self.refresh_lock = threading.RLock()
+        self.read_index()
+
+    def read_index(self):
+        cached = PickleFile.read(self.index_path)
+        version, files = cached if isinstance(cached, tuple) and len(cached) == 2 else (None, None)
+        if version != INDEX_KEY or not isinstance(files, dict):
+            return
+        with self.lock:
+            for path, entry in files.items():
+                self.files[path] = entry
+                self.add(entry[2])
+
+    def write_index(self):
+        with self.refresh_lock:
+            with self.lock:
+                files = dict(self.files)
+            PickleFile.write(self.index_path, (INDEX_KEY, files), "the library index")
+
+    def kind_of(self, path):
+        for kind, folder in self.folders:
+            if os.path.dirname(path) == os.path.dirname(folder) and path.endswith(".yaml"):
+                return kind
+        return None
+
+    def read_file(self, kind, path):
+        name = os.path.basename(path)[:-5]
+        compile_func = PartSongSet.compile_song if kind == SONG else PartSongSet.compile_setlist
+        if self.cache is not None:
+            compiled = self.cache.get(path, compile_func)
+        else:
+            with open(path, 'rb') as yaml_file:
+                compiled = compile_func(yaml_file.read())
+        return song_info(name, compiled) if kind == SONG else set_info(name, compiled)
+
+    def add(self, info):
+        name = info['name']
+        if info['kind'] == SONG:
+            self.songs[name] = info
+            insort_unique(self.song_names, name)
+            for pedal_name in info['pedals']:
+                self.songs_by_pedal.setdefault(pedal_name, set()).add(name)
+        else:
+            self.sets[name] = info
+            insort_unique(self.set_names, name)
+            for song_name in info['songs']:
+                self.sets_by_song.setdefault(song_name, set()).add(name)
+
+    def discard(self, info):
+        name = info['name']
+        if info['kind'] == SONG:
+            self.songs.pop(name, None)
+            remove_sorted(self.song_names, name)
+            for pedal_name in info['pedals']:
+                self.songs_by_pedal.get(pedal_name, set()).discard(name)
+        else:
+            self.sets.pop(name, None)
+            remove_sorted(self.set_names, name)
+            for song_name in info['songs']:
+                self.sets_by_song.get(song_name, set()).discard(name)
+
+    def update_file(self, path, stat=None):
+        """ index the file at path again if it changed, or take it out if it is gone. returns True if the index
+        changed. the file is read without the lock held, lookups go on meanwhile """
+        kind = self.kind_of(path)
+        if kind is None:
+            return False
+        try:
+            stat = stat or os.stat(path)
+        except OSError:
+            stat = None
+        with self.lock:
+            entry = self.files.get(path, None)
+            if stat is None:
+                if entry is None:
+                    return False
+                self.discard(entry[2])
+                del self.files[path]
+                return True
+        if entry is not None and entry[0] == stat.st_mtime and entry[1] == stat.st_size:
+            return False
+        try:
+            info = self.read_file(kind, path)
+        except Exception as e:
+            logger.warning("Cant index " + path + ": " + str(e))
+            return False
+        with self.lock:
+            entry = self.files.get(path, None)
+            if entry is not None:
+                self.discard(entry[2])
+            self.files[path] = (stat.st_mtime, stat.st_size, info)
+            self.add(info)
+        return True
+
+    def refresh(self, kinds=(SONG, SET), wait=True):
+        """ stat every song and set file (or only those of kinds), read the ones that are new or changed and drop the
+        ones that are gone. returns how many files changed. a refresh that is asked for while another one runs waits
+        for it, then only has the files left that changed since. without wait it leaves them to the one running """
+        if not self.refresh_lock.acquire(wait):
+            return 0
+        try:
+            changed = 0
+            seen = set()
+            for kind, folder in self.folders:
+                if kind not in kinds:
+                    continue
+                try:
+                    file_names = os.listdir(folder)
+                    folder_mtime = os.stat(folder).st_mtime
+                except OSError as e:
+                    logger.warning("Cant index " + folder + ": " + str(e))
+                    continue
+                with self.lock:
+                    self.folder_mtimes[folder] = folder_mtime
+                for file_name in file_names:
+                    if file_name[-5:] == ".yaml":
+                        path = folder + file_name
+                        seen.add(path)
+                        changed += self.update_file(path)
+            with self.lock:
+                gone = [path for path in self.files if path not in seen and self.kind_of(path) in kinds]
+            for path in gone:
+                changed += self.update_file(path)
+            if changed:
+                logger.info("Library index: " + str(changed) + " files changed, " + str(len(self.song_names)) +
+                            " songs, " + str(len(self.set_names)) + " sets.")
+                if self.cache is not None:
+                    self.cache.save()
+                self.write_index()
+            return changed
+        finally:
+            self.refresh_lock.release()
+
+    def refresh_if_changed(self, kinds=(SONG, SET), wait=True):
+        """ refresh the folders of kinds that a file was added to or removed from, that changes the mtime of the
+        folder. edits of files that are already there are picked up by refresh or update_file """
+        changed_kinds = []
+        for kind, folder in self.folders:
+            try:
+                folder_mtime = os.stat(folder).st_mtime
+            except OSError:
+                continue
+            with self.lock:
+                if kind in kinds and folder_mtime != self.folder_mtimes.get(folder, None):
+                    changed_kinds.append(kind)
+        return self.refresh(changed_kinds, wait) if changed_kinds else 0
+
+    def refresh_in_background(self):
+        """ refresh on a thread of its own, e.g. at startup, where an empty or lost compiled cache means every song
+        file is read. until it is done the index is the one read from the index file """
+        refresh_thread = threading.Thread(target=self.refresh, name="Song-Library-Refresh-Thread")
+        refresh_thread.daemon = True
+        refresh_thread.start()
+        return refresh_thread
+
+    def get_set_names(self):
+        with self.lock:
+            return list(self.set_names)
+
+    def get_song_names(self):
+        with self.lock:
+            return list(self.song_names)
+
+    def song(self, name):
+        return self.songs.get(name, None)
+
+    def setlist(self, name):
+        return self.sets.get(name, None)
+
+    def sets_with_song(self, name):
+        with self.lock:
+            return sorted(self.sets_by_song.get(name, ()))
+
+    def songs_with_pedal(self, pedal_name):
+        with self.lock:
+            return sorted(self.songs_by_pedal.get(pedal_name, ()))
+
+    def pedals(self):
+        with self.lock:
+            return sorted(pedal_name for pedal_name, songs in self.songs_by_pedal.items() if songs)
+
+    def stats(self):
+        with self.lock:
+            return {'files': len(self.files), 'songs': len(self.song_names), 'sets': len(self.set_names),
+                    'pedals': len(self.pedals())}
@@ -0,0 +1 @@
+from SongLibrary import *